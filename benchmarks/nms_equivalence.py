@@ -0,0 +1,119 @@
+import timeit
+import numpy as np
+
+from mrcnn.box_utils import compute_overlaps, non_max_suppression, non_max_suppression_xywh
+
+""" equivalence and speed of the vectorized box utilities (models/mrcnn/box_utils.py) against the previous loop
+implementations of models/mrcnn/utils.py (copied below as reference_*) and the previous YOLO post-processing of
+models/detect_objects.py (cv2.dnn.NMSBoxes + membership test), on random boxes with overlapping clusters """
+
+# random boxes per set (Mask R-CNN keeps up to 100 detections, YOLO detections of a frame are far fewer)
+NUM_BOXES = 300
+NUM_TRIALS = 20
+
+
+def reference_compute_iou(box, boxes, box_area, boxes_area):
+    """ previous mrcnn.utils.compute_iou """
+    y1 = np.maximum(box[0], boxes[:, 0])
+    y2 = np.minimum(box[2], boxes[:, 2])
+    x1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    union = box_area + boxes_area[:] - intersection[:]
+    iou = intersection / union
+    return iou
+
+
+def reference_compute_overlaps(boxes1, boxes2):
+    """ previous mrcnn.utils.compute_overlaps (loop over boxes2) """
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    overlaps = np.zeros((boxes1.shape[0], boxes2.shape[0]))
+    for i in range(overlaps.shape[1]):
+        box2 = boxes2[i]
+        overlaps[:, i] = reference_compute_iou(box2, boxes1, area2[i], area1)
+    return overlaps
+
+
+def reference_non_max_suppression(boxes, scores, threshold):
+    """ previous mrcnn.utils.non_max_suppression (while loop with np.delete) """
+    assert boxes.shape[0] > 0
+    if boxes.dtype.kind != "f":
+        boxes = boxes.astype(np.float32)
+    y1 = boxes[:, 0]
+    x1 = boxes[:, 1]
+    y2 = boxes[:, 2]
+    x2 = boxes[:, 3]
+    area = (y2 - y1) * (x2 - x1)
+    ixs = scores.argsort()[::-1]
+    pick = []
+    while len(ixs) > 0:
+        i = ixs[0]
+        pick.append(i)
+        iou = reference_compute_iou(boxes[i], boxes[ixs[1:]], area[i], area[ixs[1:]])
+        remove_ixs = np.where(iou > threshold)[0] + 1
+        ixs = np.delete(ixs, remove_ixs)
+        ixs = np.delete(ixs, 0)
+    return np.array(pick, dtype=np.int32)
+
+
+def reference_yolo_nms(boxes, confidences):
+    """ previous YOLO post-processing of detect_objects.get_object_location: indices kept by cv2.dnn.NMSBoxes in detection order """
+    import cv2
+    indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
+    return [i for i in range(len(boxes)) if i in indexes]
+
+
+def random_boxes(rng, num_boxes, dtype=np.float32):
+    """ [num_boxes, (y1, x1, y2, x2)] boxes in clusters (so NMS suppresses some) and scores """
+
+    centers = rng.rand(max(1, num_boxes // 10), 2) * 600
+    yx = centers[rng.randint(len(centers), size=num_boxes)] + rng.randn(num_boxes, 2) * 10
+    hw = rng.rand(num_boxes, 2) * 80 + 10
+    boxes = np.concatenate([yx, yx + hw], axis=1).astype(dtype)
+    return boxes, rng.rand(num_boxes).astype(np.float32)
+
+
+def check_equivalence(seed=0):
+    """ compare outputs on random inputs, returns {check name: True if identical on all trials} """
+
+    rng = np.random.RandomState(seed)
+    checks = {'compute_overlaps': True, 'compute_overlaps_int': True, 'non_max_suppression': True,
+              'non_max_suppression_int': True, 'yolo_nms_numpy_vs_opencv': True}
+    for _ in range(NUM_TRIALS):
+        for suffix, dtype in (('', np.float32), ('_int', np.int32)):
+            boxes1, scores = random_boxes(rng, NUM_BOXES, dtype)
+            boxes2, _ = random_boxes(rng, NUM_BOXES // 3, dtype)
+            for threshold in (0.3, 0.5, 0.7):
+                if not np.array_equal(non_max_suppression(boxes1, scores, threshold), reference_non_max_suppression(boxes1, scores, threshold)):
+                    checks['non_max_suppression' + suffix] = False
+            if not np.array_equal(compute_overlaps(boxes1, boxes2), reference_compute_overlaps(boxes1, boxes2)):
+                checks['compute_overlaps' + suffix] = False
+
+        # YOLO boxes (x, y, w, h) with confidences above threshold
+        boxes, confidences = random_boxes(rng, 30, np.float64)
+        xywh = [[float(x1), float(y1), float(x2 - x1), float(y2 - y1)] for y1, x1, y2, x2 in boxes]
+        confidences = [float(confidence) * 0.2 + 0.8 for confidence in confidences]
+        kept = sorted(non_max_suppression_xywh(xywh, confidences, iou_threshold=0.4, score_threshold=0.5).tolist())
+        if kept != reference_yolo_nms(xywh, confidences):
+            checks['yolo_nms_numpy_vs_opencv'] = False
+    return checks
+
+
+def time_box_utils(number=20):
+    """ time per call (sec) of reference and vectorized implementations """
+
+    rng = np.random.RandomState(1)
+    boxes1, scores = random_boxes(rng, NUM_BOXES)
+    boxes2, _ = random_boxes(rng, NUM_BOXES // 3)
+
+    def best(fn):
+        return min(timeit.repeat(fn, repeat=3, number=number)) / number
+
+    return {
+        'nms_reference': best(lambda: reference_non_max_suppression(boxes1, scores, 0.5)),
+        'nms_numpy': best(lambda: non_max_suppression(boxes1, scores, 0.5)),
+        'nms_opencv': best(lambda: non_max_suppression(boxes1, scores, 0.5, backend='opencv')),
+        'compute_overlaps_reference': best(lambda: reference_compute_overlaps(boxes1, boxes2)),
+        'compute_overlaps': best(lambda: compute_overlaps(boxes1, boxes2)),
+    }
@@ -0,0 +1,393 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+import types
+import cv2
+import numpy as np
+from scipy.io import savemat
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.append(os.path.join(BENCHMARK_DIR, '..', 'models'))
+
+# benchmarks run offline: stand-in for sensitive_info of the sensitive information folder (imported by utils), the
+# Blue Iris IP is only used to map video paths of network drives, which synthetic videos don't have
+offline_sensitive_info = types.ModuleType('sensitive_info')
+offline_sensitive_info.BLUE_IRIS_COMPUTER_IP = '0.0.0.0'
+sys.modules.setdefault('sensitive_info', offline_sensitive_info)
+
+from training_module_analysis import TrainingModuleAnalysis
+from paths import folder_paths, led_issue_info
+from models.led_tracker import led_status_check
+from dlclive.pose import argmax_pose_predict
+from synthetic_video import generate_video, generate_trial_csv, draw_timestamp
+from models.backends import BACKEND_PROFILES, load_backends
+from frame_source import open_frame_source
+from models.stub_backends import LED_POSITION, TM_POSITION, StubTimestampOCR
+from roi_transform import RoiTransform, ROI_SIZE
+from utils import resize_cropped_frame
+from nms_equivalence import check_equivalence, time_box_utils
+
+""" Reproducible benchmark suite for the training module pipeline. Runs offline on a CPU-only machine:
+synthetic videos are generated and all models are replaced by stub backends (see models/backends.py).
+
+1. end-to-end: TrainingModuleAnalysis on a synthetic video in LED mode and in trial-file mode,
+   with per-stage timings from the instrumentation layer
+2. micro: led_status_check, TimestampOCR.process_frame, parse_timestamp, Tesseract OCR (TimestampOCR.run_inference
+   on rendered RevoTech-style timestamp strips, with the fraction of correctly read timestamps), argmax_pose_predict,
+   savemat, TM ROI crop/pad/resize (copyMakeBorder + resize and RoiTransform) and frame decoding (read at
+   native/analysis resolution, grab) in isolation
+3. box utilities: vectorized NMS/IoU (models/mrcnn/box_utils.py) timed and checked for identical results
+   against the previous loop implementations (see nms_equivalence.py)
+
+Tesseract runs offline, but needs the OCR model (--ocr_model_path, default: modelinfo['ocr'] of paths.py) or another
+traineddata (--ocr_lang, ex. eng with the default tessdata path); without it the Tesseract benchmark is skipped.
+
+Results are compared against a stored baseline (benchmarks/baseline.json) to catch regressions. The baseline is
+machine specific: the first run on a machine without a baseline records it, re-record it on the reference machine
+with --save_baseline.
+
+Example of running Python script (from repository root):
+python benchmarks/run_benchmarks.py --profile stub
+python benchmarks/run_benchmarks.py --profile stub --save_baseline """
+
+# rig numbers used for synthetic videos (LED mode rig must not be in led_issue_info['rig_led_issues'])
+LED_MODE_RIG = 1
+TRIAL_FILE_MODE_RIG = 6
+
+VIDEO_START_DATETIME = datetime.datetime(2022, 3, 10, 12, 0, 0)
+
+# LED mode sparse scan step (frames)
+LED_SCAN_STEP = 5
+
+# backend profiles without real models
+STUB_PROFILES = ['stub', 'stub_cpu']
+
+# number of rendered timestamp strips (consecutive seconds) Tesseract is timed on
+OCR_NUM_TIMESTAMPS = 20
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Benchmark suite with synthetic homecage videos and stub models",
+        epilog="python benchmarks/run_benchmarks.py --profile stub"
+    )
+    parser.add_argument("--profile", '-p', required=False, default='stub', choices=STUB_PROFILES, help='stub backend profile (models/backends.py).')
+    parser.add_argument("--duration", '-d', type=int, required=False, default=120, help='duration (sec) of synthetic videos.')
+    parser.add_argument("--resolution", '-r', nargs=2, type=int, required=False, default=[1280, 720], help='width height of synthetic videos.')
+    parser.add_argument("--work_dir", '-wd', required=False, default=None, help='folder for synthetic videos and outputs (default: temp folder).')
+    parser.add_argument("--baseline", '-b', required=False, default=os.path.join(BENCHMARK_DIR, 'baseline.json'), help='path to baseline results.')
+    parser.add_argument("--save_baseline", '-sb', action='store_true', help='save results as new baseline.')
+    parser.add_argument("--output", '-o', required=False, default=None, help='path to save results as JSON.')
+    parser.add_argument("--tolerance", '-t', type=float, required=False, default=0.2, help='relative slowdown flagged as regression.')
+    parser.add_argument("--ocr_model_path", '-omp', required=False, default=None, help='folder of Tesseract traineddata (default: modelinfo[\'ocr\']).')
+    parser.add_argument("--ocr_lang", '-ol', required=False, default='ts_fast', help='Tesseract traineddata name in ocr_model_path.')
+    parser.add_argument("--verbose", '-v', action='store_true', help='show output of the analysis pipeline.')
+    return parser.parse_args()
+
+
+def time_call(fn, number):
+    """ best time (sec) per call of fn over 5 repeats """
+    return min(timeit.repeat(fn, repeat=5, number=number)) / number
+
+
+def run_end_to_end(video_path, profile, verbose=False, **analysis_kwargs):
+    """ run TrainingModuleAnalysis on video with stub models, returns timings
+    analysis_kwargs are passed to TrainingModuleAnalysis (ex. trial_file_seek) """
+
+    # stub OCR reads timestamps from the barcode of the synthetic videos
+    backend_profile = {role: dict(options) for role, options in BACKEND_PROFILES[profile].items()}
+    backend_profile['ocr']['timestamp_source'] = 'barcode'
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        backends = load_backends(profile=backend_profile, camera_view='TM')
+
+    va_object = TrainingModuleAnalysis(video_path=video_path, mouseposemodels=backends['mouse_pose'], ocr=backends['ocr'],
+                                       mousecoatrecognition=backends['coat_classification'],
+                                       tmdetectionmodel=backends['tm_detection'], leddetectionmodel=backends['led_detection'],
+                                       **analysis_kwargs)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        va_object.run()
+
+    record = va_object.get_metrics_record()
+    frames = record['frames_processed']
+    return {
+        'elapsed_sec': round(record['elapsed_sec'], 4),
+        'frames': frames,
+        'fps': round(frames / record['elapsed_sec'], 2),
+        'trials_saved': sum(1 for trial in record['trials'] if trial.get('status') == 'saved'),
+        'trial_windows': [[trial['first_frame_idx'], trial['num_frames']] for trial in record['trials'] if trial.get('status') == 'saved'],
+        'stages_ms_per_call': {name: round(stage['time_sec'] / stage['calls'] * 1000, 4) for name, stage in record['stages'].items()},
+        'stages_total_sec': {name: round(stage['time_sec'], 4) for name, stage in record['stages'].items()},
+        'counters': record['counters'],
+    }
+
+
+def time_decode(video_path, method, backend='opencv', output_size=(640, 360)):
+    """ time (sec) per frame of decoding whole video with FrameSource.read or FrameSource.grab """
+
+    def decode_video():
+        source = open_frame_source(video_path, backend=backend, output_size=output_size)
+        step = source.read if method == 'read' else source.grab
+        while True:
+            ret = step()
+            if not (ret[0] if method == 'read' else ret):
+                break
+        frame_count = source.position
+        source.release()
+        return frame_count
+
+    frame_count = decode_video()
+    return min(timeit.repeat(decode_video, repeat=3, number=1)) / frame_count
+
+
+def load_tesseract_ocr(model_path, lang):
+    """ real TimestampOCR (Tesseract) with traineddata [lang] in [model_path] (modelinfo['ocr'] if None)
+    returns None if tesserocr or the traineddata is not available """
+
+    try:
+        from models.timestamp_ocr import TimestampOCR
+        if model_path is None:
+            from chenlabpylib import chenlab_filepaths
+            from paths import modelinfo
+            model_path = chenlab_filepaths(path=modelinfo['ocr'])
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return TimestampOCR(camera_view='TM', model_path=model_path, lang=lang)
+    except (ImportError, RuntimeError) as error:
+        print("Warning: Tesseract OCR benchmark skipped ({})".format(error))
+        return None
+
+
+def time_tesseract_ocr(ocr, resolution):
+    """ time (sec) per call of TimestampOCR.run_inference on rendered RevoTech-style timestamp strips of consecutive
+    seconds (every call runs Tesseract), returns time and fraction of correctly read timestamps """
+
+    timestamps = [VIDEO_START_DATETIME + datetime.timedelta(seconds=i) for i in range(OCR_NUM_TIMESTAMPS)]
+    frames = []
+    for timestamp in timestamps:
+        frame = draw_timestamp(np.full((resolution[1], resolution[0], 3), 64, dtype=np.uint8), timestamp)
+        frames.append(cv2.cvtColor(cv2.resize(frame, (640, 360)), cv2.COLOR_BGR2RGB))
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        correct = sum(int(ocr.run_inference(frame) == timestamp) for frame, timestamp in zip(frames, timestamps))
+
+    def ocr_run_inference():
+        for frame in frames:
+            ocr.run_inference(frame)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        time_per_call = min(timeit.repeat(ocr_run_inference, repeat=3, number=1)) / len(frames)
+    return time_per_call, correct / len(frames)
+
+
+def run_micro(video_path, tesseract_ocr=None, resolution=(1280, 720)):
+    """ time pipeline pieces in isolation, returns time per call in microseconds
+    Tesseract OCR is timed if [tesseract_ocr] (TimestampOCR) is given, returns fraction of correctly read timestamps
+    (None if not timed) """
+
+    # use a decoded frame with LED on from the synthetic video
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 60)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        raise IOError('Unable to read frame from {}'.format(video_path))
+    rgbframe = cv2.cvtColor(cv2.resize(frame, (640, 360)), cv2.COLOR_BGR2RGB)
+    rgbframe_next = rgbframe.copy()
+    rgbframe_next[-10:, -100:] = 255 - rgbframe_next[-10:, -100:]  # change timestamp region
+
+    ocr = StubTimestampOCR(camera_view='TM', timestamp_source='barcode')
+    frames = [rgbframe, rgbframe_next]
+    counter = {'i': 0}
+
+    def ocr_process_frame():
+        counter['i'] += 1
+        ocr.process_frame(frame=frames[counter['i'] % 2])
+
+    # DLC output for a 400x300 frame (stride 8, 12 body parts)
+    rng = np.random.RandomState(0)
+    scmap = rng.rand(38, 50, 12).astype(np.float32)
+    locref = rng.randn(38, 50, 12, 2).astype(np.float32)
+
+    # typical trial (4 sec at 10 fps)
+    trial_data = {
+        'raw_data': os.path.basename(video_path), 'training_module_id': 1, 'camera_view': 'TM', 'resolution': (1280, 720),
+        'fps': 10, 'dlcdata': rng.rand(40, 12, 3), 'dlc_processed': 1, 'marker_list': ['bodypart{}'.format(i) for i in range(12)],
+        'tm_markers': rng.rand(9, 3), 'led_position': LED_POSITION, 'edge_case': 0, 'frame_indices': list(range(40)),
+        'trial_datetime': '03/10/2022, 12:00:05', 'mousecoatcolor': {'prediction': 'black', 'confidence': 0.99},
+        'dlc_model_path': 'model', 'timestamp_offset_list': [i // 10 for i in range(40)],
+    }
+    mat_filepath = os.path.join(os.path.dirname(video_path), 'benchmark_trial.mat')
+
+    # TM ROI of stub TM position: padded crop + resize (previous get_tm_roi) and precomputed remap into a buffer
+    padding = resize_cropped_frame(position=TM_POSITION, max_width=640, max_height=360, aspect_ratio=ROI_SIZE[0]/ROI_SIZE[1])
+    roi_transform = RoiTransform(position=TM_POSITION, padding=padding, frame_shape=rgbframe.shape)
+    roi_buffer = np.empty((ROI_SIZE[1], ROI_SIZE[0], 3), dtype=np.uint8)
+
+    def tm_roi_reference():
+        x, y, w, h = TM_POSITION
+        x, y, w, h = int(x*640), int(y*360), int(w*640), int(h*360)
+        roi = rgbframe[y:y+h, x:x+w]
+        if padding[0] == 'y':
+            roi = cv2.copyMakeBorder(roi, padding[1], 0, 0, 0, cv2.BORDER_CONSTANT)
+        else:
+            roi = cv2.copyMakeBorder(roi, 0, 0, 0, padding[1], cv2.BORDER_CONSTANT)
+        return cv2.resize(roi, ROI_SIZE)
+
+    micro = {
+        'process_frame': time_call(lambda: cv2.cvtColor(cv2.resize(frame, (640, 360)), cv2.COLOR_BGR2RGB), 200),
+        'led_status_check': time_call(lambda: led_status_check(frame=rgbframe.copy(), led_position=LED_POSITION), 500),
+        'ocr_process_frame': time_call(ocr_process_frame, 500),
+        'parse_timestamp': time_call(lambda: ocr.parse_timestamp("03/10/2022 12:00:05"), 2000),
+        'argmax_pose_predict': time_call(lambda: argmax_pose_predict(scmap, locref, 8), 500),
+        'savemat': time_call(lambda: savemat(mat_filepath, trial_data), 50),
+        'tm_roi_reference': time_call(tm_roi_reference, 1000),
+        'tm_roi_transform': time_call(lambda: roi_transform.apply(rgbframe, out=roi_buffer), 1000),
+        'decode_read_native': time_decode(video_path, 'read', output_size=None),
+        'decode_read_scaled': time_decode(video_path, 'read'),
+        'decode_grab': time_decode(video_path, 'grab'),
+    }
+    micro.update(time_box_utils())
+
+    ocr_accuracy = None
+    if tesseract_ocr is not None:
+        micro['tesseract_ocr'], ocr_accuracy = time_tesseract_ocr(tesseract_ocr, resolution)
+    return {name: round(value * 1e6, 3) for name, value in micro.items()}, ocr_accuracy
+
+
+def flatten_results(results):
+    """ flatten results to {metric name: (value, higher_is_better)} for baseline comparison """
+
+    flat = {}
+    for mode, end_to_end in results['end_to_end'].items():
+        flat['end_to_end.{}.fps'.format(mode)] = (end_to_end['fps'], True)
+        for stage, value in end_to_end['stages_ms_per_call'].items():
+            flat['end_to_end.{}.{}_ms'.format(mode, stage)] = (value, False)
+    for name, value in results['micro'].items():
+        flat['micro.{}_us'.format(name)] = (value, False)
+    return flat
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """ print comparison table against baseline, returns number of regressions """
+
+    current, previous = flatten_results(results), flatten_results(baseline)
+    regressions = 0
+
+    print("\n{:<55} {:>12} {:>12} {:>9}".format('metric', 'baseline', 'current', 'change'))
+    for name, (value, higher_is_better) in current.items():
+        if name not in previous or not previous[name][0]:
+            print("{:<55} {:>12} {:>12} {:>9}".format(name, '-', value, 'new'))
+            continue
+        base_value = previous[name][0]
+        change = (value - base_value) / base_value
+        slowdown = -change if higher_is_better else change
+        flag = ' REGRESSION' if slowdown > tolerance else ''
+        regressions += int(bool(flag))
+        print("{:<55} {:>12} {:>12} {:>+8.1f}%{}".format(name, base_value, value, change * 100, flag))
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    args = get_args()
+
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix='hva_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    # redirect outputs of analysis to work folder
+    folder_paths['matfiletm'] = os.path.join(work_dir, 'matfiles')
+    folder_paths['errortm'] = os.path.join(work_dir, 'errors')
+    folder_paths['stageresultstm'] = os.path.join(work_dir, 'stageresults')
+    folder_paths['hdf5tm'] = os.path.join(work_dir, 'hdf5')
+    folder_paths['roicalibrationtm'] = os.path.join(work_dir, 'roicalibration')
+    os.makedirs(folder_paths['matfiletm'], exist_ok=True)
+    os.makedirs(folder_paths['errortm'], exist_ok=True)
+
+    results = {
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'settings': {'profile': args.profile, 'duration': args.duration, 'resolution': args.resolution},
+        'end_to_end': {},
+    }
+
+    # LED mode
+    print("Generating synthetic videos in", work_dir)
+    led_video_path, trials = generate_video(work_dir, rig_no=LED_MODE_RIG, start_datetime=VIDEO_START_DATETIME,
+                                            duration_sec=args.duration, resolution=tuple(args.resolution))
+    print("Running end-to-end benchmark (LED mode) ...")
+    results['end_to_end']['led'] = run_end_to_end(led_video_path, args.profile, verbose=args.verbose)
+    print("Running end-to-end benchmark (LED mode, sparse scan) ...")
+    results['end_to_end']['led_sparse'] = run_end_to_end(led_video_path, args.profile, verbose=args.verbose, led_scan_step=LED_SCAN_STEP)
+    if results['end_to_end']['led']['trial_windows'] != results['end_to_end']['led_sparse']['trial_windows']:
+        print("Warning: trial windows of sparse LED scan differ from full scan")
+    print("Running end-to-end benchmark (LED mode, DLC stage only) ...")
+    results['end_to_end']['led_dlc_stage'] = run_end_to_end(led_video_path, args.profile, verbose=args.verbose, stages='dlc')
+    if results['end_to_end']['led']['trial_windows'] != results['end_to_end']['led_dlc_stage']['trial_windows']:
+        print("Warning: trial windows of DLC stage differ from full analysis")
+
+    # trial-file mode
+    trial_video_path, trials = generate_video(work_dir, rig_no=TRIAL_FILE_MODE_RIG, start_datetime=VIDEO_START_DATETIME,
+                                              duration_sec=args.duration, resolution=tuple(args.resolution))
+    csv_path = generate_trial_csv(os.path.join(work_dir, 'tm_{}_trial_dt.csv'.format(TRIAL_FILE_MODE_RIG)), VIDEO_START_DATETIME, trials)
+    led_issue_info['led_issue_csv_paths'][TRIAL_FILE_MODE_RIG] = csv_path
+    print("Running end-to-end benchmark (trial-file mode, seek) ...")
+    results['end_to_end']['trial_file'] = run_end_to_end(trial_video_path, args.profile, verbose=args.verbose)
+    print("Running end-to-end benchmark (trial-file mode, full scan) ...")
+    results['end_to_end']['trial_file_full'] = run_end_to_end(trial_video_path, args.profile, verbose=args.verbose, trial_file_seek=False)
+    if results['end_to_end']['trial_file']['trial_windows'] != results['end_to_end']['trial_file_full']['trial_windows']:
+        print("Warning: trial windows of seek mode differ from full scan")
+
+    print("Running micro benchmarks ...")
+    tesseract_ocr = load_tesseract_ocr(args.ocr_model_path, args.ocr_lang)
+    results['micro'], results['ocr_accuracy'] = run_micro(led_video_path, tesseract_ocr=tesseract_ocr, resolution=tuple(args.resolution))
+    if results['ocr_accuracy'] is not None and results['ocr_accuracy'] < 1:
+        print("Warning: Tesseract read {:.0%} of rendered timestamps correctly".format(results['ocr_accuracy']))
+
+    print("Checking equivalence of box utilities ...")
+    results['equivalence'] = check_equivalence()
+    for name, identical in results['equivalence'].items():
+        if not identical:
+            print("Warning: {} results differ from previous implementation".format(name))
+
+    print(json.dumps(results, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
+        print("{} created.".format(args.output))
+
+    # vectorized NMS/IoU must reproduce the previous implementation exactly (the OpenCV NMS backend is only reported)
+    exit_code = int(not all(identical for name, identical in results['equivalence'].items() if 'opencv' not in name))
+    if args.save_baseline or not os.path.isfile(args.baseline):
+        with open(args.baseline, 'w') as fp:
+            json.dump(results, fp, indent=4)
+        print("Saved baseline to", args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline.get('settings') != results['settings']:
+            print("Warning: baseline was recorded with different settings", baseline.get('settings'))
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        print("\n{} regression(s) above {}% tolerance".format(regressions, int(args.tolerance * 100)))
+        exit_code = 1 if regressions else exit_code
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(exit_code)
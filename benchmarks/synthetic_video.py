@@ -0,0 +1,100 @@
+import cv2
+import datetime
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models.stub_backends import LED_POSITION, TM_POSITION, encode_barcode
+
+""" synthetic training module videos for benchmarks
+Each video has a RevoTech-style timestamp strip (bottom right), a green LED at a known ROI that is ON during trials,
+a training module region with a moving blob (mouse) and a machine-readable barcode of the frame timestamp
+(bottom left) used by the stub OCR backend instead of Tesseract """
+
+
+def draw_timestamp(frame, dt):
+    """ draw RevoTech-style timestamp (MM/DD/YYYY HH:MM:SS) in bottom right timestamp strip """
+
+    height, width = frame.shape[:2]
+    x1, x2 = int(0.74 * width), int(0.98 * width)
+    y1, y2 = int(0.962 * height), int(0.995 * height)
+    frame[y1:y2, x1:x2] = 0
+    font_scale = (y2 - y1) / 32.0
+    cv2.putText(frame, dt.strftime('%m/%d/%Y %H:%M:%S'), (x1 + 2, y2 - 3), cv2.FONT_HERSHEY_SIMPLEX,
+                font_scale, (255, 255, 255), max(1, int(round(font_scale * 2))), cv2.LINE_AA)
+    return frame
+
+
+def video_file_name(rig_no, start_datetime):
+    """ BlueIris style file name ex. TM_6.20220310_190000.mp4 """
+    return "TM_{}.{}.mp4".format(rig_no, start_datetime.strftime('%Y%m%d_%H%M%S'))
+
+
+def trial_schedule(duration_sec, trial_interval_sec=20, trial_length_sec=4, first_trial_sec=5):
+    """ list of (start_sec, length_sec) of trials in video """
+    return [(start, trial_length_sec) for start in range(first_trial_sec, int(duration_sec) - trial_length_sec, trial_interval_sec)]
+
+
+def generate_video(folder, rig_no=1, start_datetime=datetime.datetime(2022, 3, 10, 12, 0, 0), duration_sec=120,
+                   fps=10, resolution=(1280, 720), trials=None, seed=0):
+    """ generate synthetic training module video, returns path to video and list of trials (start_sec, length_sec) """
+
+    if trials is None:
+        trials = trial_schedule(duration_sec)
+
+    width, height = resolution
+    rng = np.random.RandomState(seed)
+
+    # static low-contrast background texture
+    background = (rng.rand(height, width, 3) * 40 + 60).astype(np.uint8)
+
+    # training module outline
+    tx, ty, tw, th = TM_POSITION
+    tx1, ty1, tx2, ty2 = int(tx * width), int(ty * height), int((tx + tw) * width), int((ty + th) * height)
+    cv2.rectangle(background, (tx1, ty1), (tx2, ty2), (200, 200, 200), 4)
+
+    # LED center/radius
+    lx, ly, lw, lh = LED_POSITION
+    led_center = (int((lx + lw / 2) * width), int((ly + lh / 2) * height))
+    led_radius = int(min(lw * width, lh * height) / 2)
+
+    video_path = os.path.join(folder, video_file_name(rig_no, start_datetime))
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+    num_frames = int(duration_sec * fps)
+    for frame_idx in range(num_frames):
+        t = frame_idx / fps
+        dt = start_datetime + datetime.timedelta(seconds=int(t))
+        frame = background.copy()
+
+        # moving blob (mouse) inside training module, static between trials half of the time
+        phase = t if int(t) % 40 < 20 else 20 * (int(t) // 40)
+        bx = int(tx1 + (tx2 - tx1) * (0.5 + 0.3 * np.sin(phase * 0.7)))
+        by = int(ty1 + (ty2 - ty1) * (0.5 + 0.3 * np.cos(phase * 0.5)))
+        cv2.ellipse(frame, (bx, by), (int(0.04 * width), int(0.03 * height)), (phase * 20) % 360, 0, 360, (20, 20, 20), -1)
+
+        # LED ON during trials
+        led_on = any(start <= t < start + length for start, length in trials)
+        cv2.circle(frame, led_center, led_radius, (0, 255, 0) if led_on else (40, 40, 40), -1)
+
+        draw_timestamp(frame, dt)
+        encode_barcode(frame, dt)
+        writer.write(frame)
+
+    writer.release()
+    return video_path, trials
+
+
+def generate_trial_csv(csv_path, start_datetime, trials):
+    """ rig trial csv used in trial-file mode (column names match led_issue_info csv files) """
+
+    rows = []
+    for start, length in trials:
+        trial_dt = start_datetime + datetime.timedelta(seconds=start)
+        rows.append([trial_dt.strftime('%Y-%m-%d %H:%M:%S') + '.000', start_datetime.strftime('%Y-%m-%d %H:%M:%S') + '.000',
+                     int(length * 1000), 0, 0])
+    pd.DataFrame(rows, columns=["trial_datetime", "session_datetime", "report_time", "direction_1", "direction_2"]).to_csv(csv_path, index=False)
+    return csv_path
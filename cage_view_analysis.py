@@ -0,0 +1,495 @@
+from chenlabpylib import chenlab_filepaths
+import cv2
+import datetime
+import numpy as np
+import os
+import shutil
+import stat
+import sys
+import time
+import traceback
+import utils
+
+from frame_source import open_frame_source
+from instrumentation import VideoMetrics
+from mat_writer import AsyncMatWriter
+from paths import folder_paths, modelinfo
+from segmentation_cache import SegmentationCache, get_camera_name
+from trial_record import to_epoch_ms
+
+""" cage view analysis: pose of the mouse in each of the two cages of a cage view video (ex. CV_5_12.20220310_190000.mp4)
+Cages are segmented once per video with Mask R-CNN; the cage masks and crops are reused for every frame. Segmentations
+are cached per camera (segmentation_cache.py), Mask R-CNN only re-runs if the camera moved. For every frame
+the timestamp is read with OCR and both masked cage crops are run through the modelinfo['dlccv'] pose model of the cage
+(coat color of mouse + cage light) in a single batch. Results are saved as one .mat file per cage and video in the
+mat subfolder of the cage (create_mat_subfolder(cageID=...)). Decoding (frame_source.py), metrics and the background
+.mat writer are shared with the training module pipeline """
+
+# size (width, height) of cage crops (DLC input)
+CAGE_CROP_SIZE = (400, 300)
+
+# cages must be segmented within this many frames at the start of the video
+MAX_SEGMENTATION_FRAMES = 100
+
+# cage light is red from 9:30AM to 9:30PM and white otherwise (DLC models per coat color and light)
+RED_LIGHT_START = datetime.time(hour=9, minute=30)
+RED_LIGHT_END = datetime.time(hour=21, minute=30)
+
+# reuse previous pose of a cage if its crop changed by less than this (sum of absolute pixel differences)
+MOTION_SKIP_THRESH = 5
+
+
+class CageRecord():
+    __slots__ = ['cageID', 'position', 'mask', 'mousecoatcolor', 'num_frames', 'timestamps_ms', 'frame_indices', 'red_light', 'dlcdata']
+
+    def __init__(self, cageID, position, mask, mousecoatcolor, capacity):
+        """ per-frame results of a cage, preallocated for [capacity] frames (grows if the frame count estimate is too small) """
+
+        self.cageID = cageID
+        self.position = position  # normalized position of cage in frame
+        self.mask = mask  # ObjectMask of cage (crop box)
+        self.mousecoatcolor = mousecoatcolor
+        self.num_frames = 0
+        self.timestamps_ms = np.zeros(capacity, dtype=np.int64)
+        self.frame_indices = np.zeros(capacity, dtype=np.int64)
+        self.red_light = np.zeros(capacity, dtype=bool)
+        self.dlcdata = None  # allocated with shape/dtype of first pose
+
+    def append(self, frame_idx, timestamp_ms, red_light, pose):
+        """ add results of next analyzed frame """
+
+        if self.dlcdata is None:
+            pose = np.asarray(pose)
+            self.dlcdata = np.empty((len(self.frame_indices),) + pose.shape, dtype=pose.dtype)
+        if self.num_frames == len(self.frame_indices):
+            capacity = max(1, 2 * self.num_frames)
+            self.timestamps_ms, self.frame_indices, self.red_light, self.dlcdata = [
+                _resize_rows(array, capacity) for array in (self.timestamps_ms, self.frame_indices, self.red_light, self.dlcdata)]
+
+        i = self.num_frames
+        self.frame_indices[i] = frame_idx
+        self.timestamps_ms[i] = timestamp_ms
+        self.red_light[i] = red_light
+        self.dlcdata[i] = pose
+        self.num_frames += 1
+
+    def last_pose(self):
+        """ pose of last analyzed frame """
+        return self.dlcdata[self.num_frames - 1]
+
+
+def _resize_rows(array, num_rows):
+    """ copy of array with [num_rows] rows (zero padded) """
+    resized = np.zeros((num_rows,) + array.shape[1:], dtype=array.dtype)
+    resized[:min(num_rows, len(array))] = array[:num_rows]
+    return resized
+
+
+class CageViewAnalysis():
+    def __init__(self, video_path, mouseposemodels, ocr, cagesegmentationmodel, mousecoatrecognition,
+                 decode_backend='opencv', decode_threads=None, hw_decode=False,
+                 segmentation_cache='on', segmentation_cache_folder=None):
+        """ object for cage view data analysis """
+
+        # full path to video file
+        self.video_path = video_path
+
+        # check path to video file
+        if not os.path.isfile(self.video_path):
+            raise ValueError('Video path {} does not point to a file.'.format(os.path.basename(self.video_path)))
+
+        self.video_file_name = utils.get_video_file_name(self.video_path)
+
+        # path to deeplabcut models (key: coat color + cage light, ex. 'blackred')
+        self.dlc_model_paths = modelinfo['dlccv']['model_paths']
+
+        # body parts to track
+        self.body_parts = modelinfo['dlccv']['body_parts']
+
+        # path to error folder
+        self.error_folder = chenlab_filepaths(path=folder_paths['errorcv'])
+
+        # deeplabcut models
+        self.mouseposemodels = mouseposemodels
+
+        # ocr object
+        self.ocr = ocr
+
+        # Mask R-CNN cage segmentation model object
+        self.cagesegmentationmodel = cagesegmentationmodel
+
+        # mouse coat recognition model object
+        self.mousecoatrecognition = mousecoatrecognition
+
+        # video decoding options (see frame_source.py)
+        self.decode_backend = decode_backend
+        self.decode_threads = decode_threads
+        self.hw_decode = hw_decode
+
+        # cached cage segmentation of camera (see segmentation_cache.py)
+        if segmentation_cache != 'off':
+            segmentation_cache_folder = segmentation_cache_folder if segmentation_cache_folder else chenlab_filepaths(path=folder_paths['segmentationcachecv'])
+            self.segmentation_cache = SegmentationCache(cache_folder=segmentation_cache_folder, mode=segmentation_cache)
+        else:
+            self.segmentation_cache = None
+
+        # background writer of .mat files
+        self.mat_writer = None
+
+        self.dlc_total_time = 0
+
+        # per-stage timings and counters
+        self.metrics = VideoMetrics()
+
+    def init_video_data(self):
+        """ initialize video data """
+
+        # open video file, frames are decoded at native resolution (cage crops)
+        self.cap = open_frame_source(self.video_path, backend=self.decode_backend, output_size=None,
+                                     num_threads=self.decode_threads, hw_acceleration=self.hw_decode)
+
+        # check if video cap opened successfully
+        if not self.cap.isOpened():
+            raise IOError('Video {} could not be opened; it may be corrupted.'.format(os.path.basename(self.video_path)))
+        else:
+            print('Video {} successfully loaded!'.format(os.path.basename(self.video_path)))
+
+        # camera, rig and cage information from file name
+        self.init_video_info()
+
+        # get metadata of video file
+        self.fps = round(self.cap.fps)  # average video fps
+        self.resolution = self.cap.resolution  # native (width, height)
+        self.video_frame_count = self.cap.frame_count  # estimate number of frames in video
+        self.frame_idx = -1  # keep track of frame index throughout video
+
+        # segment cages
+        self.init_cage_segmentation()
+
+    def init_video_info(self):
+        """ initialize camera, rig and cage information from video file name """
+
+        # extract information from file name
+        file_info = utils.parse_filename(filename=self.video_file_name)
+
+        self.rig_no = file_info['rig_no']
+        self.camera_view = file_info['camera_view']
+        self.videodatetime = file_info['datetime']
+        self.cageIDs = file_info['cageIDs']  # ex: [1, 2] or [2, 3] (left -> right)
+
+        if self.camera_view != 'CV' or not self.cageIDs:
+            raise ValueError('Video {} is not a cage view video with cage IDs.'.format(self.video_file_name))
+
+        # location to save generated .mat files of each cage
+        self.mat_subfolder_paths = {cageID: utils.create_mat_subfolder(videofilename=self.video_file_name, training_module_id=self.rig_no,
+                                                                       camera_view=self.camera_view, videodatetime=self.videodatetime,
+                                                                       cageID=cageID)
+                                    for cageID in self.cageIDs}
+
+    def init_cage_segmentation(self):
+        """ find first frame with all cages, segment them (or reuse cached segmentation of camera) and predict coat color of mouse in each cage
+        frames are segmented in batches of the batch size of the segmentation model (one forward pass per batch) """
+
+        camera_name = get_camera_name(self.video_file_name)
+        batch_size = getattr(self.cagesegmentationmodel, 'batch_size', 1)
+        while True:
+            # read next batch of frames
+            rgbframes = []
+            while len(rgbframes) < batch_size:
+                ret, frame = self.read_frame()
+                if not ret:
+                    break
+                rgbframes.append(self.process_frame(frame))
+            if not rgbframes:
+                raise ValueError('Unable to find cages in any frame(frame-idx={}), skipping video ...'.format(self.frame_idx))
+            first_frame_idx = self.frame_idx + 1
+            self.frame_idx += len(rgbframes)
+
+            # if skipped over 100 frames (10 seconds of video), must be an issue with video, skip for now
+            if first_frame_idx > MAX_SEGMENTATION_FRAMES:
+                raise ValueError('Unable to find cages in video after {} frames. Skipping video ...'.format(first_frame_idx))
+
+            # cached segmentation is checked against first frame only
+            batch_results = None
+            if self.segmentation_cache is not None and first_frame_idx == 0:
+                with self.metrics.stage('segmentation_cache'):
+                    cage_results = self.segmentation_cache.lookup(camera_name=camera_name, frame=rgbframes[0])
+                if cage_results is not None and len(cage_results) == len(self.cageIDs):
+                    batch_results = [cage_results]
+                    self.metrics.count('segmentation_cache_hits')
+
+            cached = batch_results is not None
+            if not cached:
+                with self.metrics.stage('segmentation'):
+                    batch_results = self.cagesegmentationmodel.run_inference_batch(frames=[rgbframe.copy() for rgbframe in rgbframes])
+                self.metrics.count('segmentation_runs')
+                self.metrics.count('segmentation_frames', len(rgbframes))
+
+            # first frame of batch with all cages
+            for i, cage_results in enumerate(batch_results):
+                if len(cage_results) == len(self.cageIDs):
+                    break
+                print('{} of {} cages detected in frame-idx={}, skipping to next ...'.format(len(cage_results), len(self.cageIDs), first_frame_idx + i))
+            else:
+                continue
+            rgbframe = rgbframes[i]
+            segmentation_frame_idx = first_frame_idx + i
+
+            # reuse segmentation for later videos of camera
+            if self.segmentation_cache is not None and not cached:
+                try:
+                    self.segmentation_cache.store(camera_name=camera_name, frame=rgbframe, object_results=cage_results)
+                except OSError:
+                    print("Unable to save segmentation of camera {} to cache".format(camera_name))
+
+            # cages are sorted left -> right, same order as cage IDs in file name
+            self.cages = [self.init_cage(position=cage_result['position'], mask=cage_result['mask'], frame_shape=rgbframe.shape)
+                          for cage_result in cage_results]
+
+            # coat color of mouse in each cage selects its DLC model
+            self.records = []
+            for cageID, cage in zip(self.cageIDs, self.cages):
+                with self.metrics.stage('coat_classification'):
+                    mousecoatpredicted, confidence = self.mousecoatrecognition.run_inference(frame=self.get_cage_roi(rgbframe, cage))
+                print('cage {}: mouse coat predicted as {} with confidence {}'.format(cageID, mousecoatpredicted, round(confidence, 4)))
+                self.records.append(CageRecord(cageID=cageID, position=cage['position'], mask=cage['mask'], capacity=max(1, self.video_frame_count - segmentation_frame_idx),
+                                               mousecoatcolor={'prediction': mousecoatpredicted, 'confidence': confidence}))
+
+            print('ALL cages detected in frame-idx={} for video!'.format(segmentation_frame_idx))
+            self.cap.set_position(segmentation_frame_idx)  # re-read segmentation frame (no seek if it was the last frame read)
+            self.frame_idx = segmentation_frame_idx - 1
+            break
+
+    def init_cage(self, position, mask, frame_shape):
+        """ crop box, mask inside box and padding to crop aspect ratio of a cage (computed once, reused for every frame) """
+
+        height, width = frame_shape[:2]
+        x, y, w, h = position
+        x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
+        w, h = min(w, width - x), min(h, height - y)
+        padding = utils.resize_cropped_frame(position=position, max_width=width, max_height=height,
+                                             aspect_ratio=CAGE_CROP_SIZE[0] / CAGE_CROP_SIZE[1])
+        return {'position': position, 'mask': mask.crop(x, y, w, h), 'padding': padding}
+
+    def get_cage_roi(self, rgbframe, cage):
+        """ masked crop of cage, padded to aspect ratio and resized to CAGE_CROP_SIZE (DLC and coat recognition input) """
+
+        crop = cage['mask'].apply_to(rgbframe)  # only pixels of crop box are read
+
+        if cage['padding'][0] == 'y':
+            crop = cv2.copyMakeBorder(crop, cage['padding'][1], 0, 0, 0, cv2.BORDER_CONSTANT)  # height padding
+        elif cage['padding'][0] == 'x':
+            crop = cv2.copyMakeBorder(crop, 0, 0, 0, cage['padding'][1], cv2.BORDER_CONSTANT)  # width padding
+
+        return cv2.resize(crop, CAGE_CROP_SIZE)
+
+    def read_frame(self):
+        """ read (decode) next frame of video """
+        with self.metrics.stage('decode'):
+            return self.cap.read()
+
+    def process_frame(self, frame):
+        """ convert decoded frame to RGB """
+        with self.metrics.stage('process_frame'):
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def run_ocr(self, frame):
+        """ run timestamp ocr and count whether tesseract ran or the previous timestamp was reused """
+        with self.metrics.stage('ocr'):
+            ocr_predicted = self.ocr.run_inference(frame=frame)
+        self.metrics.count('ocr_calls' if self.ocr.last_run_ocr else 'ocr_skips')
+        return ocr_predicted
+
+    def run_dlc(self, rois, prev_rois, red_light):
+        """ pose of each cage crop. Crops with the same DLC model run in one batch, cages whose crop didn't change reuse their previous pose """
+
+        light = 'red' if red_light else 'white'
+        poses = [None] * len(rois)
+        batches = {}
+        for i, (roi, prev_roi, record) in enumerate(zip(rois, prev_rois, self.records)):
+            if prev_roi is not None and record.num_frames > 0 and cv2.absdiff(roi[:, :, 0], prev_roi[:, :, 0]).sum() < MOTION_SKIP_THRESH:
+                poses[i] = record.last_pose()
+                self.metrics.count('dlc_motion_skips')
+            else:
+                batches.setdefault(record.mousecoatcolor['prediction'] + light, []).append(i)
+
+        for key, indices in batches.items():
+            with self.metrics.stage('dlc'):
+                batch_poses = self.mouseposemodels.run_inference_batch(frames=[rois[i] for i in indices], key=key)
+            self.metrics.count('dlc_batches')
+            self.metrics.count('dlc_inferences', len(indices))
+            for i, pose in zip(indices, batch_poses):
+                poses[i] = pose
+        return poses
+
+    def run(self):
+        """ run through entire video """
+
+        # background writer of .mat files
+        self.mat_writer = AsyncMatWriter()
+
+        # retrieve initial video data, segment cages
+        self.init_video_data()
+
+        # initialize start time
+        start_time = time.time()
+
+        # timestamp of first frame and last valid timestamp
+        self.first_timestamp = None
+        last_timestamp = None
+
+        prev_rois = [None] * len(self.cages)
+
+        while True:
+            ret, frame = self.read_frame()
+            if not ret:
+                break
+            self.frame_idx += 1
+
+            rgbframe = self.process_frame(frame)
+
+            # get timestamp of frame, use previous timestamp if ocr is blank or in wrong format
+            ocr_predicted = self.run_ocr(frame=rgbframe.copy())
+            if ocr_predicted == -1:
+                if last_timestamp is None:
+                    print('No timestamp recognized in frame-idx={} before first timestamp. Skipping frame.'.format(self.frame_idx))
+                    continue
+                ocr_predicted = last_timestamp
+            last_timestamp = ocr_predicted
+            if self.first_timestamp is None:
+                self.first_timestamp = ocr_predicted
+
+            red_light = RED_LIGHT_START <= ocr_predicted.time() < RED_LIGHT_END
+
+            # pose of mouse in each cage
+            rois = [self.get_cage_roi(rgbframe, cage) for cage in self.cages]
+            start_time_dlc = time.time()
+            poses = self.run_dlc(rois=rois, prev_rois=prev_rois, red_light=red_light)
+            self.dlc_total_time += time.time() - start_time_dlc
+            prev_rois = rois
+
+            timestamp_ms = to_epoch_ms(ocr_predicted)
+            for record, pose in zip(self.records, poses):
+                record.append(frame_idx=self.frame_idx, timestamp_ms=timestamp_ms, red_light=red_light, pose=pose)
+
+        # save results of each cage
+        for record in self.records:
+            self.save_to_matfile(record)
+
+        # end time of analysis
+        total_time = str(datetime.timedelta(seconds=int(time.time() - start_time)))
+        print('Elapsed time:', total_time)
+        print('DLC time', self.dlc_total_time)
+        self.close()
+
+    def save_to_matfile(self, record):
+        """ save results of a cage to a single MAT file """
+
+        if record.num_frames == 0:
+            print("No frames analyzed for cage {}, nothing to save".format(record.cageID))
+            return
+
+        num_frames = record.num_frames
+        timestamps_ms = record.timestamps_ms[:num_frames]
+        cagedata = {
+            'raw_data': os.path.basename(self.video_path),  # basename of video file used
+            'rig_no': self.rig_no,
+            'camera_view': self.camera_view,
+            'cageID': record.cageID,
+            'resolution': self.resolution,
+            'fps': self.fps,
+            'dlcdata': record.dlcdata[:num_frames],  # deeplabcut data
+            'dlc_processed': 1,
+            'marker_list': self.body_parts,  # list of labeled markers tracked
+            'cage_position': record.position,  # position of cage in frame
+            'cage_mask': record.mask.to_dict(),  # mask of cage in crop box (frame shape, box, run-length encoding)
+            'mousecoatcolor': record.mousecoatcolor,
+            'start_datetime': self.first_timestamp.strftime('%m/%d/%Y, %H:%M:%S'),
+            'frame_indices': record.frame_indices[:num_frames],  # frame indices used in video
+            'red_light': record.red_light[:num_frames],  # cage light of each frame (DLC model used)
+            'timestamp_offset_list': (timestamps_ms - timestamps_ms[0]) / 1000.0,
+        }
+
+        # camera name of cage (ex. CV1_5 for cage 1 of rig 5)
+        cameraname = "{}{}_{}".format(self.camera_view, record.cageID, self.rig_no)
+        mat_filename = utils.format_filename(cameraname=cameraname, datetime_obj=self.first_timestamp, filextension='mat')
+        mat_filepath = os.path.join(self.mat_subfolder_paths[record.cageID], mat_filename)
+
+        with self.metrics.stage('savemat_queue'):
+            self.mat_writer.submit(mat_filepath, cagedata)
+        print("Saving cage {} data to {}".format(record.cageID, mat_filename))
+
+    def close(self):
+        """ close session """
+        if getattr(self, 'cap', None) is not None:
+            self.cap.release()  # release video capture
+
+        # wait for queued .mat files to be written
+        if self.mat_writer is not None:
+            with self.metrics.stage('savemat_flush'):
+                self.mat_writer.close()
+            for write_time in self.mat_writer.write_times:
+                self.metrics.add_time('savemat', write_time)
+            self.mat_writer = None
+
+        # delete video if copied to compute node scratch folder
+        if sys.platform == 'linux' and 'scratch' in self.video_path:
+            os.remove(self.video_path)
+        print("Closing", datetime.datetime.now())
+
+    def get_metrics_record(self, status='complete', error=None):
+        """ structured record of stage timings/counters and video information for this video """
+
+        return self.metrics.to_record(
+            video=self.video_file_name,
+            rig_no=getattr(self, 'rig_no', None),
+            camera_view=getattr(self, 'camera_view', None),
+            mode='cage_view',
+            fps=getattr(self, 'fps', None),
+            video_frame_count=getattr(self, 'video_frame_count', None),
+            frames_processed=getattr(self, 'frame_idx', -1) + 1,
+            status=status,
+            error=error,
+        )
+
+    def log_error(self):
+        """ log error caught for debugging """
+
+        print("\nError encountered for video", os.path.basename(self.video_path))
+        traceback.print_exc()
+
+        # release video capture if open
+        try:
+            self.cap.release()
+        except:
+            pass
+
+        # stop writing .mat files before their folders are deleted
+        if self.mat_writer is not None:
+            write_error = self.mat_writer.abort()
+            if write_error is not None:
+                print("Error writing {}: {}".format(*write_error))
+            self.mat_writer = None
+
+        # parse filename to locate mat subfolders of cages
+        file_info = utils.parse_filename(filename=self.video_file_name)
+
+        # delete mat subfolders with .mat files
+        for cageID in (file_info['cageIDs'] or []):
+            mat_subfolder_path = utils.create_mat_subfolder(self.video_file_name, file_info['rig_no'], file_info['camera_view'],
+                                                            file_info['datetime'], cageID=cageID)
+            if os.path.isdir(mat_subfolder_path):
+                shutil.rmtree(mat_subfolder_path)
+
+        # create error subfolder if folder doesn't exit already
+        error_subfolder_path = os.path.join(self.error_folder, self.video_file_name)
+        if os.path.isdir(error_subfolder_path):
+            shutil.rmtree(error_subfolder_path)
+            print("Overriding current error subfolder that exists.")
+        os.mkdir(error_subfolder_path)
+        os.chmod(error_subfolder_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+
+        # create log file
+        log_file_path = os.path.join(error_subfolder_path, "error.log")
+        utils.create_logfile(log_file_path=log_file_path)
+        os.chmod(log_file_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
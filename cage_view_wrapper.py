@@ -0,0 +1,125 @@
+import runtime_config  # must be imported before cv2/tensorflow/tesserocr to set thread environment
+import argparse
+import os
+import sys
+import json
+import traceback
+import utils
+import gc
+import instrumentation
+from cage_view_analysis import CageViewAnalysis
+from models.backends import load_backends, CV_MODEL_ROLES
+from frame_source import FRAME_SOURCE_BACKENDS
+from segmentation_cache import SEGMENTATION_CACHE_MODES
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Parsing arugment for video path",
+        epilog="python file.py --jfn test.json -ta 1"
+    )
+    # required argument
+    parser.add_argument("--json_file_name", '-jfn', required=False, help='name of json file with video paths.')
+    parser.add_argument("--task_array", '-ta', required=False, help='boolean to determine script is submitted as job aray or single job')
+    parser.add_argument("--dlc_model_type", '-dmt', required=False, default="base", choices=["base", "tflite", "tensorrt", "onnx"],
+                        help='inference backend for the DLC cage pose models')
+    parser.add_argument("--num_threads", '-nt', type=int, required=False, default=None, help='number of inference threads (default: $NSLOTS)')
+    parser.add_argument("--cpu_affinity", '-ca', required=False, default=None, help='cpu list to pin worker to (ex. "0-3")')
+    parser.add_argument("--metrics_file", '-mf', required=False, default=None, help='path to JSON-lines metrics file (default: next to SGE job log)')
+    parser.add_argument("--backend_profile", "--backend-profile", '-bp', required=False, default="real",
+                        help='model backends: real, stub, stub_cpu or path to JSON profile (see models/backends.py)')
+    parser.add_argument("--decode_backend", '-db', required=False, default="opencv", choices=FRAME_SOURCE_BACKENDS,
+                        help='video decoding backend')
+    parser.add_argument("--decode_threads", '-dt', type=int, required=False, default=None, help='number of FFmpeg decoding threads (default: num_threads)')
+    parser.add_argument("--hw_decode", '-hwd', action='store_true', help='use hardware video decoding if available (opencv backend)')
+    parser.add_argument("--segmentation_cache", '-sc', required=False, default="on", choices=SEGMENTATION_CACHE_MODES,
+                        help='reuse cached cage segmentation of camera unless it moved, always re-run Mask R-CNN (refresh) or no cache')
+    parser.add_argument("--segmentation_cache_folder", '-scf', required=False, default=None,
+                        help="segmentation cache folder (default: folder_paths['segmentationcachecv'])")
+    parser.add_argument("--segmentation_batch_size", '-sbs', type=int, required=False, default=1,
+                        help='number of frames per Mask R-CNN forward pass when searching for the cages')
+    args = parser.parse_args()
+    return (args.json_file_name, args.task_array, args.dlc_model_type, args.num_threads, args.cpu_affinity, args.metrics_file,
+            args.backend_profile, args.decode_backend, args.decode_threads, args.hw_decode,
+            args.segmentation_cache, args.segmentation_cache_folder, args.segmentation_batch_size)
+
+
+if __name__ == '__main__':
+
+    (json_file_name, task_array, dlc_model_type, num_threads, cpu_affinity, metrics_file,
+     backend_profile, decode_backend, decode_threads, hw_decode, segmentation_cache, segmentation_cache_folder,
+     segmentation_batch_size) = get_args()
+
+    # configure thread pools of inference engines before loading any models
+    runtime_settings = runtime_config.configure_runtime(num_threads=num_threads, cpu_affinity=cpu_affinity)
+
+    # video decoding settings
+    decode_threads = decode_threads if decode_threads else runtime_settings['opencv_threads']
+    runtime_settings.update({'decode_backend': decode_backend, 'decode_threads': decode_threads, 'hw_decode': hw_decode})
+
+    # per video metrics (stage timings/counters) saved as JSON lines
+    if metrics_file is None:
+        metrics_file = instrumentation.get_metrics_file_path()
+    print("Saving video metrics to", metrics_file)
+
+    # load in JSON file
+    f = open(json_file_name)
+    data = json.load(f)
+    f.close()
+
+    if task_array == "1":
+        task_id = int(os.environ["SGE_TASK_ID"])
+        video_path_list = data[task_id-1]
+    else:
+        video_path_list = data[0]
+
+    # update video paths w/ modified chenlab_filepaths function
+    video_path_list = [utils.ospath(path=video_path) for video_path in video_path_list]
+
+    # move video files to scratch folder if on scc
+    if sys.platform == 'linux':
+        video_path_list = utils.move_videos_2_scc_scratch(video_path_list=video_path_list)
+
+    # initialize models (Mask R-CNN cage segmentation, mouse coat recognition, tesserocr, cage DLC models)
+    # with real or stub backends
+    backends = load_backends(profile=backend_profile, roles=CV_MODEL_ROLES, dlc_model_type=dlc_model_type, camera_view='CV',
+                             segmentation_batch_size=segmentation_batch_size)
+
+    # run through all videos in list
+    for video_path in video_path_list:
+        va_object = None
+        print('\n')
+        try:
+            va_object = CageViewAnalysis(video_path=video_path, mouseposemodels=backends['cage_pose'], ocr=backends['ocr'],
+                                         cagesegmentationmodel=backends['cage_segmentation'],
+                                         mousecoatrecognition=backends['coat_classification'],
+                                         decode_backend=decode_backend, decode_threads=decode_threads, hw_decode=hw_decode,
+                                         segmentation_cache=segmentation_cache, segmentation_cache_folder=segmentation_cache_folder)
+            va_object.run()
+            metrics_record = va_object.get_metrics_record(status='complete')
+
+            del va_object
+        except:
+            error = traceback.format_exc().strip().split('\n')[-1]
+            if va_object:
+                # catch any exceptions when running video analysis
+                va_object.log_error()
+                metrics_record = va_object.get_metrics_record(status='error', error=error)
+            else:
+                print("Error during initialization of video analysis for {}".format(os.path.basename(video_path)))
+                traceback.print_exc()
+                metrics_record = instrumentation.VideoMetrics().to_record(video=os.path.basename(video_path)[:-4], status='error', error=error)
+
+        # save structured metrics of video
+        metrics_record['json_file'] = json_file_name
+        metrics_record['runtime'] = runtime_settings
+        metrics_record['backend_profile'] = backend_profile
+        try:
+            instrumentation.write_record(metrics_record, metrics_file)
+        except OSError:
+            print("Unable to write metrics to", metrics_file)
+
+        gc.collect()
+    print("Complete.")
+    sys.exit()
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import stat
+import struct
+import numpy as np
+
+""" per-video cache of trial frames for re-analysis passes (new DLC model, new thresholds) without decoding the video
+For every analyzed trial frame the cache stores the 400x300 training module crop (DLC/coat recognition input) and
+the timestamp strip (OCR input) in memory-mapped .npy files, and an index (index.json) with the frame ranges,
+frame indices, DLC motion-skip flags and object positions of each trial.
+
+cache folder layout (one subfolder per video):
+    <cache_folder>/<video_file_name>/roi.npy        (num_frames, 300, 400, 3) uint8, RGB
+    <cache_folder>/<video_file_name>/timestamp.npy  (num_frames, strip height, strip width, 3) uint8, RGB
+    <cache_folder>/<video_file_name>/index.json     video information and trials
+The index is written last, a cache without index is incomplete and ignored """
+
+# bump when layout or content of cache changes (older caches are ignored)
+FRAME_CACHE_VERSION = 1
+
+# size of .npy header (reserved when writing so the final shape can be written in place)
+NPY_HEADER_SIZE = 128
+
+FRAME_CACHE_MODES = ['off', 'write', 'read']
+
+
+def get_cache_folder(cache_folder, video_file_name):
+    """ cache subfolder of video """
+    return os.path.join(cache_folder, video_file_name)
+
+
+def cache_exists(cache_folder, video_file_name):
+    """ check if a complete cache of current version exists for video """
+
+    index_path = os.path.join(get_cache_folder(cache_folder, video_file_name), 'index.json')
+    if not os.path.isfile(index_path):
+        return False
+    try:
+        with open(index_path) as fp:
+            return json.load(fp).get('version') == FRAME_CACHE_VERSION
+    except ValueError:
+        return False
+
+
+def write_npy_header(fp, shape, dtype=np.uint8):
+    """ write .npy (version 1.0) header of NPY_HEADER_SIZE bytes at start of file """
+
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(np.dtype(dtype).str, tuple(shape))
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    if len(header) != NPY_HEADER_SIZE - 10:
+        raise ValueError('Shape {} does not fit in .npy header'.format(shape))
+    fp.seek(0)
+    fp.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
+class FrameCacheWriter():
+    def __init__(self, cache_folder, video_file_name):
+        """ write trial frames of a video to the frame cache while it is analyzed (first pass) """
+
+        self.cache_folder = cache_folder
+        self.video_file_name = video_file_name
+        self.video_cache_folder = get_cache_folder(cache_folder, video_file_name)
+
+        # write to temporary folder, moved in place on close
+        self.tmp_folder = self.video_cache_folder + '.tmp'
+        if os.path.isdir(self.tmp_folder):
+            shutil.rmtree(self.tmp_folder)
+        os.makedirs(self.tmp_folder)
+
+        self.files = {}
+        self.shapes = {}
+        self.num_frames = 0
+        self.trials = []
+
+    def append(self, name, frames):
+        """ append frames (same shape) to array [name] """
+
+        frames = np.ascontiguousarray(np.asarray(frames, dtype=np.uint8))
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.tmp_folder, name + '.npy'), 'wb')
+            self.shapes[name] = frames.shape[1:]
+            write_npy_header(self.files[name], (0,) + self.shapes[name])
+        elif frames.shape[1:] != self.shapes[name]:
+            raise ValueError('Frame shape {} of {} does not match cached shape {}'.format(frames.shape[1:], name, self.shapes[name]))
+        self.files[name].write(frames.tobytes())
+
+    def add_trial(self, rois, timestamp_strips, info):
+        """ add frames of a trial: training module crops, timestamp strips and trial information (frame indices, ...) """
+
+        if len(rois) != len(timestamp_strips):
+            raise ValueError('Number of training module crops and timestamp strips must be equal.')
+
+        self.append('roi', rois)
+        self.append('timestamp', timestamp_strips)
+
+        trial = dict(info)
+        trial['start'], trial['stop'] = self.num_frames, self.num_frames + len(rois)
+        self.trials.append(trial)
+        self.num_frames += len(rois)
+
+    def close(self, video_info):
+        """ finalize .npy headers, write index and move cache in place """
+
+        for name, fp in self.files.items():
+            write_npy_header(fp, (self.num_frames,) + self.shapes[name])
+            fp.close()
+        self.files = {}
+
+        index = {'version': FRAME_CACHE_VERSION, 'video': video_info, 'num_frames': self.num_frames, 'trials': self.trials}
+        with open(os.path.join(self.tmp_folder, 'index.json'), 'w') as fp:
+            json.dump(index, fp, default=json_default)
+
+        if os.path.isdir(self.video_cache_folder):
+            shutil.rmtree(self.video_cache_folder)
+        os.rename(self.tmp_folder, self.video_cache_folder)
+        os.chmod(self.video_cache_folder, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        print("Saved {} frames of {} trials to frame cache {}".format(self.num_frames, len(self.trials), self.video_cache_folder))
+
+    def abort(self):
+        """ delete incomplete cache (ex. error during analysis) """
+
+        for fp in self.files.values():
+            fp.close()
+        self.files = {}
+        shutil.rmtree(self.tmp_folder, ignore_errors=True)
+
+
+class FrameCache():
+    def __init__(self, cache_folder, video_file_name):
+        """ read-only access to cached trial frames of a video (memory-mapped, nothing is decoded) """
+
+        self.video_cache_folder = get_cache_folder(cache_folder, video_file_name)
+
+        with open(os.path.join(self.video_cache_folder, 'index.json')) as fp:
+            index = json.load(fp)
+        if index.get('version') != FRAME_CACHE_VERSION:
+            raise ValueError('Frame cache {} has version {}, expected {}'.format(self.video_cache_folder, index.get('version'), FRAME_CACHE_VERSION))
+
+        self.video_info = index['video']
+        self.trials = index['trials']
+        self.num_frames = index['num_frames']
+
+        self.rois = np.load(os.path.join(self.video_cache_folder, 'roi.npy'), mmap_mode='r') if self.num_frames else None
+        self.timestamp_strips = np.load(os.path.join(self.video_cache_folder, 'timestamp.npy'), mmap_mode='r') if self.num_frames else None
+
+    def get_trial(self, trial_idx):
+        """ trial information with memory-mapped training module crops ('rois') and timestamp strips """
+
+        trial = dict(self.trials[trial_idx])
+        trial['rois'] = self.rois[trial['start']:trial['stop']]
+        trial['timestamp_strips'] = self.timestamp_strips[trial['start']:trial['stop']]
+        return trial
+
+
+def json_default(value):
+    """ convert numpy types in trial information to JSON """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
@@ -0,0 +1,317 @@
+import bisect
+import cv2
+import shutil
+import subprocess
+
+""" video decoding layer used by the video analysis pipeline
+A FrameSource reads frames sequentially (like cv2.VideoCapture) with:
+    - multithreaded FFmpeg decoding (thread count follows the job slots instead of all cpus of the node)
+    - decode-time scaling to the analysis resolution (640x360), so full resolution frames are never copied around
+    - grab()-only skipping of frames whose pixels are not needed (no color conversion/scaling/copy)
+    - cheap repositioning: re-reading the last frame and short forward jumps don't seek
+    - keyframe-indexed seeking: with a keyframe index (PyAV demuxing or ffprobe, no decoding) a seek goes to the
+      keyframe before the target and decodes forward with grab(), and never seeks if no keyframe is skipped
+
+backends:
+    'opencv': cv2.VideoCapture (FFmpeg). Frames are scaled right after decoding with cv2.resize,
+        which gives the same pixels as resizing in TrainingModuleAnalysis.process_frame
+    'pyav': PyAV (optional dependency, pip install av). Scaling and BGR conversion are done by FFmpeg (swscale)
+        in a single pass during decoding, pixels differ slightly from cv2.resize """
+
+# analysis resolution (width, height) of training module pipeline
+ANALYSIS_RESOLUTION = (640, 360)
+
+# forward jumps up to this many frames are decoded with grab() instead of seeking to a keyframe
+MAX_GRAB_SKIP = 250
+
+FRAME_SOURCE_BACKENDS = ['opencv', 'pyav']
+
+
+class FrameSource():
+    def __init__(self, video_path, output_size=None):
+        """ base class of sequential frame readers
+        output_size: (width, height) of returned frames, None to keep native resolution """
+
+        self.video_path = video_path
+        self.output_size = tuple(output_size) if output_size is not None else None
+
+        # set by backends
+        self.fps = 0
+        self.resolution = (0, 0)  # native (width, height)
+        self.frame_count = 0
+
+        # index of next frame returned by read()
+        self.position = 0
+
+        # last decoded frame (allows re-reading it without seeking) and frame to return on next read()
+        self.last_frame = None
+        self.pending_frame = None
+
+        # sorted frame indices of keyframes, None if unknown (see load_keyframe_index)
+        self.keyframes = None
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _grab(self):
+        raise NotImplementedError
+
+    def _seek(self, frame_idx):
+        raise NotImplementedError
+
+    def isOpened(self):
+        raise NotImplementedError
+
+    def release(self):
+        raise NotImplementedError
+
+    def read(self):
+        """ decode next frame, returns (ret, frame) like cv2.VideoCapture.read (BGR, output_size) """
+
+        if self.pending_frame is not None:
+            ret, frame = True, self.pending_frame
+            self.pending_frame = None
+        else:
+            ret, frame = self._read()
+
+        if ret:
+            self.position += 1
+            self.last_frame = frame
+        return ret, frame
+
+    def grab(self):
+        """ advance by one frame without converting/scaling its pixels, returns False at end of video """
+
+        if self.pending_frame is not None:
+            self.pending_frame = None
+            ret = True
+        else:
+            ret = self._grab()
+
+        if ret:
+            self.position += 1
+            self.last_frame = None
+        return ret
+
+    def skip(self, num_frames):
+        """ grab() [num_frames] frames, returns number of frames skipped (less at end of video) """
+
+        skipped = 0
+        while skipped < num_frames and self.grab():
+            skipped += 1
+        return skipped
+
+    def load_keyframe_index(self):
+        """ build keyframe index of video, returns True if available """
+        self.keyframes = get_keyframe_index(self.video_path, fps=self.fps)
+        return self.keyframes is not None
+
+    def set_position(self, frame_idx):
+        """ next read() returns frame [frame_idx]
+        the last read frame and short forward jumps are served without seeking """
+
+        if frame_idx == self.position:
+            return True
+
+        if frame_idx == self.position - 1 and self.last_frame is not None:
+            self.pending_frame = self.last_frame
+            self.position -= 1
+            return True
+
+        if self.keyframes:
+            # decode forward from the closest keyframe before frame (or from current position if it is closer)
+            keyframe_idx = self.keyframes[max(0, bisect.bisect_right(self.keyframes, frame_idx) - 1)]
+            if keyframe_idx <= self.position < frame_idx:
+                return self.skip(frame_idx - self.position) == frame_idx - self.position
+            ret = self._seek(keyframe_idx)
+            self.position = keyframe_idx
+            self.last_frame = None
+            self.pending_frame = None
+            return ret and self.skip(frame_idx - keyframe_idx) == frame_idx - keyframe_idx
+
+        if self.position < frame_idx <= self.position + MAX_GRAB_SKIP:
+            return self.skip(frame_idx - self.position) == frame_idx - self.position
+
+        ret = self._seek(frame_idx)
+        self.position = frame_idx
+        self.last_frame = None
+        self.pending_frame = None
+        return ret
+
+    def scale(self, frame):
+        """ resize decoded frame to output_size """
+        if self.output_size is None or frame.shape[1::-1] == self.output_size:
+            return frame
+        return cv2.resize(frame, self.output_size)
+
+
+class OpenCVFrameSource(FrameSource):
+    def __init__(self, video_path, output_size=None, num_threads=None, hw_acceleration=False):
+        """ FFmpeg decoding with cv2.VideoCapture
+        num_threads: FFmpeg decoding threads (OpenCV >= 4.6, otherwise FFmpeg uses all cpus of the node)
+        hw_acceleration: use any available hardware decoder (OpenCV >= 4.5.2 built with hw support) """
+
+        super().__init__(video_path=video_path, output_size=output_size)
+
+        params = []
+        if num_threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+            params += [cv2.CAP_PROP_N_THREADS, int(num_threads)]
+        if hw_acceleration and hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+            params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+
+        if params:
+            self.cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, params)
+        else:
+            self.cap = cv2.VideoCapture(video_path)
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.resolution = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def _read(self):
+        ret, frame = self.cap.read()
+        if ret:
+            frame = self.scale(frame)
+        return ret, frame
+
+    def _grab(self):
+        return self.cap.grab()
+
+    def _seek(self, frame_idx):
+        return self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+
+class PyAVFrameSource(FrameSource):
+    def __init__(self, video_path, output_size=None, num_threads=None):
+        """ FFmpeg decoding with PyAV, frame and slice threading enabled
+        num_threads: FFmpeg decoding threads (None/0 = FFmpeg default) """
+
+        import av
+
+        super().__init__(video_path=video_path, output_size=output_size)
+
+        self.av_error = (StopIteration, av.error.EOFError)
+        try:
+            self.container = av.open(video_path)
+        except av.error.FFmpegError:
+            self.container = None
+            return
+
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.stream.thread_count = int(num_threads) if num_threads else 0
+
+        self.fps = float(self.stream.average_rate) if self.stream.average_rate else 0
+        self.resolution = (self.stream.codec_context.width, self.stream.codec_context.height)
+        if self.stream.frames:
+            self.frame_count = self.stream.frames
+        elif self.stream.duration:
+            self.frame_count = int(float(self.stream.duration * self.stream.time_base) * self.fps)
+
+        self.frames = self.container.decode(self.stream)
+        self.pending_av_frame = None
+
+    def _next(self):
+        """ next decoded av.VideoFrame, None at end of video """
+        if self.pending_av_frame is not None:
+            frame, self.pending_av_frame = self.pending_av_frame, None
+            return frame
+        try:
+            return next(self.frames)
+        except self.av_error:
+            return None
+
+    def _read(self):
+        frame = self._next()
+        if frame is None:
+            return False, None
+
+        # scale and convert to BGR in a single swscale pass
+        if self.output_size is not None:
+            return True, frame.to_ndarray(format='bgr24', width=self.output_size[0], height=self.output_size[1])
+        return True, frame.to_ndarray(format='bgr24')
+
+    def _grab(self):
+        return self._next() is not None
+
+    def _frame_index(self, frame):
+        """ frame index of decoded frame from its presentation timestamp """
+        start_time = self.stream.start_time or 0
+        return int(round(float((frame.pts - start_time) * self.stream.time_base) * self.fps))
+
+    def _seek(self, frame_idx):
+        # seek to keyframe before frame, then decode forward
+        start_time = self.stream.start_time or 0
+        target_pts = start_time + int(frame_idx / self.fps / self.stream.time_base)
+        self.container.seek(target_pts, stream=self.stream, backward=True, any_frame=False)
+        self.frames = self.container.decode(self.stream)
+        self.pending_av_frame = None
+
+        while True:
+            frame = self._next()
+            if frame is None:
+                return False
+            if frame.pts is None or self._frame_index(frame) >= frame_idx:
+                self.pending_av_frame = frame
+                return True
+
+    def isOpened(self):
+        return self.container is not None
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+def get_keyframe_index(video_path, fps):
+    """ sorted frame indices of keyframes from packet headers (PyAV demuxing, or ffprobe), None if neither is available """
+
+    try:
+        import av
+    except ImportError:
+        av = None
+
+    if av is not None:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            start_time = stream.start_time or 0
+            keyframes = [int(round(float((packet.pts - start_time) * stream.time_base) * fps))
+                         for packet in container.demux(stream) if packet.pts is not None and packet.is_keyframe]
+        return sorted(set(keyframes))
+
+    if shutil.which('ffprobe'):
+        result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+                                 '-of', 'csv=print_section=0', video_path], stdout=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            return None
+        packets = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if pts_time not in ('', 'N/A'):
+                packets.append((float(pts_time), 'K' in flags))
+        if not packets:
+            return None
+        start_time = min(pts_time for pts_time, _ in packets)
+        return sorted(set(int(round((pts_time - start_time) * fps)) for pts_time, keyframe in packets if keyframe))
+
+    return None
+
+
+def open_frame_source(video_path, backend='opencv', output_size=ANALYSIS_RESOLUTION, num_threads=None, hw_acceleration=False):
+    """ create frame source of video with decoding [backend] ('opencv' or 'pyav') """
+
+    if backend == 'opencv':
+        return OpenCVFrameSource(video_path=video_path, output_size=output_size, num_threads=num_threads, hw_acceleration=hw_acceleration)
+    elif backend == 'pyav':
+        if hw_acceleration:
+            print("Hardware decoding is not supported with the pyav backend, using software decoding")
+        return PyAVFrameSource(video_path=video_path, output_size=output_size, num_threads=num_threads)
+    else:
+        raise ValueError("Decode backend {} is not one of {}".format(backend, FRAME_SOURCE_BACKENDS))
@@ -0,0 +1,177 @@
+import h5py
+import numpy as np
+import os
+import stat
+from scipy.io import savemat
+
+import utils
+
+""" consolidated output of all trials of a video in one chunked, compressed HDF5 file instead of one .mat file per trial
+(far fewer files and directories on the network share). Per-trial .mat files can be exported from it on demand
+(export_matfiles or tools/export_matfiles.py), with the contents of TrainingModuleAnalysis.save_to_matfile except that
+pose (dlcdata) is downcast to float32.
+
+file layout (one file per video, <hdf5_folder>/<video_file_name>.h5):
+    attributes              raw_data, training_module_id, camera_view, camera_name, resolution, fps, marker_list
+                            (written when the file is created, so a video without trials has them too)
+    /pose                   (num_frames, num_body_parts, 3) float32, DLC data of all trial frames (x, y, likelihood)
+    /timestamp_offset       (num_frames,) float64, offset (sec) of each frame from trial datetime
+    /frame_indices          (num_frames,) int64, frame index in video
+    /trials/start, stop     (num_trials,) int64, frame range of each trial in the frame datasets
+    /trials/<column>        (num_trials, ...) trial metadata columns (trial_datetime, edge_case, mousecoatcolor, ...),
+                            float metadata (led_position, tm_markers, mousecoatcolor_confidence) is float64
+Frame datasets and trial columns are created with the first trial, they are missing if the video has no trials
+The file is written to <video_file_name>.h5.tmp and renamed on close, a file from an incomplete analysis is never read """
+
+# output formats of trial data
+OUTPUT_FORMATS = ['mat', 'hdf5', 'both']
+
+# frames per chunk of frame datasets
+HDF5_CHUNK_FRAMES = 1024
+
+HDF5_COMPRESSION = 'gzip'
+HDF5_COMPRESSION_LEVEL = 4
+
+STRING_DTYPE = h5py.special_dtype(vlen=str)
+
+
+def get_hdf5_path(hdf5_folder, video_file_name):
+    """ path to consolidated output of video """
+    return os.path.join(hdf5_folder, video_file_name + '.h5')
+
+
+class HDF5TrialWriter():
+    def __init__(self, hdf5_folder, video_file_name, video_info):
+        """ append trial data (TrialRecord.to_mat_dict) of a video to one HDF5 file
+        video_info: raw_data, training_module_id, camera_view, camera_name, resolution, fps and marker_list of video """
+
+        self.hdf5_path = get_hdf5_path(hdf5_folder, video_file_name)
+        self.tmp_path = self.hdf5_path + '.tmp'
+        os.makedirs(hdf5_folder, exist_ok=True)
+        self.file = h5py.File(self.tmp_path, 'w')
+        self.num_frames = 0
+        self.num_trials = 0
+
+        for key in ['raw_data', 'training_module_id', 'camera_view', 'camera_name', 'fps']:
+            self.file.attrs[key] = video_info[key]
+        self.file.attrs['resolution'] = np.array(video_info['resolution'])
+        self.file.attrs['marker_list'] = np.array(video_info['marker_list'], dtype=STRING_DTYPE)
+
+    def _create_dataset(self, name, shape, dtype, chunk_rows):
+        """ resizable dataset along first axis """
+        return self.file.create_dataset(name, shape=(0,) + tuple(shape), maxshape=(None,) + tuple(shape), dtype=dtype,
+                                        chunks=(chunk_rows,) + tuple(shape), compression=HDF5_COMPRESSION,
+                                        compression_opts=HDF5_COMPRESSION_LEVEL, shuffle=True)
+
+    def _append(self, name, values, dtype, chunk_rows=HDF5_CHUNK_FRAMES):
+        """ append rows to dataset [name], created with shape of first rows """
+
+        values = np.asarray(values, dtype=dtype) if dtype is not STRING_DTYPE else np.array(values, dtype=object)
+        if name not in self.file:
+            self._create_dataset(name, values.shape[1:], dtype, chunk_rows)
+        dataset = self.file[name]
+        if values.shape[1:] != dataset.shape[1:]:
+            raise ValueError('Shape {} of {} does not match shape {} of earlier trials'.format(values.shape[1:], name, dataset.shape[1:]))
+        dataset.resize(dataset.shape[0] + len(values), axis=0)
+        dataset[-len(values):] = values
+
+    def add_trial(self, trial_data):
+        """ append processed trial data (pose, timestamps and frame indices as frame rows, metadata as trial columns) """
+
+        num_frames = len(trial_data['frame_indices'])
+        self._append('pose', trial_data['dlcdata'], np.float32)
+        self._append('timestamp_offset', trial_data['timestamp_offset_list'], np.float64)
+        self._append('frame_indices', trial_data['frame_indices'], np.int64)
+
+        # trial columns
+        led_position = trial_data['led_position'] if trial_data['led_position'] is not None else [np.nan] * 4
+        columns = [
+            ('start', [self.num_frames], np.int64),
+            ('stop', [self.num_frames + num_frames], np.int64),
+            ('trial_datetime', [trial_data['trial_datetime']], STRING_DTYPE),
+            ('edge_case', [trial_data['edge_case']], np.int8),
+            ('dlc_processed', [trial_data['dlc_processed']], np.int8),
+            ('mousecoatcolor', [trial_data['mousecoatcolor']['prediction']], STRING_DTYPE),
+            ('mousecoatcolor_confidence', [trial_data['mousecoatcolor']['confidence']], np.float64),
+            ('dlc_model_path', [trial_data['dlc_model_path']], STRING_DTYPE),
+            ('led_position', [led_position], np.float64),
+            ('tm_markers', [trial_data['tm_markers']], np.float64),
+        ]
+        for name, values, dtype in columns:
+            self._append('trials/' + name, values, dtype, chunk_rows=64)
+
+        self.num_frames += num_frames
+        self.num_trials += 1
+
+    def close(self):
+        """ close file and move it in place """
+
+        self.file.close()
+        os.replace(self.tmp_path, self.hdf5_path)
+        os.chmod(self.hdf5_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        print("Saved {} trials ({} frames) to {}".format(self.num_trials, self.num_frames, self.hdf5_path))
+
+    def abort(self):
+        """ delete incomplete file (ex. error during analysis) """
+
+        self.file.close()
+        if os.path.isfile(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def to_str(value):
+    """ string of HDF5 string value (h5py >= 3 returns bytes for string datasets) """
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def read_trials(hdf5_path, trial_indices=None):
+    """ trial data dictionaries (same keys as the per-trial .mat files) of trials [trial_indices] (default: all) """
+
+    trials = []
+    with h5py.File(hdf5_path, 'r') as fp:
+        if 'trials' not in fp:  # video without trials
+            return trials
+        columns = fp['trials']
+        num_trials = len(columns['start'])
+        for trial_idx in (range(num_trials) if trial_indices is None else trial_indices):
+            start, stop = int(columns['start'][trial_idx]), int(columns['stop'][trial_idx])
+            led_position = columns['led_position'][trial_idx]
+            trials.append({
+                'raw_data': to_str(fp.attrs['raw_data']),
+                'training_module_id': int(fp.attrs['training_module_id']),
+                'camera_view': to_str(fp.attrs['camera_view']),
+                'resolution': tuple(fp.attrs['resolution']),
+                'fps': fp.attrs['fps'],
+                'dlcdata': fp['pose'][start:stop],
+                'dlc_processed': int(columns['dlc_processed'][trial_idx]),
+                'marker_list': [to_str(marker) for marker in fp.attrs['marker_list']],
+                'tm_markers': columns['tm_markers'][trial_idx],
+                'led_position': None if np.isnan(led_position).all() else tuple(led_position),
+                'edge_case': int(columns['edge_case'][trial_idx]),
+                'frame_indices': fp['frame_indices'][start:stop].tolist(),
+                'trial_datetime': to_str(columns['trial_datetime'][trial_idx]),
+                'mousecoatcolor': {'prediction': to_str(columns['mousecoatcolor'][trial_idx]),
+                                   'confidence': float(columns['mousecoatcolor_confidence'][trial_idx])},
+                'dlc_model_path': to_str(columns['dlc_model_path'][trial_idx]),
+                'timestamp_offset_list': fp['timestamp_offset'][start:stop].tolist(),
+            })
+    return trials
+
+
+def export_matfiles(hdf5_path, mat_folder, trial_indices=None):
+    """ export trials of consolidated output to one .mat file per trial in [mat_folder], returns paths of .mat files """
+
+    with h5py.File(hdf5_path, 'r') as fp:
+        if 'trials' not in fp:  # video without trials
+            return []
+        camera_name = to_str(fp.attrs['camera_name'])
+
+    os.makedirs(mat_folder, exist_ok=True)
+    mat_filepaths = []
+    for trial_data in read_trials(hdf5_path, trial_indices=trial_indices):
+        mat_filename = utils.format_filename(cameraname=camera_name, datetime_obj=trial_data['trial_datetime'], filextension='mat')
+        mat_filepath = os.path.join(mat_folder, mat_filename)
+        savemat(mat_filepath, trial_data)
+        os.chmod(mat_filepath, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        mat_filepaths.append(mat_filepath)
+    return mat_filepaths
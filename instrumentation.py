@@ -0,0 +1,133 @@
+import contextlib
+import datetime
+import json
+import os
+import socket
+import stat
+import time
+
+""" lightweight per-stage timing and counters for video analysis
+records wall time and number of calls per stage (decode, ocr, dlc, ...) for the whole video and for each trial,
+and writes a single JSON-lines record per video next to the SGE job log """
+
+
+class VideoMetrics():
+    def __init__(self):
+        """ collect stage timings and counters for a single video """
+
+        # stage name -> {'time_sec': total wall time, 'calls': number of calls}
+        self.stages = {}
+
+        # counter name -> count (ex. ocr_calls, ocr_skips, dlc_inferences, dlc_motion_skips)
+        self.counters = {}
+
+        # list of per trial metrics
+        self.trials = []
+        self.current_trial = None
+
+        self.start_time = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ time block of code as stage [name]
+        note: time of stages nested inside another stage is also included in the outer stage """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, elapsed):
+        """ add elapsed time (sec) to stage for video and active trial """
+        stage_dicts = [self.stages]
+        if self.current_trial is not None:
+            stage_dicts.append(self.current_trial['stages'])
+
+        for stages in stage_dicts:
+            if name not in stages:
+                stages[name] = {'time_sec': 0.0, 'calls': 0}
+            stages[name]['time_sec'] += elapsed
+            stages[name]['calls'] += 1
+
+    def count(self, name, n=1):
+        """ increment counter for video and active trial """
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.current_trial is not None:
+            self.current_trial['counters'][name] = self.current_trial['counters'].get(name, 0) + n
+
+    def start_trial(self, **info):
+        """ start collecting metrics of a trial """
+        self.current_trial = {'stages': {}, 'counters': {}, 'start_time': time.time()}
+        self.current_trial.update(info)
+
+    def end_trial(self, **info):
+        """ end active trial and store its metrics """
+        if self.current_trial is None:
+            return
+        self.current_trial.update(info)
+        self.current_trial['time_sec'] = time.time() - self.current_trial.pop('start_time')
+        self.trials.append(self.current_trial)
+        self.current_trial = None
+
+    def to_record(self, **info):
+        """ create JSON serializable record of all metrics (+ extra video/job information) """
+
+        # close trial if video ended during trial
+        if self.current_trial is not None:
+            self.end_trial(status='incomplete')
+
+        record = get_job_info()
+        record.update(info)
+        record['start_time'] = datetime.datetime.fromtimestamp(self.start_time).isoformat()
+        record['elapsed_sec'] = time.time() - self.start_time
+        record['stages'] = self.stages
+        record['counters'] = self.counters
+        record['num_trials'] = len(self.trials)
+        record['trials'] = self.trials
+        return record
+
+
+def get_job_info():
+    """ SGE job and compute node information """
+    return {
+        'host': os.environ.get("HOSTNAME", socket.gethostname()).split(".")[0],
+        'job_id': os.environ.get("JOB_ID"),
+        'task_id': os.environ.get("SGE_TASK_ID"),
+        'nslots': os.environ.get("NSLOTS"),
+    }
+
+
+def get_metrics_file_path():
+    """ path of JSON-lines metrics file next to the SGE job log (or in current directory if not an SGE job) """
+
+    if "SGE_STDOUT_PATH" in os.environ:
+        log_path = os.environ["SGE_STDOUT_PATH"]
+        if os.path.isdir(log_path):
+            log_name = "{}.o{}".format(os.environ.get("JOB_NAME", "job"), os.environ.get("JOB_ID", 0))
+            if os.environ.get("SGE_TASK_ID", "undefined") != "undefined":
+                log_name += "." + os.environ["SGE_TASK_ID"]
+            log_path = os.path.join(log_path, log_name)
+        return log_path + ".metrics.jsonl"
+
+    return os.path.join(os.getcwd(), "videoanalysis_metrics.jsonl")
+
+
+def _json_default(obj):
+    """ convert numpy/datetime objects for json """
+    if hasattr(obj, 'item'):
+        return obj.item()
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def write_record(record, metrics_file_path):
+    """ append record as a single JSON line to metrics file """
+
+    new_file = not os.path.isfile(metrics_file_path)
+    with open(metrics_file_path, 'a') as fp:
+        fp.write(json.dumps(record, default=_json_default) + '\n')
+
+    # allow rw for everyone
+    if new_file:
+        os.chmod(metrics_file_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
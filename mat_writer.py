@@ -0,0 +1,81 @@
+import os
+import queue
+import stat
+import threading
+import time
+from scipy.io import savemat
+
+""" background writer of trial .mat files, so the analysis of the next trial never waits on the network share
+Finished trial data is put in a bounded queue (analysis only blocks if the share is MAT_WRITER_QUEUE_SIZE trials behind)
+and written by a single thread to a temporary file that is renamed in place with rw permissions for everyone,
+so an incomplete .mat file is never visible. A failed write is raised in the analysis thread on the next submit()
+or close(), files queued after a failed write are not written """
+
+# maximum number of trials waiting to be written
+MAT_WRITER_QUEUE_SIZE = 16
+
+
+def write_matfile(mat_filepath, trial_data):
+    """ save trial data to .mat file atomically (temporary file + rename) """
+
+    tmp_filepath = mat_filepath + '.tmp'
+    savemat(tmp_filepath, trial_data, appendmat=False)
+    os.chmod(tmp_filepath, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+    os.replace(tmp_filepath, mat_filepath)
+
+
+class AsyncMatWriter():
+    def __init__(self, max_queue_size=MAT_WRITER_QUEUE_SIZE):
+        """ start writer thread """
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        # (mat file path, exception) of first failed write
+        self.error = None
+        self.aborted = False
+
+        # write time (sec) of each file, read by analysis thread after close
+        self.write_times = []
+
+        self.thread = threading.Thread(target=self._run, name='mat_writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None and not self.aborted:
+                    start = time.perf_counter()
+                    write_matfile(*item)
+                    self.write_times.append(time.perf_counter() - start)
+            except Exception as error:
+                self.error = (item[0], error)
+            finally:
+                self.queue.task_done()
+
+    def check_error(self):
+        """ raise error of failed write in calling thread """
+        if self.error is not None:
+            mat_filepath, error = self.error
+            raise IOError('Unable to save {}: {}'.format(mat_filepath, error)) from error
+
+    def submit(self, mat_filepath, trial_data):
+        """ queue trial data (not modified afterwards) to be written to [mat_filepath], blocks if queue is full """
+        self.check_error()
+        self.queue.put((mat_filepath, trial_data))
+
+    def close(self):
+        """ write all queued files and stop writer thread """
+        self.queue.join()
+        self.queue.put(None)
+        self.thread.join()
+        self.check_error()
+
+    def abort(self):
+        """ stop writer thread without writing queued files (ex. error during analysis), returns error of failed write """
+        self.aborted = True
+        self.queue.put(None)
+        self.thread.join()
+        return self.error
@@ -0,0 +1,189 @@
+import json
+import os
+
+""" registry of model backends for each model role of the training module and cage view pipelines
+Every role can be served by the real model ('real') or by a deterministic stub ('stub', see models/stub_backends.py)
+with configurable latency and outputs. This makes it possible to profile/regression test the pipeline itself
+without the model weights on the Z: drive, and to measure orchestration overhead separately from inference cost.
+
+A backend profile maps each role to a backend name and its options, ex:
+    {"ocr": {"backend": "real"}, "mouse_pose": {"backend": "stub", "latency": 0.02}}
+Roles missing from a profile use the real model. Profiles are either one of BACKEND_PROFILES or a path to a JSON file.
+Real model factories import their dependencies lazily, so stub profiles don't need model weights or TensorFlow """
+
+# model roles used in training module analysis
+MODEL_ROLES = ['led_detection', 'tm_detection', 'coat_classification', 'mouse_pose', 'ocr']
+
+# model roles used in cage view analysis
+CV_MODEL_ROLES = ['cage_segmentation', 'cage_pose', 'coat_classification', 'ocr']
+
+ALL_MODEL_ROLES = MODEL_ROLES + [role for role in CV_MODEL_ROLES if role not in MODEL_ROLES]
+
+# frame size (width, height) of BlueIris recordings the cage view Mask R-CNN was trained on
+CV_SEGMENTATION_TRAINED_SIZE = (1280, 720)
+
+
+def _real_led_detection(**kwargs):
+    from models.detect_objects import ObjectDetector
+    return ObjectDetector(class_label='LED', confidence_thresh=kwargs.get('confidence_thresh', 0.8))
+
+
+def _real_tm_detection(dlc_model_type='base', **kwargs):
+    from chenlabpylib import chenlab_filepaths
+    from paths import modelinfo
+    from models.detect_tm_anchor_pts import DetectTMAnchorPts
+    return DetectTMAnchorPts(model_path=chenlab_filepaths(modelinfo['tmdetection']), model_type=dlc_model_type)
+
+
+def _real_coat_classification(**kwargs):
+    from chenlabpylib import chenlab_filepaths
+    from paths import modelinfo
+    from models.coat_classifier import CoatClassifier
+    return CoatClassifier(model_path=chenlab_filepaths(path=modelinfo['coatrecognition']))
+
+
+def _real_mouse_pose(dlc_model_type='base', **kwargs):
+    from paths import modelinfo
+    from models.detect_mouse_pose import DetectMousePose
+    return DetectMousePose(model_paths=modelinfo['dlctm']['model_paths'], model_type=dlc_model_type)
+
+
+def _real_ocr(camera_view='TM', **kwargs):
+    from chenlabpylib import chenlab_filepaths
+    from paths import modelinfo
+    from models.timestamp_ocr import TimestampOCR
+    return TimestampOCR(camera_view=camera_view, model_path=chenlab_filepaths(path=modelinfo['ocr']))
+
+
+def _real_cage_segmentation(trained_size=CV_SEGMENTATION_TRAINED_SIZE, segmentation_batch_size=1, **kwargs):
+    from chenlabpylib import chenlab_filepaths
+    from paths import modelinfo
+    from models.cv_segmentation import MaskRCNNCageView
+    return MaskRCNNCageView(trained_height=trained_size[1], trained_width=trained_size[0],
+                            weights_path=chenlab_filepaths(path=modelinfo['maskrcnncv']), log=False,
+                            batch_size=segmentation_batch_size)
+
+
+def _real_cage_pose(dlc_model_type='base', **kwargs):
+    from paths import modelinfo
+    from models.detect_mouse_pose import DetectMousePose
+    return DetectMousePose(model_paths=modelinfo['dlccv']['model_paths'], model_type=dlc_model_type)
+
+
+def _stub_led_detection(**kwargs):
+    from models.stub_backends import StubLEDDetector
+    return StubLEDDetector(**kwargs)
+
+
+def _stub_tm_detection(**kwargs):
+    from models.stub_backends import StubTMAnchorPts
+    return StubTMAnchorPts(**kwargs)
+
+
+def _stub_coat_classification(**kwargs):
+    from models.stub_backends import StubCoatClassifier
+    return StubCoatClassifier(**kwargs)
+
+
+def _stub_mouse_pose(**kwargs):
+    from models.stub_backends import StubMousePose
+    return StubMousePose(**kwargs)
+
+
+def _stub_cage_segmentation(**kwargs):
+    from models.stub_backends import StubCageSegmentation
+    return StubCageSegmentation(**kwargs)
+
+
+def _stub_cage_pose(**kwargs):
+    from models.stub_backends import StubMousePose
+    return StubMousePose(**kwargs)
+
+
+def _stub_ocr(camera_view='TM', **kwargs):
+    from models.stub_backends import StubTimestampOCR
+    return StubTimestampOCR(camera_view=camera_view, **kwargs)
+
+
+# role -> backend name -> factory
+BACKEND_REGISTRY = {
+    'led_detection': {'real': _real_led_detection, 'stub': _stub_led_detection},
+    'tm_detection': {'real': _real_tm_detection, 'stub': _stub_tm_detection},
+    'coat_classification': {'real': _real_coat_classification, 'stub': _stub_coat_classification},
+    'mouse_pose': {'real': _real_mouse_pose, 'stub': _stub_mouse_pose},
+    'ocr': {'real': _real_ocr, 'stub': _stub_ocr},
+    'cage_segmentation': {'real': _real_cage_segmentation, 'stub': _stub_cage_segmentation},
+    'cage_pose': {'real': _real_cage_pose, 'stub': _stub_cage_pose},
+}
+
+# built-in backend profiles
+BACKEND_PROFILES = {
+    # real models for all roles
+    'real': {role: {'backend': 'real'} for role in ALL_MODEL_ROLES},
+    # stubs without inference cost (orchestration overhead only)
+    'stub': {role: {'backend': 'stub', 'latency': 0.0} for role in ALL_MODEL_ROLES},
+    # stubs with rough CPU inference cost of the real models on an SCC node
+    'stub_cpu': {
+        'led_detection': {'backend': 'stub', 'latency': 0.06},
+        'tm_detection': {'backend': 'stub', 'latency': 0.04},
+        'coat_classification': {'backend': 'stub', 'latency': 0.03},
+        'mouse_pose': {'backend': 'stub', 'latency': 0.025},
+        'ocr': {'backend': 'stub', 'latency': 0.004},
+        'cage_segmentation': {'backend': 'stub', 'latency': 2.0},
+        'cage_pose': {'backend': 'stub', 'latency': 0.025},
+    },
+}
+
+
+def register_backend(role, name, factory):
+    """ register a new backend [name] for model [role]. factory(**options) must return an object
+    with the same run_inference interface as the real model """
+
+    if role not in BACKEND_REGISTRY:
+        raise ValueError("Unknown model role {}. Must be one of {}".format(role, ALL_MODEL_ROLES))
+    BACKEND_REGISTRY[role][name] = factory
+
+
+def get_backend_profile(profile):
+    """ get backend profile by name (BACKEND_PROFILES) or from a JSON file """
+
+    if isinstance(profile, dict):
+        return profile
+    if profile in BACKEND_PROFILES:
+        return BACKEND_PROFILES[profile]
+    if os.path.isfile(profile):
+        with open(profile) as fp:
+            return json.load(fp)
+    raise ValueError("Backend profile {} is neither one of {} nor a JSON file".format(profile, list(BACKEND_PROFILES.keys())))
+
+
+def load_backends(profile='real', roles=MODEL_ROLES, **kwargs):
+    """ create model object for each of [roles] (MODEL_ROLES or CV_MODEL_ROLES) from backend profile
+    kwargs (ex. dlc_model_type, camera_view) are passed to the real model factories
+    returns dictionary role -> model object """
+
+    profile = get_backend_profile(profile)
+
+    unknown_roles = set(profile.keys()) - set(ALL_MODEL_ROLES)
+    if unknown_roles:
+        raise ValueError("Unknown model role(s) {} in backend profile".format(sorted(unknown_roles)))
+
+    backends = {}
+    for role in roles:
+        options = dict(profile.get(role, {'backend': 'real'}))
+        backend_name = options.pop('backend', 'real')
+        if backend_name not in BACKEND_REGISTRY[role]:
+            raise ValueError("Unknown backend {} for model role {}. Must be one of {}".format(
+                backend_name, role, list(BACKEND_REGISTRY[role].keys())))
+
+        if backend_name == 'real':
+            options.update(kwargs)
+        elif role == 'ocr' and 'camera_view' in kwargs:
+            options['camera_view'] = kwargs['camera_view']
+        elif role == 'cage_segmentation' and 'segmentation_batch_size' in kwargs:
+            options['segmentation_batch_size'] = kwargs['segmentation_batch_size']
+
+        print("Model role {}: {} backend".format(role, backend_name))
+        backends[role] = BACKEND_REGISTRY[role][backend_name](**options)
+
+    return backends
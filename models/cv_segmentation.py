@@ -1,16 +1,20 @@
 import os
 import sys
 import cv2
+import numpy as np
 
 #### Written 06/07/2022 by Kevin D ####
 
-sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+ROOT_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(ROOT_DIR)
 
 from mrcnn import utils
 from mrcnn import model as modellib
 from mrcnn.config import Config
+from mrcnn.utils import unmold_dilated_mask
 
 import utils
+from object_mask import ObjectMask
 
 class CustomConfig(Config):
     """Configuration for training on the toy  dataset.
@@ -40,8 +44,21 @@ class InferenceConfig(config.__class__):
     IMAGES_PER_GPU = 1
 config = InferenceConfig()
 
+# note: maskrcnn masks are sometimes smaller than the actual object and are dilated to include more of the frame.
+# 4 iterations of a 6x6 rect kernel (anchor (3, 3)) are the same as a single dilation with a 21x21 kernel anchored at (12, 12)
+MASK_DILATION_KERNEL = np.ones((21, 21), dtype=np.uint8)
+MASK_DILATION_ANCHOR = (12, 12)
+
+
+def get_inference_config(batch_size=1):
+    """ inference config running [batch_size] frames per forward pass """
+
+    class BatchInferenceConfig(InferenceConfig):
+        IMAGES_PER_GPU = batch_size
+    return BatchInferenceConfig()
+
 class MaskRCNNCageView():
-    def __init__(self, trained_height, trained_width, weights_path, preferred_aspect_ratio = None, confidence_thresh = 0.80, log = True):  
+    def __init__(self, trained_height, trained_width, weights_path, preferred_aspect_ratio = None, confidence_thresh = 0.80, log = True, batch_size = 1):  
         """"" MaskRCNN python class used to initialize image segmentation model/weights and run inference
 
         Parameters
@@ -63,6 +80,9 @@ class MaskRCNNCageView():
 
         log: boolean
             Choose to print process to command window
+
+        batch_size: int
+            Number of frames per forward pass of run_inference_batch
         """
 
         self.trained_width = trained_width
@@ -71,6 +91,7 @@ class MaskRCNNCageView():
         self.confidence_thresh = confidence_thresh
         self.weights_path = weights_path
         self.log = log
+        self.batch_size = batch_size
 
         # # TODO: Remove this when done debugging
         # self.weights_path = r'Z:\Dropbox\Chen Lab Dropbox\Chen Lab Team Folder\Projects\Home_Cage_Training\DeepLabCut\ObjectDetection\cage\cilse_cages\cageview_v3\weights\mask_rcnn_cage_ls_06132022.h5'
@@ -84,7 +105,7 @@ class MaskRCNNCageView():
 
         # load maskrcnn model architecture
         MODEL_DIR = os.path.join(ROOT_DIR, "logs")
-        self.model = modellib.MaskRCNN(mode="inference", model_dir=MODEL_DIR, config=config)
+        self.model = modellib.MaskRCNN(mode="inference", model_dir=MODEL_DIR, config=get_inference_config(batch_size))
 
         if self.log:
             print("(MASKRCNN) Loading weights: ", os.path.basename(self.weights_path), "...")
@@ -93,26 +114,37 @@ class MaskRCNNCageView():
 
     def run_inference(self, frame, DEBUG = False):
         """ get cage view position and mask from single [frame]"""
+        return self.run_inference_batch(frames=[frame], DEBUG=DEBUG)[0]
+
+    def run_inference_batch(self, frames, DEBUG = False):
+        """ get cage view positions and masks of each of [frames] (same size), frames are run batch_size at a time """
 
-        # dim of input frame
-        height, width = frame.shape[:2]
+        # dim of input frames
+        height, width = frames[0].shape[:2]
 
         # compare aspect ratio vs. trained aspect ratio
         # note: continue analysis but send warning to alert aspect ratio discrepancy
         if round(width/height, 1) != round(self.trained_width/self.trained_height, 1):
             print('(MASKRCNN) Warning: Aspect ratio of input frame is not equal to aspect ratio of trained frames')
 
-        # resize input frame
-        frame = cv2.resize(frame, (self.trained_width, self.trained_height))
+        # resize input frames
+        frames = [cv2.resize(frame, (self.trained_width, self.trained_height)) for frame in frames]
         if self.log:
-            print('(MASKRCNN) Frame dim:', frame.shape)
+            print('(MASKRCNN) Frame dim: {} x {}'.format(len(frames), frames[0].shape))
 
         # run mask rcnn inference
         # note: verbose = 0 to ignore output to terminal
-        results = self.model.detect([frame], verbose=0)
+        results = self.model.detect_batched(frames, verbose=0, unmold_masks=False)
 
-        # parse prediction
-        boxes, masks, confidences = results[0]['rois'], results[0]['masks'], results[0]['scores']
+        return [self.parse_result(result=result, frame=frame, width=width, height=height, DEBUG=DEBUG) for result, frame in zip(results, frames)]
+
+    def parse_result(self, result, frame, width, height, DEBUG = False):
+        """ objects (position, dilated ObjectMask of [width] x [height] frame) detected in resized [frame], sorted left -> right
+        full size masks are only computed for objects above the confidence threshold, dilation is done at the
+        resolution of the network input in the region of each object only """
+
+        # parse prediction (masks are the small masks of the network)
+        boxes, masks, confidences = result['rois'], result['masks'], result['scores']
         N = boxes.shape[0]
 
         if self.log:
@@ -122,25 +154,17 @@ class MaskRCNNCageView():
             # confidences of each detected object
             print('(MASKRCNN) Confidences: ', confidences)
 
-        # note: maskrcnn masks are sometimes smaller than the actual object. Dilate predicted mask
-        # to increase area of mask/including more of frame
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (6,6))
-        kernel_iterations = 4
+        # filter objects below confidence threshold
+        for i in np.flatnonzero(confidences < self.confidence_thresh):
+            print('(MASKRCNN) Warning: Skipping object #{} since it has a low confidence level [{}]'.format(str(i), str(round(confidences[i], 3))))
 
         object_results = []
-        sorted_object_results = []
 
         # loop through all objects detected from maskrcnn
-        for i in range(N):
-
-            # filter objects below confidence threshold
-            obj_confidence = confidences[i]
-            if obj_confidence < self.confidence_thresh:
-                print('(MASKRCNN) Warning: Skipping object #{} since it has a low confidence level [{}]'.format(str(i), str(round(obj_confidence, 3))))
-                continue
+        for i in np.flatnonzero(confidences >= self.confidence_thresh):
 
             # object results
-            box, mask = boxes[i], masks[:,:,i]
+            box, mask = boxes[i], masks[i]
 
             # re-format cage position coordinates
             y1, x1, y2, x2 = box
@@ -151,29 +175,25 @@ class MaskRCNNCageView():
                 obj_position = utils.resize_cropped_frame(position = obj_position, max_width = self.trained_width, 
                     max_height = self.trained_height, aspect_ratio = self.preferred_aspect_ratio)
 
-
-            # convert mask of 0/1 to 0/255 for opencv
-            obj_mask = mask.astype("uint8") * 255
-
-            # resize and dilate mask detected
-            obj_mask = cv2.dilate(obj_mask, kernel, iterations = kernel_iterations)
-            obj_mask = cv2.resize(obj_mask, (width, height))
+            # dilated mask of object region, scaled to input frame size
+            y, x, region = unmold_dilated_mask(mask, box, (self.trained_height, self.trained_width), (height, width),
+                                               dilation_kernel=MASK_DILATION_KERNEL, dilation_anchor=MASK_DILATION_ANCHOR)
+            obj_mask = ObjectMask.from_region(shape=(height, width), y=y, x=x, region=region)
 
             # return object position and mask
-            object_results.append({'position': obj_position, 'mask': obj_mask}) 
+            object_results.append({'position': obj_position, 'mask': obj_mask})
 
             # debug
             if DEBUG:
                 # view results of maskrcnn
-                frame_cpy = frame.copy()
+                frame_cpy = cv2.resize(frame, (width, height))
 
                 # mask frame
-                frame_cpy[~(obj_mask == 255)] = 0
-                frame_cpy = frame_cpy
+                frame_cpy[~(obj_mask.to_array() == 255)] = 0
 
                 # crop frame
                 x, y, w, h = obj_position
-                x, y, w, h = int(x*self.trained_width), int(y*self.trained_height), int(w*self.trained_width), int(h*self.trained_height)
+                x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
                 frame_cpy = frame_cpy[y:y+h, x:x+w]
                 
                 cv2.imshow("mask#{}".format(str(i)), frame_cpy)
@@ -182,4 +202,4 @@ class MaskRCNNCageView():
         # sort objects based on position in frame (left -> right)
         sorted_object_results = sorted(object_results, key=lambda d: d['position'][0]) 
 
-        return sorted_object_results
\ No newline at end of file
+        return sorted_object_results
@@ -8,18 +8,24 @@ from dlclive.dlclive import DLCLive
 
 
 class DetectMousePose():
-    def __init__(self, model_paths):
+    def __init__(self, model_paths, model_type = "base"):
         """ Using DeepLabCut(DLC), a pose estimation toolbox, to locate the body parts 
-        of mouse as they do a whisker-based task """
+        of mouse as they do a whisker-based task
+        model_type: DLCLive inference backend ('base', 'tflite', 'tensorrt', 'onnx') """
 
          # initialize DLCLive
         self.dlcmodels = {}
         for key in model_paths:
-            self.dlcmodels[key] = DLCLive(chenlab_filepaths(path = model_paths[key]), display = False)
+            self.dlcmodels[key] = DLCLive(chenlab_filepaths(path = model_paths[key]), model_type = model_type,
+                                         tflite_input_shape = (300, 400), display = False)
             self.dlcmodels[key].init_inference()
         print("Successfully initialized DeepLabCut model(s)")
 
 
     def run_inference(self, frame, key):
         dlcresults = self.dlcmodels[key].get_pose(np.array([frame]))
-        return dlcresults
\ No newline at end of file
+        return dlcresults
+
+    def run_inference_batch(self, frames, key):
+        """ pose of each frame (same size) with a single network run, returns (num_frames, num_body_parts, 3) """
+        return self.dlcmodels[key].get_pose_batch(np.array(frames))
@@ -3,6 +3,7 @@ import numpy as np
 import os
 from paths import modelinfo
 from chenlabpylib import chenlab_filepaths
+from models.mrcnn.box_utils import non_max_suppression_xywh
 
 """ Object Detection used for video analysis
 As of 01/12/2021, we are able to detect
@@ -10,9 +11,11 @@ As of 01/12/2021, we are able to detect
 	2. LED
 """
 
-def get_object_location(img, class_label, confidence_thresh = 0.8, verbose = False, ):
-	""" Get initial position of a specific object [class_id]  """
-	# NOTE: Set "confidence_thresh" accordingly. Change if needed. Detections are present if prediction is {confidence_thresh} confident
+# non-maximum suppression of overlapping detections ('numpy' or 'opencv', see models/mrcnn/box_utils.py)
+NMS_BACKEND = 'numpy'
+
+def load_object_detection_model(class_label):
+	""" YOLO network of a specific object [class_label], its output layer names and trained image size/channels """
 
 	# check if class_label is valid model, else throw ERROR
 	valid_objectdetection_models = ['LED', 'TM']
@@ -33,22 +36,6 @@ def get_object_location(img, class_label, confidence_thresh = 0.8, verbose = Fal
 	cfg_filename = model_info['config']
 
 	##########################################################################################
-		
-	# Get dimensions of image
-	height, width = img.shape[:2]
-
-	# Check dimensions of input frame match trained frame dimensions
-	input_frame_channels = None
-	if len(img.shape) == 2:
-		input_frame_channels = 1
-	elif len(img.shape) == 3:
-		input_frame_channels = 3
-	else:
-		raise ValueError('Issues with input frame for class [{}] for object detection'.format(class_label))
-
-	if input_frame_channels != channels:
-		# number of channels trained on is not equal to input frame
-		raise ValueError('Number of channels are not the same for class [{}] for object detection'.format(class_label))
 
 	# Config and weights files
 	cfg_file = os.path.join(model_folder, weights_filename)
@@ -56,76 +43,140 @@ def get_object_location(img, class_label, confidence_thresh = 0.8, verbose = Fal
 
 	# Reading weights and cfg file for object detection model
 	net = cv2.dnn.readNet(cfg_file, weights_file)
-	classes = [str(class_label)] # LED class detection
-
 
 	# Getting information of darknet (YOLO_v3)
 	layer_names = net.getLayerNames()
 	outputLayers = [layer_names[i - 1] for i in net.getUnconnectedOutLayers()]
 
+	return net, outputLayers, trained_image_size, channels
+
+
+def get_object_detections(img, class_label, confidence_thresh = 0.8, verbose = False):
+	""" Get all detections of a specific object [class_id] as list of (position (x, y, w, h) relative to frame, confidence),
+	sorted by confidence (highest first) """
+	return get_object_detections_batch([img], class_label, confidence_thresh = confidence_thresh, verbose = verbose)[0]
+
+
+def get_object_detections_batch(imgs, class_label, confidence_thresh = 0.8, verbose = False):
+	""" get_object_detections of each frame of [imgs] (same size) with a single network run """
+	# NOTE: Set "confidence_thresh" accordingly. Change if needed. Detections are present if prediction is {confidence_thresh} confident
+
+	net, outputLayers, trained_image_size, channels = load_object_detection_model(class_label)
+
+	# Get dimensions of images
+	height, width = imgs[0].shape[:2]
+
+	# Check dimensions of input frames match trained frame dimensions
+	for img in imgs:
+		input_frame_channels = None
+		if len(img.shape) == 2:
+			input_frame_channels = 1
+		elif len(img.shape) == 3:
+			input_frame_channels = 3
+		else:
+			raise ValueError('Issues with input frame for class [{}] for object detection'.format(class_label))
+
+		if input_frame_channels != channels:
+			# number of channels trained on is not equal to input frame
+			raise ValueError('Number of channels are not the same for class [{}] for object detection'.format(class_label))
+
+		if img.shape[:2] != (height, width):
+			raise ValueError('Frames of a batch must have the same size for class [{}] for object detection'.format(class_label))
+
 	# Detecting obj
-	blob = cv2.dnn.blobFromImage(img, 0.00392, trained_image_size, (0,0,0), True, crop=False)
+	blob = cv2.dnn.blobFromImages(imgs, 0.00392, trained_image_size, (0,0,0), True, crop=False)
 
 	net.setInput(blob)
 	outs = net.forward(outputLayers)
 
-	confidences = []
-	boxes = []
+	# output rows of each frame (outputs of a batch are either (frames, rows, columns) or frame-major (frames * rows, columns))
+	outs = [out.reshape(len(imgs), -1, out.shape[-1]) for out in outs]
+
+	detections_per_frame = []
+	for frame_outs in zip(*outs):
+		# Decode all output rows at once, filter predictions based on confidence threshold
+		boxes, confidences = decode_yolo_outputs(frame_outs, width, height, confidence_thresh)
 
-	for out in outs:
-	    for detection in out:
-	        scores = detection[5:]
-	        class_id = np.argmax(scores)
-	        confidence = scores[class_id]
+		# Run non-maximum-suppression to ignore overlapping boxes predicted (kept boxes sorted by confidence)
+		indexes = non_max_suppression_xywh(boxes, confidences, iou_threshold=0.4, score_threshold=0.5, backend=NMS_BACKEND)
 
-	        # Filter predictions based on confidence threshold
-	        if confidence > confidence_thresh:
-	            center_x = detection[0] * width
-	            center_y = detection[1] * height
-	            w, h= detection[2] * width, detection[3] * height
-	            x, y = center_x - w /2, center_y - h /2
+		objects_detected = []
+		for i in indexes:
+			x, y, w, h = boxes[i]
 
-	            boxes.append([x, y, w, h])
-	            confidences.append(float(confidence))
+			# Modify coordinates to be with respect to dimensions of width/height ratio (clipped to frame)
+			x, y = max(x, 0)/width, max(y, 0)/height
+			w, h = w/width, h/height
+			objects_detected.append(((float(x), float(y), float(w), float(h)), float(confidences[i])))
+
+		if verbose:
+			print('{} {} object(s) detected with confidences {}'.format(len(objects_detected), class_label, [round(confidence, 3) for _, confidence in objects_detected]))
 
-	# Run non-maximum-suppression to ignore overlapping boxes predicted
-	indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
-	num_object_detected = len(boxes)
+		detections_per_frame.append(objects_detected)
 
-	objects_detected = []
-	for i in range(num_object_detected):
-	    if i in indexes:
-	        objects_detected.append([boxes[i], confidences[i]])
+	return detections_per_frame
 
 
+def decode_yolo_outputs(outs, width, height, confidence_thresh):
+	""" boxes (x, y, w, h in pixels of [width] x [height] frame) and confidences (score of most likely class) of all rows
+	of YOLO output layers [outs] with confidence above [confidence_thresh] """
+
+	# rows: center x, center y, w, h (relative), objectness, class scores
+	detections = np.concatenate([out.reshape(-1, out.shape[-1]) for out in outs])
+	confidences = detections[:, 5:].max(axis=1)
+	keep = confidences > confidence_thresh
+	detections, confidences = detections[keep], confidences[keep]
+
+	w, h = detections[:, 2] * width, detections[:, 3] * height
+	x, y = detections[:, 0] * width - w / 2, detections[:, 1] * height - h / 2
+	return np.stack([x, y, w, h], axis=1), confidences
+
+
+def get_object_location(img, class_label, confidence_thresh = 0.8, verbose = False, ):
+	""" Get initial position of a specific object [class_id]: position (x, y, w, h) relative to frame of the
+	highest confidence detection, None if object is not detected """
+
+	objects_detected = get_object_detections(img, class_label, confidence_thresh = confidence_thresh, verbose = verbose)
+
 	if len(objects_detected) > 0:
 
 		if len(objects_detected) > 1:
-			# Issue! More than 1 of the specified objects were detected, choose first index as resort
+			# Issue! More than 1 of the specified objects were detected, use highest confidence prediction
 			if verbose:
 				print('More than 1 {} object was detected. {} detected. Using highest confidence prediction.\n'.format(class_label, str(len(objects_detected))))
 
-		# Distribute coordinates
-		x, y, w, h = objects_detected[0][0]
-		if x < 0:
-			x = 0
-		if y < 0:
-			y = 0
-
-		# Modify coordinates to be with respect to dimensions of width/height ratio
-		x, y = x/width, y/height
-		w, h = w/width, h/height
-
-		# Get confidence score of object detected
-		confidence_score = objects_detected[0][1]
+		# Final predictions with respect to percentage of dimensions of frame
+		position, confidence_score = objects_detected[0]
 
 		if verbose:
 			print('{} object detected with confidence of {}'.format(class_label, confidence_score))
 
-		# Final predictions with respect to percentage of dimensions of frame
-		return (x, y, w, h)
+		return position
 
 	else:
 		if verbose:
 			print('{} object not detected in frame.\n'.format(class_label))
-		return None
\ No newline at end of file
+		return None
+
+class ObjectDetector():
+	def __init__(self, class_label, confidence_thresh = 0.8):
+		""" YOLO object detection of a single class (e.g. 'LED') with the same interface as the other models (run_inference) """
+
+		self.class_label = class_label
+		self.confidence_thresh = confidence_thresh
+
+
+	def run_inference(self, frame):
+		""" get normalized position (x, y, w, h) of highest confidence detection of object in [frame], None if object is not detected """
+		return get_object_location(frame, self.class_label, confidence_thresh = self.confidence_thresh)
+
+
+	def run_inference_all(self, frame):
+		""" get all detections (normalized position, confidence) of object in [frame], sorted by confidence """
+		return get_object_detections(frame, self.class_label, confidence_thresh = self.confidence_thresh)
+
+
+	def run_inference_batch(self, frames):
+		""" run_inference of each frame of [frames] (same size) with a single network run """
+		detections = get_object_detections_batch(frames, self.class_label, confidence_thresh = self.confidence_thresh)
+		return [objects_detected[0][0] if len(objects_detected) else None for objects_detected in detections]
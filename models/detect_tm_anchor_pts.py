@@ -9,14 +9,16 @@ import utils
 
 
 class DetectTMAnchorPts():
-	def __init__(self, model_path, CONFIDENCE_THRESH=0.5):
+	def __init__(self, model_path, CONFIDENCE_THRESH=0.5, model_type="base"):
 		""" Using DeepLabCut(DLC), a pose estimation toolbox, to locate the 
-		anchor points of the training module in camera view """
+		anchor points of the training module in camera view
+		model_type: DLCLive inference backend ('base', 'tflite', 'tensorrt', 'onnx') """
 
 		if not os.path.isdir(model_path):
 			raise ValueError(f'Weights path "{model_path}" does not point to a file.')
 
-		self.model = DLCLive(model_path, display = False)
+		# note: tflite needs a fixed input size (frames are resized to 640x360 before TM detection)
+		self.model = DLCLive(model_path, model_type = model_type, tflite_input_shape = (360, 640), display = False)
 		self.model.init_inference()
 		self.CONFIDENCE_THRESH = CONFIDENCE_THRESH
 		print('Successfully loaded in DetectTMwDLC model!\n')
@@ -31,6 +33,24 @@ class DetectTMAnchorPts():
 
 		dlcresults = self.model.get_pose(np.array([gsframe]))
 
+		return self.parse_result(dlcresults, width, height)
+
+
+	def run_inference_batch(self, frames):
+		""" run_inference of each frame of [frames] (same size) with a single network run """
+		height, width = frames[0].shape[:2]
+
+		# convert frames to 3-channel grayscale
+		gsframes = [cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2RGB) for frame in frames]
+
+		poses = self.model.get_pose_batch(np.array(gsframes))
+
+		return [self.parse_result(dlcresults, width, height) for dlcresults in poses]
+
+
+	def parse_result(self, dlcresults, width, height):
+		""" check anchor points [dlcresults] of a frame of [width] x [height], returns TM position or None """
+
 		# most important tm_markers are 0 and 8
 		if dlcresults[0,2] < self.CONFIDENCE_THRESH or dlcresults[8,2] < self.CONFIDENCE_THRESH:
 			return None
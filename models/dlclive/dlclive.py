@@ -30,6 +30,7 @@ from dlclive.graph import (
     get_output_tensors,
     extract_graph,
 )
+from dlclive.onnx_export import get_onnx_file, convert_to_onnx
 from dlclive.pose import extract_cnn_output, argmax_pose_predict, multi_pose_predict
 from dlclive.display import Display
 from dlclive import utils
@@ -47,10 +48,23 @@ class DLCLive(object):
         Full path to exported model directory
 
     model_type: string, optional
-        which model to use: 'base', 'tensorrt' for tensorrt optimized graph, 'lite' for tensorflow lite optimized graph
+        which model to use: 'base', 'tensorrt' for tensorrt optimized graph, 'tflite' for tensorflow lite optimized graph,
+        'onnx' for onnxruntime inference (uses the .onnx file in the model directory, or converts the .pb graph if there is none)
 
     precision : string, optional
-        precision of model weights, only for model_type='tensorrt'. Can be 'FP16' (default), 'FP32', or 'INT8'
+        precision of model weights, only for model_type='tensorrt' or 'tflite'. Can be 'FP16', 'FP32' (default), or 'INT8'.
+        For model_type='tflite', 'FP16' and 'INT8' apply post-training quantization; 'INT8' requires calibration_frames
+
+    tflite_input_shape : tuple of int, optional
+        (height, width) of the processed frames fed to the tensorflow lite model. Tensorflow lite does not support
+        dynamic input sizes, so either this or a frame passed to init_inference is required when model_type='tflite'
+
+    calibration_frames : :class:`numpy.ndarray` or list, optional
+        sample frames (e.g. training module crops) used as the representative dataset for 'INT8' quantization
+
+    num_threads : int, optional
+        number of threads used by the tensorflow lite interpreter or the onnxruntime intra-op thread pool.
+        If None, onnxruntime uses the number of SCC slots ($NSLOTS) when set, and tensorflow lite picks its own default
 
     cropping : list of int
         cropping parameters in pixel number: [x1, x2, y1, y2]
@@ -97,6 +111,8 @@ class DLCLive(object):
         "dynamic",
         "resize",
         "processor",
+        "tflite_input_shape",
+        "num_threads",
     )
 
     def __init__(
@@ -105,6 +121,9 @@ class DLCLive(object):
         model_type="base",
         precision="FP32",
         tf_config=None,
+        tflite_input_shape=None,
+        calibration_frames=None,
+        num_threads=None,
         cropping=None,
         dynamic=(False, 0.5, 10),
         resize=None,
@@ -121,6 +140,9 @@ class DLCLive(object):
         self.model_type = model_type
         self.tf_config = tf_config
         self.precision = precision
+        self.tflite_input_shape = tflite_input_shape
+        self.calibration_frames = calibration_frames
+        self.num_threads = num_threads
         self.cropping = cropping
         self.dynamic = dynamic
         self.dynamic_cropping = None
@@ -137,13 +159,14 @@ class DLCLive(object):
         self.inputs = None
         self.outputs = None
         self.tflite_interpreter = None
+        self.onnx_session = None
         self.pose = None
         self.is_initialized = False
 
         # checks
 
         if self.model_type == "tflite" and self.dynamic[0]:
-            self.dynamic[0] = False
+            self.dynamic = (False,) + tuple(self.dynamic[1:])
             warnings.warn(
                 "Dynamic cropping is not supported for tensorflow lite inference. Dynamic cropping will not be used...",
                 DLCLiveWarning,
@@ -252,23 +275,32 @@ class DLCLive(object):
         # get model file
         # print(self.path)
 
-        model_file = glob.glob(os.path.normpath(self.path + "/*.pb"))[0]
-        if not os.path.isfile(model_file):
+        model_files = glob.glob(os.path.normpath(self.path + "/*.pb"))
+        model_file = model_files[0] if model_files else None
+        onnx_file = get_onnx_file(self.path) if self.model_type == "onnx" else None
+        if (model_file is None or not os.path.isfile(model_file)) and onnx_file is None:
             raise FileNotFoundError(
-                "The model file {} does not exist.".format(model_file)
+                "No model file was found in {}.".format(self.path)
             )
 
         # process frame
 
-        if frame is None and (self.model_type == "tflite"):
+        if frame is None and self.model_type == "tflite" and self.tflite_input_shape is None:
             raise DLCLiveError(
-                "No image was passed to initialize inference. An image must be passed to the init_inference method"
+                "No image was passed to initialize inference. An image or tflite_input_shape must be passed to initialize a tflite model"
             )
 
         if frame is not None:
-            if frame.ndim == 2:
+            # accept either a single image or a batch of images
+            if frame.ndim == 4:
+                batch = frame
+            else:
+                batch = np.expand_dims(frame, axis=0)
+            if batch.ndim == 3:
                 self.convert2rgb = True
-            #processed_frame = self.process_frame(frame)
+            processed_frame = self.process_frame(batch[0])
+            if self.model_type == "tflite":
+                self.tflite_input_shape = processed_frame.shape[:2]
 
         # load model
 
@@ -293,12 +325,32 @@ class DLCLive(object):
             graph = finalize_graph(graph_def)
             output_nodes = get_output_nodes(graph)
             output_nodes = [on.replace("DLC/", "") for on in output_nodes]
-            converter = tf.lite.TFLiteConverter.from_frozen_graph(
+            height, width = self.tflite_input_shape
+            converter = tf.compat.v1.lite.TFLiteConverter.from_frozen_graph(
                 model_file,
                 ["Placeholder"],
                 output_nodes,
-                input_shapes={"Placeholder": [1, processed_frame.shape[0], processed_frame.shape[1], 3]},
+                input_shapes={"Placeholder": [1, height, width, 3]},
             )
+
+            # post-training quantization
+            if self.precision == "FP16":
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.target_spec.supported_types = [tf.float16]
+            elif self.precision == "INT8":
+                if self.calibration_frames is None or len(self.calibration_frames) == 0:
+                    raise DLCLiveError(
+                        "INT8 quantization of a tflite model requires calibration_frames"
+                    )
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = self._representative_dataset
+            elif self.precision != "FP32":
+                raise DLCLiveError(
+                    "precision = {} is not supported for tflite. precision must be 'FP32', 'FP16', or 'INT8'".format(
+                        self.precision
+                    )
+                )
+
             try:
                 tflite_model = converter.convert()
             except Exception:
@@ -311,10 +363,20 @@ class DLCLive(object):
                     )
                 )
 
-            self.tflite_interpreter = tf.lite.Interpreter(model_content=tflite_model)
+            self.tflite_interpreter = tf.lite.Interpreter(
+                model_content=tflite_model, num_threads=self.num_threads
+            )
             self.tflite_interpreter.allocate_tensors()
             self.inputs = self.tflite_interpreter.get_input_details()
-            self.outputs = self.tflite_interpreter.get_output_details()
+
+            # keep outputs in the same order as the graph (score map first, then location refinement)
+            output_details = self.tflite_interpreter.get_output_details()
+            self.outputs = sorted(
+                output_details,
+                key=lambda od: output_nodes.index(od["name"])
+                if od["name"] in output_nodes
+                else len(output_nodes),
+            )
 
         elif self.model_type == "tensorrt":
 
@@ -344,10 +406,46 @@ class DLCLive(object):
                 graph, tf_config=self.tf_config
             )
 
+        elif self.model_type == "onnx":
+
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise DLCLiveError(
+                    "onnxruntime must be installed to use model_type = 'onnx'"
+                )
+
+            sess_options = ort.SessionOptions()
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            sess_options.inter_op_num_threads = 1
+            num_threads = self.num_threads
+            if num_threads is None and "NSLOTS" in os.environ:
+                num_threads = int(os.environ["NSLOTS"])
+            if num_threads:
+                sess_options.intra_op_num_threads = num_threads
+
+            if onnx_file is not None:
+                model_content = onnx_file
+            else:
+                warnings.warn(
+                    "No .onnx file found in {}. Converting the .pb model in memory; "
+                    "use tools/convert_dlc_to_onnx.py to save the converted model.".format(self.path),
+                    DLCLiveWarning,
+                )
+                model_content = convert_to_onnx(self.path).SerializeToString()
+
+            self.onnx_session = ort.InferenceSession(
+                model_content, sess_options=sess_options, providers=["CPUExecutionProvider"]
+            )
+            # outputs are ordered as in the graph (score map first, then location refinement)
+            self.inputs = self.onnx_session.get_inputs()[0].name
+            self.outputs = [out.name for out in self.onnx_session.get_outputs()]
+
         else:
 
             raise DLCLiveError(
-                "model_type = {} is not supported. model_type must be 'base', 'tflite', or 'tensorrt'".format(
+                "model_type = {} is not supported. model_type must be 'base', 'tflite', 'tensorrt', or 'onnx'".format(
                     self.model_type
                 )
             )
@@ -355,7 +453,7 @@ class DLCLive(object):
         # get pose of first frame (first inference is often very slow)
 
         if frame is not None:
-            pose = self.get_pose(frame, **kwargs)
+            pose = self.get_pose(batch, **kwargs)
         else:
             pose = None
 
@@ -363,14 +461,27 @@ class DLCLive(object):
 
         return pose
 
+    def _representative_dataset(self):
+        """
+        Yields processed calibration frames for tensorflow lite INT8 quantization
+        """
+
+        for frame in self.calibration_frames:
+            processed_frame = self.process_frame(frame)
+            if processed_frame.shape[:2] != tuple(self.tflite_input_shape):
+                processed_frame = cv2.resize(
+                    processed_frame, (self.tflite_input_shape[1], self.tflite_input_shape[0])
+                )
+            yield [np.expand_dims(processed_frame, axis=0).astype(np.float32)]
+
     def get_pose(self, batch=None, **kwargs):
         """
         Get the pose of an image
 
         Parameters
         -----------
-        frame :class:`numpy.ndarray`
-            image as a numpy array
+        batch :class:`numpy.ndarray`
+            batch of images as a numpy array (num_frames, height, width, channels)
 
         Returns
         --------
@@ -378,11 +489,69 @@ class DLCLive(object):
             the pose estimated by DeepLabCut for the input image
         """
 
-        num_frames, height, width, _ = batch.shape
+        pose_output = self._run_network(batch)
+
+        # check if using TFGPUinference flag
+        # if not, get pose from network output
+        if len(pose_output) > 1:
+            scmap, locref = extract_cnn_output(pose_output, self.cfg)
+            num_outputs = self.cfg.get("num_outputs", 1)
+            if num_outputs > 1:
+                self.pose = multi_pose_predict(
+                    scmap, locref, self.cfg["stride"], num_outputs
+                )
+            else:
+                self.pose = argmax_pose_predict(scmap, locref, self.cfg["stride"])
+        else:
+            pose = np.array(pose_output[0])
+            self.pose = pose[:, [1, 0, 2]]
+
+        return self.pose
+
+    def get_pose_batch(self, batch):
+        """
+        Get the pose of each image of a batch with a single network run
+
+        Parameters
+        -----------
+        batch :class:`numpy.ndarray`
+            batch of images as a numpy array (num_frames, height, width, channels)
+
+        Returns
+        --------
+        poses :class:`numpy.ndarray`
+            pose of each image (num_frames, num_body_parts, 3)
+        """
+
+        pose_output = self._run_network(batch)
+        num_frames = batch.shape[0]
+
+        if len(pose_output) > 1:
+            poses = []
+            for i in range(num_frames):
+                scmap, locref = extract_cnn_output([output[i:i+1] for output in pose_output], self.cfg)
+                num_outputs = self.cfg.get("num_outputs", 1)
+                if num_outputs > 1:
+                    poses.append(multi_pose_predict(scmap, locref, self.cfg["stride"], num_outputs))
+                else:
+                    poses.append(argmax_pose_predict(scmap, locref, self.cfg["stride"]))
+            self.pose = np.array(poses)
+        else:
+            pose = np.array(pose_output[0]).reshape(num_frames, -1, 3)
+            self.pose = pose[:, :, [1, 0, 2]]
+
+        return self.pose
+
+    def _run_network(self, batch):
+        """
+        Process frames of batch and run the network, returns the network outputs
+        """
 
         if batch is None:
             raise DLCLiveError("No frame provided for live pose estimation")
 
+        num_frames, height, width, _ = batch.shape
+
         start = time.time()
         processed_batch = []
         for i in range(num_frames):
@@ -400,53 +569,51 @@ class DLCLive(object):
 
         elif self.model_type == "tflite":
 
-            self.tflite_interpreter.set_tensor(
-                self.inputs[0]["index"],
-                np.expand_dims(frame, axis=0).astype(np.float32),
-            )
-            self.tflite_interpreter.invoke()
+            if processed_batch.shape[1:3] != tuple(self.tflite_input_shape):
+                raise DLCLiveError(
+                    "Frame size {} does not match the fixed tflite input size {}".format(
+                        processed_batch.shape[1:3], tuple(self.tflite_input_shape)
+                    )
+                )
 
-            if len(self.outputs) > 1:
-                pose_output = [
-                    self.tflite_interpreter.get_tensor(self.outputs[0]["index"]),
-                    self.tflite_interpreter.get_tensor(self.outputs[1]["index"]),
-                ]
-            else:
-                pose_output = self.tflite_interpreter.get_tensor(
-                    self.outputs[0]["index"]
+            # tflite model has a fixed batch size of 1, run each frame of the batch separately
+            frame_outputs = []
+            for processed_frame in processed_batch:
+                self.tflite_interpreter.set_tensor(
+                    self.inputs[0]["index"],
+                    np.expand_dims(processed_frame, axis=0).astype(np.float32),
+                )
+                self.tflite_interpreter.invoke()
+                frame_outputs.append(
+                    [self.tflite_interpreter.get_tensor(out["index"]) for out in self.outputs]
                 )
+            pose_output = [np.concatenate(outs, axis=0) for outs in zip(*frame_outputs)]
+
+        elif self.model_type == "onnx":
+
+            pose_output = self.onnx_session.run(
+                self.outputs, {self.inputs: processed_batch.astype(np.float32)}
+            )
 
         else:
 
             raise DLCLiveError(
-                "model_type = {} is not supported. model_type must be 'base', 'tflite', or 'tensorrt'".format(
+                "model_type = {} is not supported. model_type must be 'base', 'tflite', 'tensorrt', or 'onnx'".format(
                     self.model_type
                 )
             )
 
-        # check if using TFGPUinference flag
-        # if not, get pose from network output
-        if len(pose_output) > 1:
-            scmap, locref = extract_cnn_output(pose_output, self.cfg)
-            num_outputs = self.cfg.get("num_outputs", 1)
-            if num_outputs > 1:
-                self.pose = multi_pose_predict(
-                    scmap, locref, self.cfg["stride"], num_outputs
-                )
-            else:
-                self.pose = argmax_pose_predict(scmap, locref, self.cfg["stride"])
-        else:
-            pose = np.array(pose_output[0])
-            self.pose = pose[:, [1, 0, 2]]
-
-        return self.pose
+        return pose_output
 
     def close(self):
         """ Close tensorflow session
         """
 
-        self.sess.close()
+        if self.sess is not None:
+            self.sess.close()
         self.sess = None
+        self.tflite_interpreter = None
+        self.onnx_session = None
         self.is_initialized = False
         if self.display is not None:
             self.display.destroy()
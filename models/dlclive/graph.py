@@ -6,6 +6,7 @@ Licensed under GNU Lesser General Public License v3.0
 """
 
 
+import os
 import tensorflow as tf
 
 vers = (tf.__version__).split(".")
@@ -119,7 +120,9 @@ def extract_graph(graph, tf_config=None):
     -----------
     graph :class:`tensorflow.Graph`
         a tensorflow graph containing the desired model
-    tf_config :class:`tensorflow.ConfigProto`
+    tf_config :class:`tensorflow.ConfigProto`, optional
+        session configuration. If None, a default configuration is created that uses the thread pool sizes
+        in the TF_NUM_INTRAOP_THREADS / TF_NUM_INTEROP_THREADS environment variables (if set)
 
     Returns
     --------
@@ -132,9 +135,14 @@ def extract_graph(graph, tf_config=None):
     input_tensor = get_input_tensor(graph)
     output_tensor = get_output_tensors(graph)
 
-    tf_config = tf.ConfigProto()
-    tf_config.gpu_options.per_process_gpu_memory_fraction = 1.0
-    tf_config.gpu_options.allow_growth = True
+    if tf_config is None:
+        tf_config = tf.ConfigProto()
+        tf_config.gpu_options.per_process_gpu_memory_fraction = 1.0
+        tf_config.gpu_options.allow_growth = True
+        if "TF_NUM_INTRAOP_THREADS" in os.environ:
+            tf_config.intra_op_parallelism_threads = int(os.environ["TF_NUM_INTRAOP_THREADS"])
+        if "TF_NUM_INTEROP_THREADS" in os.environ:
+            tf_config.inter_op_parallelism_threads = int(os.environ["TF_NUM_INTEROP_THREADS"])
 
     sess = tf.Session(graph=graph, config=tf_config)
     inputs = graph.get_tensor_by_name(input_tensor)
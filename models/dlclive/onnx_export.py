@@ -0,0 +1,86 @@
+"""
+Conversion of exported DeepLabCut models (frozen .pb graphs) to ONNX
+for inference with onnxruntime
+"""
+
+
+import glob
+import os
+
+from dlclive.graph import (
+    read_graph,
+    finalize_graph,
+    get_input_tensor,
+    get_output_tensors,
+)
+from dlclive.exceptions import DLCLiveError
+
+
+def get_onnx_file(model_path):
+    """
+    Get the path to an ONNX model in an exported model directory
+
+    Parameters
+    -----------
+    model_path : string
+        Full path to exported model directory
+
+    Returns
+    --------
+    onnx_file : string
+        path to the .onnx file, or None if the directory does not contain one
+    """
+
+    onnx_files = glob.glob(os.path.normpath(model_path + "/*.onnx"))
+    return onnx_files[0] if onnx_files else None
+
+
+def convert_to_onnx(model_path, onnx_file=None, opset=11):
+    """
+    Convert the frozen graph of an exported DeepLabCut model to ONNX.
+    The batch, height and width dimensions of the input are kept dynamic.
+
+    Parameters
+    -----------
+    model_path : string
+        Full path to exported model directory
+    onnx_file : string, optional
+        path to save the converted model. If None, the model is only converted in memory
+    opset : int, optional
+        ONNX opset version used for conversion
+
+    Returns
+    --------
+    model_proto :class:`onnx.ModelProto`
+        the converted ONNX model
+    """
+
+    try:
+        import tf2onnx
+    except ImportError:
+        raise DLCLiveError(
+            "tf2onnx must be installed to convert DeepLabCut models to ONNX"
+        )
+
+    pb_files = glob.glob(os.path.normpath(model_path + "/*.pb"))
+    if not pb_files:
+        raise FileNotFoundError(
+            "No .pb model file found in {}".format(model_path)
+        )
+
+    graph_def = read_graph(pb_files[0])
+    graph = finalize_graph(graph_def)
+
+    # tensor names without the "DLC/" prefix added by finalize_graph
+    input_names = [get_input_tensor(graph).replace("DLC/", "")]
+    output_names = [ot.replace("DLC/", "") for ot in get_output_tensors(graph)]
+
+    model_proto, _ = tf2onnx.convert.from_graph_def(
+        graph_def,
+        input_names=input_names,
+        output_names=output_names,
+        opset=opset,
+        output_path=onnx_file,
+    )
+
+    return model_proto
@@ -2,8 +2,16 @@ import cv2
 import numpy as np
 import os
 
-def led_movement_check(frame, prev_frame, led_position, DEBUG = False):
+def get_movement_crop_size(led_position, resolution):
+	""" size (width, height) in pixels of LED region [led_position] at [resolution] (native resolution of video) """
+	x, y, w, h = led_position
+	return max(1, int(w*resolution[0])), max(1, int(h*resolution[1]))
+
+
+def led_movement_check(frame, prev_frame, led_position, DEBUG = False, crop_size = None):
 	""" check frame difference between previous and current frame 
+	crop_size: (width, height) the LED crops are resized to before differencing (see get_movement_crop_size), so the
+	2x2 noise suppression and the pixel count of frames decoded below native resolution keep the scale of native frames
 	TODO: current logic for checking camera movement can be improved ... 
 	"""
 
@@ -14,6 +22,9 @@ def led_movement_check(frame, prev_frame, led_position, DEBUG = False):
 
 	prev_frame = prev_frame.copy()[y:y+h, x:x+w]
 	frame = frame.copy()[y:y+h, x:x+w]
+	if crop_size is not None and frame.shape[1::-1] != tuple(crop_size):
+		prev_frame = cv2.resize(prev_frame, tuple(crop_size), interpolation = cv2.INTER_LINEAR)
+		frame = cv2.resize(frame, tuple(crop_size), interpolation = cv2.INTER_LINEAR)
 	og_frame = frame.copy()
 
 	prev_frame = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2HLS)
@@ -0,0 +1,95 @@
+"""
+Mask R-CNN
+Vectorized box utilities: IoU matrices and non-maximum suppression.
+
+Pure NumPy (and optionally OpenCV) so they can be shared by the Mask R-CNN
+utilities and the YOLO post-processing (detect_objects.py) without
+importing TensorFlow.
+"""
+
+import numpy as np
+import cv2
+
+# non-maximum suppression implementations
+NMS_BACKENDS = ['numpy', 'opencv']
+
+
+def compute_overlaps(boxes1, boxes2):
+    """Computes IoU overlaps between two sets of boxes.
+    boxes1, boxes2: [N, (y1, x1, y2, x2)].
+
+    Returns [boxes1 count, boxes2 count] float64 matrix of IoU values,
+    computed in a single broadcast instead of one pass per box.
+    """
+    return iou_matrix(boxes1, boxes2).astype(np.float64)
+
+
+def iou_matrix(boxes1, boxes2):
+    """IoU matrix of two sets of boxes [N, (y1, x1, y2, x2)] in the dtype of
+    the boxes (float64 for integer boxes).
+    """
+    # Areas of both sets of boxes
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+
+    # Intersection areas [boxes1 count, boxes2 count]
+    y1 = np.maximum(boxes2[None, :, 0], boxes1[:, None, 0])
+    y2 = np.minimum(boxes2[None, :, 2], boxes1[:, None, 2])
+    x1 = np.maximum(boxes2[None, :, 1], boxes1[:, None, 1])
+    x2 = np.minimum(boxes2[None, :, 3], boxes1[:, None, 3])
+    intersection = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    union = area2[None, :] + area1[:, None] - intersection
+    return intersection / union
+
+
+def non_max_suppression(boxes, scores, threshold, backend='numpy'):
+    """Performs non-maximum suppression and returns indices of kept boxes
+    (highest score first).
+    boxes: [N, (y1, x1, y2, x2)]. Notice that (y2, x2) lays outside the box.
+    scores: 1-D array of box scores.
+    threshold: Float. IoU threshold to use for filtering.
+    backend: 'numpy' (IoU matrix, same result as the greedy loop) or
+        'opencv' (cv2.dnn.NMSBoxes).
+    """
+    assert boxes.shape[0] > 0
+    if backend not in NMS_BACKENDS:
+        raise ValueError("NMS backend {} must be one of {}".format(backend, NMS_BACKENDS))
+    if boxes.dtype.kind != "f":
+        boxes = boxes.astype(np.float32)
+
+    if backend == 'opencv':
+        xywh = np.stack([boxes[:, 1], boxes[:, 0], boxes[:, 3] - boxes[:, 1], boxes[:, 2] - boxes[:, 0]], axis=1)
+        score_threshold = float(np.min(scores)) - 1.0
+        pick = cv2.dnn.NMSBoxes(xywh.astype(np.float64).tolist(), np.asarray(scores, dtype=np.float64).tolist(),
+                                score_threshold, float(threshold))
+        return np.array(pick, dtype=np.int32).reshape(-1)
+
+    # Boxes sorted by scores (highest first) and their IoU matrix
+    ixs = scores.argsort()[::-1]
+    overlaps = iou_matrix(boxes[ixs], boxes[ixs])
+
+    # Greedy selection: every kept box suppresses the boxes it overlaps
+    suppressed = np.zeros(len(ixs), dtype=bool)
+    pick = []
+    for i in range(len(ixs)):
+        if suppressed[i]:
+            continue
+        pick.append(ixs[i])
+        suppressed |= overlaps[i] > threshold
+    return np.array(pick, dtype=np.int32)
+
+
+def non_max_suppression_xywh(boxes, scores, iou_threshold, score_threshold=None, backend='numpy'):
+    """Non-maximum suppression of [N, (x, y, w, h)] boxes (OpenCV/YOLO format).
+    Boxes with a score not above score_threshold are dropped first, like
+    cv2.dnn.NMSBoxes. Returns indices of kept boxes (highest score first).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    candidates = np.arange(len(boxes)) if score_threshold is None else np.flatnonzero(scores > score_threshold)
+    if not len(candidates):
+        return np.zeros(0, dtype=np.int32)
+
+    x, y, w, h = boxes[candidates].T
+    pick = non_max_suppression(np.stack([y, x, y + h, x + w], axis=1), scores[candidates], iou_threshold, backend=backend)
+    return candidates[pick].astype(np.int32)
@@ -2415,7 +2415,7 @@ class MaskRCNN(object):
         return molded_images, image_metas, windows
 
     def unmold_detections(self, detections, mrcnn_mask, original_image_shape,
-                          image_shape, window):
+                          image_shape, window, unmold_masks=True):
         """Reformats the detections of one image from the format of the neural
         network output to a format suitable for use in the rest of the
         application.
@@ -2426,12 +2426,15 @@ class MaskRCNN(object):
         image_shape: [H, W, C] Shape of the image after resizing and padding
         window: [y1, x1, y2, x2] Pixel coordinates of box in the image where the real
                 image is excluding the padding.
+        unmold_masks: If False, the small masks of the network are returned
+                instead of full size masks (see utils.unmold_dilated_mask).
 
         Returns:
         boxes: [N, (y1, x1, y2, x2)] Bounding boxes in pixels
         class_ids: [N] Integer class IDs for each bounding box
         scores: [N] Float probability scores of the class_id
-        masks: [height, width, num_instances] Instance masks
+        masks: [height, width, num_instances] Instance masks, or
+               [num_instances, mask height, mask width] if not unmold_masks
         """
         # How many detections do we have?
         # Detections array is padded with zeros. Find the first class_id == 0.
@@ -2459,23 +2462,20 @@ class MaskRCNN(object):
 
         # Filter out detections with zero area. Happens in early training when
         # network weights are still random
-        exclude_ix = np.where(
-            (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) <= 0)[0]
-        if exclude_ix.shape[0] > 0:
-            boxes = np.delete(boxes, exclude_ix, axis=0)
-            class_ids = np.delete(class_ids, exclude_ix, axis=0)
-            scores = np.delete(scores, exclude_ix, axis=0)
-            masks = np.delete(masks, exclude_ix, axis=0)
+        keep = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) > 0
+        if not keep.all():
+            boxes, class_ids, scores, masks = boxes[keep], class_ids[keep], scores[keep], masks[keep]
             N = class_ids.shape[0]
 
+        if not unmold_masks:
+            return boxes, class_ids, scores, masks
+
         # Resize masks to original image size and set boundary threshold.
-        full_masks = []
+        full_masks = np.zeros(original_image_shape[:2] + (N,), dtype=bool)
         for i in range(N):
             # Convert neural network mask to full size mask
-            full_mask = utils.unmold_mask(masks[i], boxes[i], original_image_shape)
-            full_masks.append(full_mask)
-        full_masks = np.stack(full_masks, axis=-1)\
-            if full_masks else np.empty(original_image_shape[:2] + (0,))
+            y1, x1, y2, x2 = boxes[i]
+            full_masks[y1:y2, x1:x2, i] = utils.unmold_box_mask(masks[i], boxes[i])
 
         return boxes, class_ids, scores, full_masks
 
@@ -2537,6 +2537,76 @@ class MaskRCNN(object):
             })
         return results
 
+    def detect_batched(self, images, verbose=0, unmold_masks=True):
+        """Runs the detection pipeline on any number of images.
+
+        Images are run through the network BATCH_SIZE at a time. The last
+        partial batch is padded with copies of its last molded image and
+        the results of the padding are discarded. All images must have the
+        same size after resizing.
+
+        images: List of images.
+        unmold_masks: If False, masks are the small masks of the network
+            [N, mask height, mask width] (see unmold_detections).
+
+        Returns a list of dicts, one dict per image, same as detect().
+        """
+        assert self.mode == "inference", "Create model in inference mode."
+        batch_size = self.config.BATCH_SIZE
+
+        results = []
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            num_images = len(batch)
+
+            if verbose:
+                log("Processing {} images".format(num_images))
+                for image in batch:
+                    log("image", image)
+
+            # Mold inputs to format expected by the neural network
+            molded_images, image_metas, windows = self.mold_inputs(batch)
+
+            # Validate image sizes
+            # All images in a batch MUST be of the same size
+            image_shape = molded_images[0].shape
+            for g in molded_images[1:]:
+                assert g.shape == image_shape,\
+                    "After resizing, all images must have the same size. Check IMAGE_RESIZE_MODE and image sizes."
+
+            # Pad partial batch
+            num_padding = batch_size - num_images
+            if num_padding:
+                molded_images = np.concatenate(
+                    [molded_images, np.repeat(molded_images[-1:], num_padding, axis=0)])
+                image_metas = np.concatenate(
+                    [image_metas, np.repeat(image_metas[-1:], num_padding, axis=0)])
+
+            # Anchors (cached per image shape)
+            anchors = self.get_anchors(image_shape)
+            anchors = np.broadcast_to(anchors, (batch_size,) + anchors.shape)
+
+            if verbose:
+                log("molded_images", molded_images)
+                log("image_metas", image_metas)
+                log("anchors", anchors)
+            # Run object detection
+            detections, _, _, mrcnn_mask, _, _, _ =\
+                self.keras_model.predict([molded_images, image_metas, anchors], verbose=0)
+            # Process detections of the real images only
+            for i, image in enumerate(batch):
+                final_rois, final_class_ids, final_scores, final_masks =\
+                    self.unmold_detections(detections[i], mrcnn_mask[i],
+                                           image.shape, molded_images[i].shape,
+                                           windows[i], unmold_masks=unmold_masks)
+                results.append({
+                    "rois": final_rois,
+                    "class_ids": final_class_ids,
+                    "scores": final_scores,
+                    "masks": final_masks,
+                })
+        return results
+
     def detect_molded(self, molded_images, image_metas, verbose=0):
         """Runs the detection pipeline, but expect inputs that are
         molded already. Used mostly for debugging and inspecting
@@ -2597,11 +2667,11 @@ class MaskRCNN(object):
 
     def get_anchors(self, image_shape):
         """Returns anchor pyramid for the given image size."""
-        backbone_shapes = compute_backbone_shapes(self.config, image_shape)
         # Cache anchors and reuse if image shape is the same
         if not hasattr(self, "_anchor_cache"):
             self._anchor_cache = {}
         if not tuple(image_shape) in self._anchor_cache:
+            backbone_shapes = compute_backbone_shapes(self.config, image_shape)
             # Generate Anchors
             a = utils.generate_pyramid_anchors(
                 self.config.RPN_ANCHOR_SCALES,
@@ -13,6 +13,7 @@ import logging
 import math
 import random
 import numpy as np
+import cv2
 import tensorflow as tf
 import scipy
 import skimage.color
@@ -23,6 +24,8 @@ import shutil
 import warnings
 from distutils.version import LooseVersion
 
+from mrcnn import box_utils
+
 # URL from which to download the latest COCO trained weights
 COCO_MODEL_URL = "https://github.com/matterport/Mask_RCNN/releases/download/v2.0/mask_rcnn_coco.h5"
 
@@ -82,19 +85,10 @@ def compute_overlaps(boxes1, boxes2):
     """Computes IoU overlaps between two sets of boxes.
     boxes1, boxes2: [N, (y1, x1, y2, x2)].
 
-    For better performance, pass the largest set first and the smaller second.
+    Returns matrix [boxes1 count, boxes2 count], each cell contains the IoU
+    value (vectorized, see box_utils.compute_overlaps).
     """
-    # Areas of anchors and GT boxes
-    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
-    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
-
-    # Compute overlaps to generate matrix [boxes1 count, boxes2 count]
-    # Each cell contains the IoU value.
-    overlaps = np.zeros((boxes1.shape[0], boxes2.shape[0]))
-    for i in range(overlaps.shape[1]):
-        box2 = boxes2[i]
-        overlaps[:, i] = compute_iou(box2, boxes1, area2[i], area1)
-    return overlaps
+    return box_utils.compute_overlaps(boxes1, boxes2)
 
 
 def compute_overlaps_masks(masks1, masks2):
@@ -119,41 +113,15 @@ def compute_overlaps_masks(masks1, masks2):
     return overlaps
 
 
-def non_max_suppression(boxes, scores, threshold):
+def non_max_suppression(boxes, scores, threshold, backend='numpy'):
     """Performs non-maximum suppression and returns indices of kept boxes.
     boxes: [N, (y1, x1, y2, x2)]. Notice that (y2, x2) lays outside the box.
     scores: 1-D array of box scores.
     threshold: Float. IoU threshold to use for filtering.
+    backend: 'numpy' (IoU matrix) or 'opencv' (cv2.dnn.NMSBoxes), see
+        box_utils.non_max_suppression.
     """
-    assert boxes.shape[0] > 0
-    if boxes.dtype.kind != "f":
-        boxes = boxes.astype(np.float32)
-
-    # Compute box areas
-    y1 = boxes[:, 0]
-    x1 = boxes[:, 1]
-    y2 = boxes[:, 2]
-    x2 = boxes[:, 3]
-    area = (y2 - y1) * (x2 - x1)
-
-    # Get indicies of boxes sorted by scores (highest first)
-    ixs = scores.argsort()[::-1]
-
-    pick = []
-    while len(ixs) > 0:
-        # Pick top box and add its index to the list
-        i = ixs[0]
-        pick.append(i)
-        # Compute IoU of the picked box with the rest
-        iou = compute_iou(boxes[i], boxes[ixs[1:]], area[i], area[ixs[1:]])
-        # Identify boxes with IoU over the threshold. This
-        # returns indices into ixs[1:], so add 1 to get
-        # indices into ixs.
-        remove_ixs = np.where(iou > threshold)[0] + 1
-        # Remove indices of the picked and overlapped boxes.
-        ixs = np.delete(ixs, remove_ixs)
-        ixs = np.delete(ixs, 0)
-    return np.array(pick, dtype=np.int32)
+    return box_utils.non_max_suppression(boxes, scores, threshold, backend=backend)
 
 
 def apply_box_deltas(boxes, deltas):
@@ -565,17 +533,75 @@ def unmold_mask(mask, bbox, image_shape):
 
     Returns a binary mask with the same size as the original image.
     """
-    threshold = 0.5
     y1, x1, y2, x2 = bbox
-    mask = resize(mask, (y2 - y1, x2 - x1))
-    mask = np.where(mask >= threshold, 1, 0).astype(np.bool)
+    mask = unmold_box_mask(mask, bbox)
 
     # Put the mask in the right location.
-    full_mask = np.zeros(image_shape[:2], dtype=np.bool)
+    full_mask = np.zeros(image_shape[:2], dtype=bool)
     full_mask[y1:y2, x1:x2] = mask
     return full_mask
 
 
+def unmold_box_mask(mask, bbox):
+    """Resizes a mask generated by the neural network to its box.
+    mask: [height, width] of type float. A small, typically 28x28 mask.
+    bbox: [y1, x1, y2, x2]. The box to fit the mask in.
+
+    Returns a binary mask [y2 - y1, x2 - x1].
+    """
+    threshold = 0.5
+    y1, x1, y2, x2 = bbox
+    # Bilinear resize with OpenCV (much faster than skimage for small masks)
+    return cv2.resize(mask.astype(np.float32), (int(x2 - x1), int(y2 - y1)),
+                      interpolation=cv2.INTER_LINEAR) >= threshold
+
+
+def unmold_dilated_mask(mask, bbox, image_shape, output_shape,
+                        dilation_kernel=None, dilation_anchor=(-1, -1)):
+    """Converts a mask generated by the neural network to a dilated binary
+    mask of a (possibly larger) output image, without building masks of the
+    full image at the network resolution.
+
+    The mask is resized into its box, thresholded and dilated in the box
+    region only (plus a margin of the kernel size) at the resolution of
+    the network input, and that region is scaled to the output image.
+
+    mask: [height, width] of type float. A small, typically 28x28 mask.
+    bbox: [y1, x1, y2, x2]. The box to fit the mask in (network input pixels).
+    image_shape: [H, W] of the network input image.
+    output_shape: [H, W] of the output mask.
+    dilation_kernel: structuring element for cv2.dilate, or None.
+    dilation_anchor: anchor of dilation_kernel.
+
+    Returns (y1, x1, region): uint8 0/255 mask [region_height, region_width]
+    whose top left corner is at (y1, x1) of the output image.
+    """
+    height, width = image_shape[:2]
+    y1, x1, y2, x2 = [int(v) for v in bbox]
+
+    # Region of the box plus dilation margin
+    margin = max(dilation_kernel.shape) if dilation_kernel is not None else 0
+    ry1, rx1 = max(0, y1 - margin), max(0, x1 - margin)
+    ry2, rx2 = min(height, y2 + margin), min(width, x2 + margin)
+
+    region = np.zeros((ry2 - ry1, rx2 - rx1), dtype=np.uint8)
+    region[y1 - ry1:y2 - ry1, x1 - rx1:x2 - rx1][unmold_box_mask(mask, bbox)] = 255
+    if dilation_kernel is not None:
+        region = cv2.dilate(region, dilation_kernel, anchor=dilation_anchor)
+
+    # Scale region to output image
+    out_height, out_width = output_shape[:2]
+    if (out_height, out_width) == (height, width):
+        return ry1, rx1, region
+    sy, sx = out_height / height, out_width / width
+    oy1, ox1 = int(math.floor(ry1 * sy)), int(math.floor(rx1 * sx))
+    oy2 = min(out_height, int(math.ceil(ry2 * sy)))
+    ox2 = min(out_width, int(math.ceil(rx2 * sx)))
+    region = cv2.resize(region, (ox2 - ox1, oy2 - oy1), interpolation=cv2.INTER_LINEAR)
+    region[region > 0] = 255
+    return oy1, ox1, region
+
+
 ############################################################
 #  Anchors
 ############################################################
@@ -0,0 +1,192 @@
+import datetime
+import time
+import numpy as np
+
+import utils
+from object_mask import ObjectMask
+from models.timestamp_ocr import TimestampOCR
+
+""" deterministic stub model backends used to run the training module pipeline without model weights
+(profiling/regression testing of the pipeline itself). Each stub sleeps for a configurable latency to emulate
+inference cost and returns configurable, deterministic outputs. See models/backends.py for the registry """
+
+# default outputs of stub detectors (normalized x, y, w, h); match benchmarks/synthetic_video.py
+LED_POSITION = (0.05, 0.05, 0.04, 0.07)
+TM_POSITION = (0.3, 0.0, 0.45, 0.8)
+
+# default cage positions (normalized x, y, w, h, left -> right) of stub cage segmentation
+CAGE_POSITIONS = ((0.05, 0.1, 0.4, 0.8), (0.55, 0.1, 0.4, 0.8))
+
+# timestamp barcode drawn by synthetic videos: seconds since BARCODE_EPOCH encoded as BARCODE_BITS black/white blocks
+BARCODE_EPOCH = datetime.datetime(2000, 1, 1)
+BARCODE_BITS = 32
+BARCODE_ORIGIN = (0.01, 0.962)  # normalized x, y of first block
+BARCODE_BLOCK = (0.012, 0.033)  # normalized width, height of each block
+
+
+def encode_barcode(frame, dt):
+    """ draw barcode of datetime [dt] (second precision) onto frame """
+
+    height, width = frame.shape[:2]
+    value = int((dt - BARCODE_EPOCH).total_seconds())
+    bw, bh = BARCODE_BLOCK[0] * width, BARCODE_BLOCK[1] * height
+    y1, y2 = int(BARCODE_ORIGIN[1] * height), int(BARCODE_ORIGIN[1] * height + bh)
+    for bit in range(BARCODE_BITS):
+        x1 = int(BARCODE_ORIGIN[0] * width + bit * bw)
+        x2 = int(BARCODE_ORIGIN[0] * width + (bit + 1) * bw)
+        color = 255 if (value >> bit) & 1 else 0
+        frame[y1:y2, x1:x2] = color
+    return frame
+
+
+def decode_barcode(frame):
+    """ read datetime from barcode in frame (any resolution, 3 channels or grayscale) """
+
+    if frame.ndim == 3:
+        frame = frame.mean(axis=2)
+    height, width = frame.shape[:2]
+    bw, bh = BARCODE_BLOCK[0] * width, BARCODE_BLOCK[1] * height
+    y = int(BARCODE_ORIGIN[1] * height + bh / 2)
+    value = 0
+    for bit in range(BARCODE_BITS):
+        x = int(BARCODE_ORIGIN[0] * width + (bit + 0.5) * bw)
+        if frame[y, x] > 127:
+            value |= 1 << bit
+    return BARCODE_EPOCH + datetime.timedelta(seconds=value)
+
+
+class StubLEDDetector():
+    def __init__(self, latency=0.0, led_position=LED_POSITION):
+        """ replaces YOLO LED detection (detect_objects.ObjectDetector) """
+        self.latency = latency
+        self.led_position = tuple(led_position) if led_position is not None else None
+
+    def run_inference(self, frame):
+        time.sleep(self.latency)
+        return self.led_position
+
+    def run_inference_batch(self, frames):
+        return [self.run_inference(frame=frame) for frame in frames]
+
+
+class StubTMAnchorPts():
+    def __init__(self, latency=0.0, tm_position=TM_POSITION):
+        """ replaces DetectTMAnchorPts """
+        self.latency = latency
+        self.tm_position = tuple(tm_position)
+
+    def run_inference(self, frame):
+        time.sleep(self.latency)
+        height, width = frame.shape[:2]
+        x, y, w, h = self.tm_position
+
+        # 9 training module anchor points along the outline
+        xs = np.linspace(x, x + w, 9) * width
+        ys = np.full(9, (y + h) * height)
+        dlcresults = np.stack([xs, ys, np.ones(9)], axis=1)
+
+        padding_for_aspect_ratio = utils.resize_cropped_frame(position=self.tm_position, max_width=width,
+                                                              max_height=height, aspect_ratio=400/300)
+        return {'dlc_marker_positions': dlcresults, 'original_tm_position': self.tm_position,
+                'padding_for_aspect_ratio': padding_for_aspect_ratio}
+
+    def run_inference_batch(self, frames):
+        return [self.run_inference(frame=frame) for frame in frames]
+
+
+class StubCoatClassifier():
+    def __init__(self, latency=0.0, label='black', confidence=0.99):
+        """ replaces CoatClassifier """
+        self.latency = latency
+        self.label = label
+        self.confidence = confidence
+
+    def run_inference(self, frame):
+        time.sleep(self.latency)
+        return self.label, self.confidence
+
+
+class StubMousePose():
+    def __init__(self, latency=0.0, num_body_parts=12):
+        """ replaces DetectMousePose, pose is derived from the frame so it is deterministic """
+        self.latency = latency
+        self.num_body_parts = num_body_parts
+
+    def run_inference(self, frame, key):
+        time.sleep(self.latency)
+
+        # darkest pixel (mouse) as location of all body parts
+        gsframe = frame.mean(axis=2) if frame.ndim == 3 else frame
+        y, x = np.unravel_index(np.argmin(gsframe), gsframe.shape)
+        pose = np.zeros((self.num_body_parts, 3))
+        pose[:, 0] = x + np.arange(self.num_body_parts)
+        pose[:, 1] = y
+        pose[:, 2] = 0.9
+        return pose
+
+    def run_inference_batch(self, frames, key):
+        return np.array([self.run_inference(frame=frame, key=key) for frame in frames])
+
+
+class StubCageSegmentation():
+    def __init__(self, latency=0.0, cage_positions=CAGE_POSITIONS, segmentation_batch_size=1):
+        """ replaces Mask R-CNN cage segmentation (cv_segmentation.MaskRCNNCageView), rectangular cage masks """
+        self.latency = latency
+        self.batch_size = segmentation_batch_size
+        self.cage_positions = [tuple(position) for position in cage_positions]
+
+    def run_inference(self, frame, DEBUG=False):
+        time.sleep(self.latency)
+        height, width = frame.shape[:2]
+
+        object_results = []
+        for position in self.cage_positions:
+            x, y, w, h = position
+            x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
+            mask = ObjectMask(shape=(height, width), bbox=(x, y, w, h), bits=np.packbits(np.ones((h, w), dtype=bool), axis=-1))
+            object_results.append({'position': position, 'mask': mask})
+        return object_results
+
+    def run_inference_batch(self, frames, DEBUG=False):
+        return [self.run_inference(frame=frame) for frame in frames]
+
+
+class StubTimestampOCR(TimestampOCR):
+    def __init__(self, camera_view='TM', latency=0.0, timestamp_source='fixed', timestamp='2022-03-10 12:00:00'):
+        """ replaces Tesseract in TimestampOCR. The real frame processing (crop, threshold, change detection) runs,
+        but Tesseract does not
+
+        timestamp_source: 'barcode' to read the timestamp from the barcode of synthetic videos (benchmarks),
+            'fixed' to always return [timestamp] (format YYYY-MM-DD HH:MM:SS)
+        """
+
+        if camera_view == 'TM':
+            self.ocrposition = [0.74, 0.98, 0.962, 0.995]
+        elif camera_view == 'CV':
+            self.ocrposition = [0.75, 1.0, 0.965, 1.0]
+        else:
+            raise ValueError("camera_view doesn't match enumerate (TM, CV)")
+
+        if timestamp_source not in ['barcode', 'fixed']:
+            raise ValueError("timestamp_source must be either 'barcode' or 'fixed'")
+
+        self.latency = latency
+        self.timestamp_source = timestamp_source
+        self.timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+        self.prev_frame = np.array([])
+        self.prev_timestamp = {"text_from_img": None, "datetime_object": None}
+        self.last_run_ocr = False
+
+    def run_inference(self, frame, DEBUG=False):
+        _, run_ocr = self.process_frame(frame=frame.copy())
+        self.last_run_ocr = run_ocr
+
+        if run_ocr:
+            time.sleep(self.latency)
+            datetime_object = decode_barcode(frame) if self.timestamp_source == 'barcode' else self.timestamp
+            text_from_img = datetime_object.strftime('%m %d %Y %H:%M:%S')
+            self.prev_timestamp = {"text_from_img": text_from_img, "datetime_object": datetime_object}
+        else:
+            datetime_object = self.prev_timestamp["datetime_object"]
+
+        return datetime_object
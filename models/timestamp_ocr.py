@@ -6,9 +6,12 @@ import re
 import tesserocr
 import time
 
+import runtime_config
+
 class TimestampOCR():
-	def __init__(self, camera_view, model_path):
-		""" Object that holds the Tesserocr(optical character recognition) api to run on timestamps for each frame """
+	def __init__(self, camera_view, model_path, lang="ts_fast"):
+		""" Object that holds the Tesserocr(optical character recognition) api to run on timestamps for each frame
+		[lang]: name of traineddata in [model_path] (ts_fast: model trained on RevoTech timestamps) """
 
 		# depending on the camera view, the timestamp is slighly in a different location in frame ( these are hardcoded positions of the timestamp based on camera GUI [RevoTech])
 		if camera_view == 'TM':
@@ -22,7 +25,7 @@ class TimestampOCR():
 		# path = r"C:\Users\Abed\OneDrive\Documents\tesstrain/data/", 
 		self.tess_api = tesserocr.PyTessBaseAPI(
 			path = model_path, 
-			lang="ts_fast", 
+			lang=lang, 
 			oem = tesserocr.OEM.LSTM_ONLY
 		)
 
@@ -31,6 +34,9 @@ class TimestampOCR():
 		# allocate previous data variables to save for later
 		self.prev_frame = np.array([])
 		self.prev_timestamp = {"text_from_img": None, "datetime_object": None}
+
+		# whether tesseract ran for the last frame (False if timestamp was unchanged and previous result was reused)
+		self.last_run_ocr = False
 		print('Successfully loaded in Tesserocr API!\n')
 
 
@@ -45,7 +51,8 @@ class TimestampOCR():
 		# note: change accordingly if position of timestamp changes! currently position of timestamp in videos/live feed are static
 		height, width = frame.shape[:2]
 
-		frame = frame[int(height*self.ocrposition[2]):int(height*self.ocrposition[3]), int(width*self.ocrposition[0]):int(width*self.ocrposition[1])]
+		rows, cols = self.get_timestamp_region(height = height, width = width)
+		frame = frame[rows, cols]
 
 		# manually remove backslashes '/' from image
 		height, width = frame.shape[:2]
@@ -87,6 +94,11 @@ class TimestampOCR():
 		return frame, run_ocr
 
 
+	def get_timestamp_region(self, height, width):
+		""" row and column slices of timestamp in frame of size height x width """
+		return slice(int(height*self.ocrposition[2]), int(height*self.ocrposition[3])), slice(int(width*self.ocrposition[0]), int(width*self.ocrposition[1]))
+
+
 	def raw_inference(self, frame, process_frame = False):
 		""" run ocr on frame without checking string results """
 
@@ -94,9 +106,10 @@ class TimestampOCR():
 			# process frame
 			frame, _ = self.process_frame(frame = frame)
 
-		# run tesserocr
-		self.tess_api.SetImage(frame)
-		text_from_img = self.tess_api.GetUTF8Text()
+		# run tesserocr (OpenMP threads of tesseract limited to this call)
+		with runtime_config.limit_openmp_threads(runtime_config.TESSERACT_THREADS):
+			self.tess_api.SetImage(frame)
+			text_from_img = self.tess_api.GetUTF8Text()
 
 		return text_from_img
 
@@ -106,6 +119,7 @@ class TimestampOCR():
 
 		# prepare frame for ocr(tesseract)
 		frame, run_ocr = self.process_frame(frame = frame)
+		self.last_run_ocr = run_ocr
 		
 		if run_ocr:
 
@@ -114,10 +128,10 @@ class TimestampOCR():
 				cv2.imshow('DEBUG(tesserocr) {}x{}'.format(height, width), np.array(frame))
 				cv2.waitKey(0)
 
-			# run tesserocr
-			self.tess_api.SetImage(frame)
-
-			text_from_img = self.tess_api.GetUTF8Text()
+			# run tesserocr (OpenMP threads of tesseract limited to this call)
+			with runtime_config.limit_openmp_threads(runtime_config.TESSERACT_THREADS):
+				self.tess_api.SetImage(frame)
+				text_from_img = self.tess_api.GetUTF8Text()
 
 			# parse string predicted and convert to datetime object
 			datetime_object = self.parse_timestamp(timestamp = text_from_img)
@@ -0,0 +1,65 @@
+import numpy as np
+
+""" multi-frame consensus localization of the LED and training module (TM) at the start of a video
+Instead of taking the first frame where both detectors succeed (up to 100 frames with both networks run on each),
+LOCALIZATION_NUM_FRAMES frames spread over the first LOCALIZATION_SEC seconds are run through LED YOLO and the TM anchor
+DLC model as one batch each. The position of each object is the median of its detections; detections further than a
+tolerance from the median (ex. hand in front of the camera, LED glare) are outliers and left out of the median. The
+confidence score is the fraction of sampled frames in which both objects were detected and agree with the consensus """
+
+# number of frames sampled and length (seconds) of start of video they are spread over
+LOCALIZATION_NUM_FRAMES = 8
+LOCALIZATION_SEC = 10
+
+# largest difference (normalized x, y, w, h) of a detection from the median position to agree with the consensus
+LED_POSITION_TOLERANCE = 0.01
+TM_POSITION_TOLERANCE = 0.02
+
+# minimum confidence score of consensus, below it objects are searched frame by frame
+LOCALIZATION_MIN_CONFIDENCE = 0.5
+
+
+def sample_frame_indices(num_frames, num_samples):
+    """ up to [num_samples] frame indices spread evenly over the first [num_frames] frames, starting at frame 0 """
+
+    if num_frames <= 0 or num_samples <= 0:
+        return []
+    indices = np.linspace(0, num_frames - 1, num=min(num_samples, num_frames)).round().astype(int)
+    return sorted(set(indices.tolist()))
+
+
+def consensus_position(positions, tolerance):
+    """ median of [positions] (x, y, w, h, None if not detected) without outliers and boolean inlier mask of positions
+    returns (None, mask) if there is no consensus """
+
+    detected = np.array([position is not None for position in positions], dtype=bool)
+    inliers = np.zeros(len(positions), dtype=bool)
+    if not detected.any():
+        return None, inliers
+
+    values = np.array([position for position in positions if position is not None], dtype=np.float64)
+    agree = np.abs(values - np.median(values, axis=0)).max(axis=1) <= tolerance
+    if not agree.any():
+        return None, inliers
+
+    inliers[detected] = agree
+    return tuple(float(value) for value in np.median(values[agree], axis=0)), inliers
+
+
+def localize_objects(led_positions, tm_detections):
+    """ consensus of LED positions and TM detections (see DetectTMAnchorPts.run_inference) of sampled frames
+    returns {'led_position', 'tm_detection', 'confidence', 'sample_idx'} or None if no frame agrees on both objects
+    tm_detection: detection of the agreeing frame closest to the median TM position (its anchor points and padding match it)
+    sample_idx: first sampled frame agreeing on both objects """
+
+    led_position, led_inliers = consensus_position(led_positions, LED_POSITION_TOLERANCE)
+    tm_positions = [tm_detection['original_tm_position'] if tm_detection is not None else None for tm_detection in tm_detections]
+    tm_position, tm_inliers = consensus_position(tm_positions, TM_POSITION_TOLERANCE)
+
+    agree = np.flatnonzero(led_inliers & tm_inliers)
+    if not len(agree):
+        return None
+
+    distances = [np.abs(np.array(tm_positions[i]) - tm_position).max() for i in agree]
+    return {'led_position': led_position, 'tm_detection': tm_detections[agree[int(np.argmin(distances))]],
+            'confidence': len(agree) / len(led_positions), 'sample_idx': int(agree[0])}
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+""" compact binary mask of an object (ex. cage) in a frame
+Only the bounding box of the mask is stored, bit-packed along rows (np.packbits, 8 pixels per byte), instead of a
+full resolution uint8 frame. apply_to(frame) masks the pixels of the bounding box only. Masks are serialized for
+.mat/HDF5 outputs and caches as the frame shape, the bounding box and the run-length encoding of the box mask
+(row-major run lengths, starting with a run of 0s) """
+
+
+class ObjectMask():
+    __slots__ = ['shape', 'bbox', 'bits', '_box_mask']
+
+    def __init__(self, shape, bbox, bits):
+        """ mask of frame of [shape] (height, width), [bbox] (x, y, w, h pixels) and bit-packed rows of box mask [bits] """
+
+        self.shape = tuple(int(v) for v in shape[:2])
+        self.bbox = tuple(int(v) for v in bbox)
+        self.bits = bits
+        self._box_mask = None  # unpacked 0/255 box mask, see box_mask()
+
+    @classmethod
+    def from_region(cls, shape, y, x, region):
+        """ mask of frame of [shape] from nonzero pixels of [region] with top left corner at (y, x) """
+
+        region = np.asarray(region) > 0
+        rows, cols = np.flatnonzero(region.any(axis=1)), np.flatnonzero(region.any(axis=0))
+        if not len(rows):
+            return cls(shape, (x, y, 0, 0), np.zeros((0, 0), dtype=np.uint8))
+        region = region[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]
+        bbox = x + cols[0], y + rows[0], region.shape[1], region.shape[0]
+        return cls(shape, bbox, np.packbits(region, axis=-1))
+
+    @classmethod
+    def from_array(cls, mask):
+        """ mask from full frame array (nonzero = object) """
+        return cls.from_region(mask.shape, 0, 0, mask)
+
+    @classmethod
+    def from_rle(cls, shape, bbox, counts):
+        """ mask from run-length encoding of box mask (see to_rle) """
+
+        x, y, w, h = [int(v) for v in bbox]
+        values = np.arange(len(counts)) % 2 == 1
+        box_mask = np.repeat(values, np.asarray(counts, dtype=np.int64)).reshape(h, w)
+        return cls(shape, bbox, np.packbits(box_mask, axis=-1))
+
+    @classmethod
+    def from_dict(cls, data):
+        """ mask from dictionary of to_dict """
+        return cls.from_rle(shape=data['shape'], bbox=data['bbox'], counts=np.ravel(data['counts']))
+
+    @property
+    def area(self):
+        """ number of mask pixels """
+        return int(np.unpackbits(self.bits).sum()) if self.bits.size else 0
+
+    def box_mask(self):
+        """ 0/255 uint8 mask of bounding box (unpacked once) """
+
+        if self._box_mask is None:
+            w, h = self.bbox[2:]
+            box_mask = np.unpackbits(self.bits, axis=-1, count=w) if h and w else np.zeros((h, w), dtype=np.uint8)
+            self._box_mask = box_mask * np.uint8(255)
+        return self._box_mask
+
+    def to_array(self):
+        """ full frame 0/255 uint8 mask """
+
+        x, y, w, h = self.bbox
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        mask[y:y+h, x:x+w] = self.box_mask()
+        return mask
+
+    def crop(self, x, y, w, h):
+        """ mask restricted to box (x, y, w, h pixels) of frame, the bounding box of the returned mask is that box """
+
+        bx, by, bw, bh = self.bbox
+        box_mask = np.zeros((h, w), dtype=bool)
+        x1, y1, x2, y2 = max(x, bx), max(y, by), min(x + w, bx + bw), min(y + h, by + bh)
+        if x1 < x2 and y1 < y2:
+            box_mask[y1-y:y2-y, x1-x:x2-x] = self.box_mask()[y1-by:y2-by, x1-bx:x2-bx] > 0
+        return ObjectMask(self.shape, (x, y, w, h), np.packbits(box_mask, axis=-1))
+
+    def apply_to(self, frame, out=None):
+        """ bounding box region of [frame] with pixels outside of the mask set to 0 (only box pixels are read/written)
+        written to [out] (box size) if given """
+
+        x, y, w, h = self.bbox
+        roi = frame[y:y+h, x:x+w]
+        if out is None:
+            return cv2.bitwise_and(roi, roi, mask=self.box_mask())
+        return cv2.bitwise_and(roi, roi, dst=out, mask=self.box_mask())
+
+    def to_rle(self):
+        """ row-major run lengths of box mask, starting with a run of 0s """
+
+        flat = self.box_mask().ravel() > 0
+        if not flat.size:
+            return np.zeros(0, dtype=np.uint32)
+        boundaries = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]])
+        counts = np.diff(boundaries)
+        if flat[0]:
+            counts = np.concatenate([[0], counts])
+        return counts.astype(np.uint32)
+
+    def to_dict(self):
+        """ serializable dictionary (.mat struct/HDF5 attributes): frame shape, bounding box and RLE counts """
+        return {'shape': np.array(self.shape), 'bbox': np.array(self.bbox), 'counts': self.to_rle()}
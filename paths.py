@@ -10,12 +10,27 @@ folder_paths['errortm'] = r'Z:\Projects\Homecage\DLCVideos\trainingmodule_errors
 # path to save generated .MAT files (training module)
 folder_paths['matfiletm'] = r'Z:\Projects\Homecage\DLCVideos\trainingmodule_matfiles'
 
+# path to save consolidated HDF5 file of all trials per video (training module)
+folder_paths['hdf5tm'] = r'Z:\Projects\Homecage\DLCVideos\trainingmodule_hdf5'
+
+# path to frame cache of trial frames for re-analysis (training module)
+folder_paths['framecachetm'] = r'Z:\Projects\Homecage\DLCVideos\trainingmodule_framecache'
+
+# path to stored segmentation/OCR results of trials for re-running only DLC (training module)
+folder_paths['stageresultstm'] = r'Z:\Projects\Homecage\DLCVideos\trainingmodule_stageresults'
+
+# path to stored LED/TM positions per rig, reused by later videos of rig (training module)
+folder_paths['roicalibrationtm'] = r'Z:\Projects\Homecage\DLCVideos\trainingmodule_roicalibration'
+
 # path to move any errors caught/exceptions (cageview)
 folder_paths['errorcv'] = r'Z:\Projects\Homecage\DLC\Other\cageview_errors'
 
 # path to save generated .MAT files (cageview)
 folder_paths['matfilecv'] = r'Z:\Projects\Homecage\DLC\Other\cageview_matfiles'
 
+# path to cached cage segmentation (Mask R-CNN positions and masks) per camera (cageview)
+folder_paths['segmentationcachecv'] = r'Z:\Projects\Homecage\DLC\Other\cageview_segmentationcache'
+
 
 # paths to different deep learning models used in analysis
 modelinfo = {}
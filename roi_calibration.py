@@ -0,0 +1,158 @@
+import base64
+import cv2
+import datetime
+import json
+import os
+import stat
+import tempfile
+import numpy as np
+
+from segmentation_cache import get_reference_frame, get_fingerprint, fingerprint_distance, registration_shift, \
+    FINGERPRINT_MAX_DISTANCE, REGISTRATION_MAX_SHIFT, REGISTRATION_MIN_RESPONSE
+from models.led_tracker import led_status_check, led_movement_check, get_movement_crop_size
+
+""" per-rig store of LED/TM positions (led_position, TM anchor points, original_tm_position, padding_for_aspect_ratio)
+Training module cameras are fixed most of the time, so the positions detected in a video of a rig are reused for its
+next videos instead of running LED YOLO and the TM anchor DLC model. Positions are validated on the first frame of the
+video without any network:
+    1. camera registration: fingerprint/phase correlation of the downsampled frame with the reference frame of the
+       entry (same checks as the cage segmentation cache, see segmentation_cache.py)
+    2. LED template: difference of the LED region with the stored LED patch (led_movement_check) must stay below the
+       camera movement threshold, unless the LED status changed (led_status_check), like camera_view_unstable does
+An entry is only replaced when the positions were detected again (new video with a moved camera, re-detection during
+a video), so small camera shifts accepted by the checks can't add up over many videos.
+
+store layout (one JSON file per rig camera, ex. TM_6.json):
+    version, camera_name, video (file name of video the positions were detected in), updated (ISO datetime),
+    led_position, tm_markers, original_tm_position, padding_for_aspect_ratio, resolution (width, height),
+    fingerprint, reference (PNG, base64) of downsampled grayscale frame, led_patch (PNG, base64) of LED region, led_status
+The file is written to a temporary file (unique per writer) and renamed, an incomplete entry is never read and
+unreadable entries are treated as missing """
+
+# bump when content of store changes (older entries are ignored)
+ROI_CALIBRATION_VERSION = 1
+
+# 'on': reuse stored positions and store new ones, 'refresh': always detect positions and store, 'off': no store
+ROI_CALIBRATION_MODES = ['on', 'refresh', 'off']
+
+
+def encode_image(image):
+    """ PNG of [image] as base64 string """
+    return base64.b64encode(cv2.imencode('.png', image)[1].tobytes()).decode('ascii')
+
+
+def decode_image(data):
+    """ image of base64 PNG string """
+    return cv2.imdecode(np.frombuffer(base64.b64decode(data), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def get_led_patch(frame, led_position):
+    """ LED region (pixels) of frame """
+    height, width = frame.shape[:2]
+    x, y, w, h = led_position
+    x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
+    return frame[y:y+h, x:x+w]
+
+
+class RoiCalibrationStore():
+    def __init__(self, store_folder, mode='on'):
+        """ LED/TM position store in [store_folder] (see ROI_CALIBRATION_MODES) """
+
+        if mode not in ROI_CALIBRATION_MODES:
+            raise ValueError("ROI calibration mode {} must be one of {}".format(mode, ROI_CALIBRATION_MODES))
+
+        self.store_folder = store_folder
+        self.mode = mode
+
+    def get_store_path(self, camera_name):
+        """ path to entry of rig camera """
+        return os.path.join(self.store_folder, camera_name + '.json')
+
+    def lookup(self, camera_name, rgbframe, movement_thresh, resolution):
+        """ stored positions of camera if they still match (RGB) [rgbframe], else None
+        [movement_thresh]: number of changed LED pixels (LED region at native [resolution] (width, height) of video)
+        considered camera movement (see led_movement_check)
+        returns {'led_position', 'tm_markers', 'original_tm_position', 'padding_for_aspect_ratio'} """
+
+        store_path = self.get_store_path(camera_name)
+        if self.mode != 'on' or not os.path.isfile(store_path):
+            return None
+
+        try:
+            with open(store_path, 'r') as fp:
+                entry = json.load(fp)
+            if entry.get('version') != ROI_CALIBRATION_VERSION:
+                return None
+            resolution = tuple(entry['resolution'])
+            led_position = tuple(float(value) for value in entry['led_position'])
+            calibration = {'led_position': led_position, 'tm_markers': np.array(entry['tm_markers'], dtype=np.float64),
+                           'original_tm_position': tuple(float(value) for value in entry['original_tm_position']),
+                           'padding_for_aspect_ratio': [entry['padding_for_aspect_ratio'][0], int(entry['padding_for_aspect_ratio'][1])]}
+            cached_reference, cached_led_patch = decode_image(entry['reference']), decode_image(entry['led_patch'])
+            cached_fingerprint, cached_led_status = str(entry['fingerprint']), int(entry['led_status'])
+            if cached_reference is None or cached_led_patch is None:
+                raise ValueError('invalid image')
+        except (OSError, ValueError, KeyError, TypeError, IndexError, AttributeError, cv2.error) as error:
+            print('(ROI CALIBRATION) Unreadable entry of camera {} ({}), LED/TM detection is re-run'.format(camera_name, error))
+            return None
+
+        if resolution != rgbframe.shape[1::-1]:
+            print('(ROI CALIBRATION) Frame size of {} changed, LED/TM detection is re-run'.format(camera_name))
+            return None
+
+        # camera registration
+        reference = get_reference_frame(rgbframe)
+        distance = fingerprint_distance(get_fingerprint(reference), cached_fingerprint)
+        if distance > FINGERPRINT_MAX_DISTANCE:
+            shift, response = registration_shift(cached_reference, reference)
+            if shift > REGISTRATION_MAX_SHIFT or response < REGISTRATION_MIN_RESPONSE:
+                print('(ROI CALIBRATION) Camera {} moved (fingerprint distance {}, shift {:.2f} px, response {:.2f}), LED/TM detection is re-run'.format(
+                    camera_name, distance, shift, response))
+                return None
+
+        # LED template (difference due to a change of LED status is not camera movement)
+        led_patch = get_led_patch(rgbframe, led_position)
+        crop_size = None if tuple(rgbframe.shape[1::-1]) == tuple(resolution) else get_movement_crop_size(led_position, resolution)
+        led_difference = led_movement_check(led_patch, cached_led_patch, (0, 0, 1, 1), crop_size=crop_size)
+        if led_difference > movement_thresh and led_status_check(frame=rgbframe, led_position=led_position) == cached_led_status:
+            print('(ROI CALIBRATION) LED of camera {} moved (difference {}), LED/TM detection is re-run'.format(camera_name, led_difference))
+            return None
+
+        print('(ROI CALIBRATION) Reusing LED/TM positions of camera {} (detected in {})'.format(camera_name, entry.get('video')))
+        return calibration
+
+    def store(self, camera_name, video_file_name, rgbframe, led_position, tm_markers, original_tm_position, padding_for_aspect_ratio):
+        """ save positions detected in (RGB) [rgbframe] of video as entry of camera """
+
+        if self.mode == 'off':
+            return
+
+        reference = get_reference_frame(rgbframe)
+        entry = {
+            'version': ROI_CALIBRATION_VERSION,
+            'camera_name': camera_name,
+            'video': video_file_name,
+            'updated': datetime.datetime.now().isoformat(timespec='seconds'),
+            'led_position': [float(value) for value in led_position],
+            'tm_markers': np.asarray(tm_markers, dtype=np.float64).tolist(),
+            'original_tm_position': [float(value) for value in original_tm_position],
+            'padding_for_aspect_ratio': [padding_for_aspect_ratio[0], int(padding_for_aspect_ratio[1])],
+            'resolution': list(rgbframe.shape[1::-1]),
+            'fingerprint': get_fingerprint(reference),
+            'reference': encode_image(reference),
+            'led_patch': encode_image(get_led_patch(rgbframe, led_position)),
+            'led_status': led_status_check(frame=rgbframe, led_position=led_position),
+        }
+
+        os.makedirs(self.store_folder, exist_ok=True)
+        store_path = self.get_store_path(camera_name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_folder, prefix=camera_name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(entry, fp, indent=1)
+            os.chmod(tmp_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+            os.replace(tmp_path, store_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+""" precomputed crop/pad/resize of the training module (TM) region of a frame (DLC and coat recognition input)
+The TM region (original_tm_position) is cropped, padded with black pixels at the top ('y') or on the right ('x') to the
+aspect ratio of the ROI (padding_for_aspect_ratio, see utils.resize_cropped_frame) and resized to 400x300.
+RoiTransform computes the integer crop and a fixed-point cv2.remap map of the padded resize once per TM position; every
+frame is then transformed with a single remap of the crop (a view of the frame) into the output buffer, without the
+padded copy of cv2.copyMakeBorder. Sampling positions are the ones of cv2.resize (bilinear, pixel centers aligned,
+clamped at the edges), quantized to 1/32 pixel by remap, so pixel values can differ by a gray level from
+copyMakeBorder + cv2.resize """
+
+# size (width, height) of TM ROI, DLC model was trained on 400x300 frames
+ROI_SIZE = (400, 300)
+
+
+def resize_coordinates(src_size, dst_size):
+    """ source coordinate of each destination pixel of a bilinear cv2.resize along one axis """
+    scale = src_size / dst_size
+    return np.clip((np.arange(dst_size) + 0.5) * scale - 0.5, 0, src_size - 1)
+
+
+class RoiTransform():
+    __slots__ = ['key', 'crop', 'map1', 'map2', 'size']
+
+    def __init__(self, position, padding, frame_shape, size=ROI_SIZE):
+        """ transform of TM region [position] (normalized x, y, w, h) with [padding] ('x'/'y', pixels) of frames of [frame_shape] to [size] """
+
+        height, width = frame_shape[:2]
+        self.key = (tuple(position), tuple(padding), (height, width))
+        self.size = tuple(size)
+
+        # integer crop (clipped to frame like numpy slicing)
+        x, y, w, h = position
+        x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
+        self.crop = (slice(y, y+h), slice(x, x+w))
+        crop_height, crop_width = len(range(height)[self.crop[0]]), len(range(width)[self.crop[1]])
+
+        # size of padded crop, pixels outside of crop are black (border of remap)
+        pad_top = padding[1] if padding[0] == 'y' else 0
+        pad_right = padding[1] if padding[0] == 'x' else 0
+        padded_width, padded_height = crop_width + pad_right, crop_height + pad_top
+
+        # source coordinates of cv2.resize of padded crop, relative to crop
+        map_x = resize_coordinates(padded_width, self.size[0]).astype(np.float32)
+        map_y = (resize_coordinates(padded_height, self.size[1]) - pad_top).astype(np.float32)
+        map_x, map_y = np.meshgrid(map_x, map_y)
+        self.map1, self.map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+    def matches(self, position, padding, frame_shape):
+        """ True if transform was computed for [position], [padding] and [frame_shape] """
+        return self.key == (tuple(position), tuple(padding), tuple(frame_shape[:2]))
+
+    def apply(self, frame, out=None):
+        """ ROI of [frame], written to [out] (array of ROI shape and frame dtype) if given """
+        return cv2.remap(frame[self.crop], self.map1, self.map2, cv2.INTER_LINEAR, dst=out,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+import os
+import sys
+
+""" central thread-pool and CPU affinity configuration for all inference engines (Tensorflow, OpenCV, Tesseract/OpenMP)
+note: OpenMP/BLAS read their thread environment variables when the native libraries are loaded, so they are set when
+this module is imported, sized by --num_threads/-nt of the command line (or NSLOTS). Import it before cv2, tensorflow
+or tesserocr (see training_module_wrapper.py). Tesseract's OpenMP threads are limited only around OCR calls
+(limit_openmp_threads), a process-wide OMP_THREAD_LIMIT would also limit Tensorflow/MKL and BLAS """
+
+# OpenMP threads per Tesseract call (OCR of small timestamp crops, where OpenMP overhead dominates)
+TESSERACT_THREADS = 1
+
+
+def get_num_slots():
+    """ number of cores available to this job (SGE sets NSLOTS to the -pe omp value) """
+
+    if "NSLOTS" in os.environ:
+        return max(1, int(os.environ["NSLOTS"]))
+    return os.cpu_count() or 1
+
+
+def parse_cpu_list(cpu_list):
+    """ parse cpu list string (ex. "0-3,8,10-11") into a sorted list of cpu ids """
+
+    cpus = set()
+    for part in str(cpu_list).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def get_requested_threads(argv=None):
+    """ value of --num_threads/-nt of command line [argv] (default: sys.argv), None if not given """
+
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--num_threads", '-nt', type=int, default=None)
+    try:
+        args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    except SystemExit:
+        return None
+    return args.num_threads
+
+
+def set_thread_environment(num_threads=None):
+    """ set thread environment variables read by OpenMP, BLAS and Tensorflow (only effective before they are loaded)
+    note: single-batch convolutions scale with intra-op threads, so Tensorflow gets all slots for intra-op
+    and a single inter-op thread """
+
+    num_threads = num_threads if num_threads else get_num_slots()
+
+    thread_env = {
+        'OMP_NUM_THREADS': num_threads,
+        'OPENBLAS_NUM_THREADS': num_threads,
+        'MKL_NUM_THREADS': num_threads,
+        'TF_NUM_INTRAOP_THREADS': num_threads,
+        'TF_NUM_INTEROP_THREADS': 1,
+    }
+
+    for key, value in thread_env.items():
+        os.environ[key] = str(value)
+
+    return thread_env
+
+
+@functools.lru_cache(maxsize=None)
+def get_openmp_runtime():
+    """ OpenMP runtime (libgomp, used by Tesseract), None if not available (looked up once) """
+
+    library_path = ctypes.util.find_library('gomp')
+    if library_path is None:
+        return None
+    try:
+        return ctypes.CDLL(library_path)
+    except OSError:
+        return None
+
+
+@contextlib.contextmanager
+def limit_openmp_threads(num_threads):
+    """ run block with at most [num_threads] OpenMP threads in parallel regions of the calling thread (ex. Tesseract OCR),
+    the previous number of threads is restored afterwards """
+
+    omp = get_openmp_runtime() if num_threads else None
+    if omp is None:
+        yield
+        return
+
+    previous = omp.omp_get_max_threads()
+    omp.omp_set_num_threads(int(num_threads))
+    try:
+        yield
+    finally:
+        omp.omp_set_num_threads(previous)
+
+
+def configure_runtime(num_threads=None, opencv_threads=None, tesseract_threads=1, cpu_affinity=None, verbose=True):
+    """ configure thread pools of all inference engines and (optionally) pin this worker to a set of cpus
+    returns dictionary of the effective settings
+
+    num_threads: number of threads for Tensorflow (default: NSLOTS or number of cpus), OpenMP/BLAS/MKL pools are sized
+        when this module is imported (--num_threads of the command line)
+    opencv_threads: number of threads for OpenCV (default: num_threads)
+    tesseract_threads: OpenMP threads per Tesseract call
+    cpu_affinity: cpu list string (ex. "0-3") to pin the worker to, None to leave affinity unchanged """
+
+    global TESSERACT_THREADS
+
+    num_threads = num_threads if num_threads else get_num_slots()
+    opencv_threads = opencv_threads if opencv_threads else num_threads
+    TESSERACT_THREADS = tesseract_threads
+
+    # pin worker to cpus (linux only)
+    if cpu_affinity is not None:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, parse_cpu_list(cpu_affinity))
+        else:
+            print("CPU affinity is not supported on {}, ignoring cpu_affinity={}".format(sys.platform, cpu_affinity))
+
+    # OpenMP/BLAS/MKL already read their environment when this module was imported
+    omp_num_threads = int(os.environ.get('OMP_NUM_THREADS', num_threads))
+    if omp_num_threads != num_threads:
+        print("OpenMP/BLAS thread pools were sized to {} threads on import of runtime_config, pass --num_threads on the command line".format(omp_num_threads))
+    # Tensorflow thread counts are read when models are loaded (DLC sessions)
+    thread_env = {'TF_NUM_INTRAOP_THREADS': num_threads, 'TF_NUM_INTEROP_THREADS': 1}
+    for key, value in thread_env.items():
+        os.environ[key] = str(value)
+
+    # opencv thread pool
+    import cv2
+    cv2.setNumThreads(opencv_threads)
+
+    # tensorflow (keras models run eagerly; DLC TF1 sessions read TF_NUM_*_THREADS in dlclive.graph.extract_graph)
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(thread_env['TF_NUM_INTRAOP_THREADS'])
+        tf.config.threading.set_inter_op_parallelism_threads(thread_env['TF_NUM_INTEROP_THREADS'])
+    except RuntimeError:
+        # tensorflow context was already initialized, thread pools can no longer be changed
+        print("Tensorflow already initialized, unable to change eager thread pools")
+
+    settings = {
+        'num_slots': get_num_slots(),
+        'tf_intra_op_threads': tf.config.threading.get_intra_op_parallelism_threads(),
+        'tf_inter_op_threads': tf.config.threading.get_inter_op_parallelism_threads(),
+        'opencv_threads': cv2.getNumThreads(),
+        'omp_num_threads': omp_num_threads,
+        'tesseract_threads': TESSERACT_THREADS,
+        'cpu_affinity': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None,
+    }
+
+    if verbose:
+        print("Runtime configuration:")
+        for key, value in settings.items():
+            print("    {}: {}".format(key, value))
+
+    return settings
+
+
+# apply thread environment of command line (or default) on import
+set_thread_environment(num_threads=get_requested_threads())
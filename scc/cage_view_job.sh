@@ -1,28 +1,35 @@
 #!/bin/bash -l
 
-#specify array job
-#$ -t 1-1
-
-#this makes it so you'll get an email at the (b)eginning of the job, (e)nd of the job, and on an (a)bort of the job
-#$ -m ea
-
 #this merges output and error files into one file
 #$ -j y
 
 #this sets the project for the script to be run under
 #$ -P jchenlab
 
+#number of cores to select
 #$ -pe omp 16
 
-#Specify the time limit
+#specify the time limit
 #$ -l h_rt=12:00:00
 
 #activate conda environment
 module load miniconda
 conda activate VideoAnalysisENV
 
-#temporary solution to deal with h5 files
-HDF5_USE_FILE_LOCKING='FALSE'
+#handle hdf5 files on scc
+export HDF5_USE_FILE_LOCKING='FALSE'
+
+#thread pools (Tensorflow, OpenCV, Tesseract) are sized from $NSLOTS in runtime_config.py
+
+slptime=$(echo "scale=4 ; ($RANDOM/32768) * 10" | bc)
+sleep $slptime
+
+if [ $2 = "task_array" ]; then
+	task_array="1"
+else
+	task_array="0"
+fi
 
 #run main python script
-python maincv.py
+cd ..
+python cage_view_wrapper.py --json_file_name $1 --task_array $task_array
\ No newline at end of file
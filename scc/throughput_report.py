@@ -0,0 +1,223 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+""" Aggregated throughput report across an SGE job array. Reads the per-video structured metrics
+(*.metrics.jsonl, written next to each job log by training_module_wrapper.py) from the log folder.
+Logs without metrics files (older runs) are parsed as a fallback; these only provide trials, elapsed time
+and failure causes (no node name, frame counts or OCR/DLC counters).
+
+Produces per-rig and per-node tables of frames/sec, trials/video, DLC skip ratio, OCR call ratio, failures
+and queue time (time from JSON creation/job submission to video start) with percentiles, to help choose
+batch_size, -pe omp and -tc values.
+
+Example of running Python script:
+python throughput_report.py -lf log -o report """
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Aggregated throughput report across an SGE job array",
+        epilog="python throughput_report.py -lf log"
+    )
+    parser.add_argument("--log_folder", '-lf', required=False, default=os.path.join(os.getcwd(), "log"), help='folder with job logs and metrics files.')
+    parser.add_argument("--output", '-o', required=False, default=None, help='prefix of CSV files to save tables.')
+    parser.add_argument("--no_log_fallback", '-nlf', action='store_true', help='only use structured metrics files.')
+    args = parser.parse_args()
+    return args.log_folder, args.output, args.no_log_fallback
+
+
+def get_rig_no(video_name):
+    """ rig number from video name (ex. TM_6.20220310_190000 -> 6) """
+    match = re.match(r'^[A-Za-z]+_(\d+)', str(video_name))
+    return int(match[1]) if match else None
+
+
+def get_submit_time(json_file):
+    """ datetime of JSON creation (job submission) from json file name created by collect_video_paths_helper.py """
+    match = re.search(r'_(\d{14})\.json$', str(json_file))
+    if match:
+        return datetime.datetime.strptime(match[1], '%m%d%Y%H%M%S')
+    return None
+
+
+def read_metrics_files(log_folder):
+    """ read all per-video metrics records """
+
+    rows = []
+    metrics_files = glob.glob(os.path.join(log_folder, "*.metrics.jsonl"))
+    for metrics_file in metrics_files:
+        with open(metrics_file) as fp:
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                counters = record.get('counters', {})
+                elapsed = record.get('elapsed_sec') or np.nan
+                frames = record.get('frames_processed') or np.nan
+
+                submit_time = get_submit_time(record.get('json_file'))
+                start_time = datetime.datetime.fromisoformat(record['start_time']) if record.get('start_time') else None
+                queue_time_min = (start_time - submit_time).total_seconds() / 60 if (submit_time and start_time) else np.nan
+
+                dlc_total = counters.get('dlc_inferences', 0) + counters.get('dlc_motion_skips', 0)
+                ocr_total = counters.get('ocr_calls', 0) + counters.get('ocr_skips', 0)
+
+                rows.append({
+                    'source': os.path.basename(metrics_file),
+                    'video': record.get('video'),
+                    'rig_no': record.get('rig_no') if record.get('rig_no') is not None else get_rig_no(record.get('video')),
+                    'host': record.get('host'),
+                    'status': record.get('status'),
+                    'error': record.get('error'),
+                    'elapsed_min': elapsed / 60,
+                    'frames': frames,
+                    'fps': frames / elapsed if elapsed and elapsed > 0 else np.nan,
+                    'trials': sum(1 for trial in record.get('trials', []) if trial.get('status') == 'saved'),
+                    'dlc_skip_ratio': counters.get('dlc_motion_skips', 0) / dlc_total if dlc_total else np.nan,
+                    'ocr_call_ratio': counters.get('ocr_calls', 0) / ocr_total if ocr_total else np.nan,
+                    'queue_time_min': queue_time_min,
+                })
+
+    return rows, metrics_files
+
+
+def parse_log_file(log_file):
+    """ parse unstructured log of a single array task (fallback when no metrics file exists) """
+
+    rows = []
+    current = None
+    in_error = False
+    mat_line = False  # last trial line was a .mat file (output format 'both' logs a .mat and an HDF5 line per trial)
+
+    with open(log_file, errors='ignore') as fp:
+        lines = fp.read().splitlines()
+
+    for line in lines:
+        loaded = re.match(r'^Video (\S+) successfully loaded!', line)
+        init_error = re.match(r'^Error during initialization of video analysis for (\S+)', line)
+        if loaded or init_error:
+            if current:
+                rows.append(current)
+            video = (loaded or init_error)[1]
+            video = video[:-4] if video.endswith('.mp4') else video
+            current = {'source': os.path.basename(log_file), 'video': video, 'rig_no': get_rig_no(video), 'host': None,
+                       'status': 'error' if init_error else 'incomplete', 'error': None, 'elapsed_min': np.nan,
+                       'frames': np.nan, 'fps': np.nan, 'trials': 0, 'dlc_skip_ratio': np.nan,
+                       'ocr_call_ratio': np.nan, 'queue_time_min': np.nan}
+            in_error = bool(init_error)
+            mat_line = False
+            continue
+
+        if current is None:
+            continue
+
+        if line.startswith('Saving trial data to') or line.startswith('Saved trial data to'):
+            current['trials'] += 1
+            mat_line = True
+        elif line.startswith('Appended trial data to'):
+            # HDF5 line of a trial already counted by its .mat line
+            if not mat_line:
+                current['trials'] += 1
+            mat_line = False
+        elif line.startswith('Elapsed time:'):
+            h, m, s = [int(x) for x in line.split('Elapsed time:')[1].strip().split(' ')[-1].split(':')]
+            current['elapsed_min'] = (h * 3600 + m * 60 + s) / 60
+            current['status'] = 'complete'
+        elif line.startswith('Error encountered for video'):
+            current['status'] = 'error'
+            in_error = True
+        elif in_error and re.match(r'^[A-Za-z_.]*(Error|Exception)\b', line):
+            # last exception line of traceback is the failure cause
+            current['error'] = line.strip()
+
+    if current:
+        rows.append(current)
+
+    return rows
+
+
+def percentile(q):
+    """ percentile aggregation function for pandas """
+    def _percentile(x):
+        return np.nanpercentile(x, q) if np.any(~np.isnan(x)) else np.nan
+    _percentile.__name__ = 'p{}'.format(q)
+    return _percentile
+
+
+def summarize(df, group_by):
+    """ throughput table grouped by [group_by] """
+
+    grouped = df.groupby(group_by, dropna=False)
+    table = grouped.agg(
+        videos=('video', 'count'),
+        failures=('status', lambda x: int((x == 'error').sum())),
+        fps_mean=('fps', 'mean'),
+        fps_p50=('fps', percentile(50)),
+        fps_p10=('fps', percentile(10)),
+        elapsed_min_p50=('elapsed_min', percentile(50)),
+        elapsed_min_p90=('elapsed_min', percentile(90)),
+        trials_per_video=('trials', 'mean'),
+        dlc_skip_ratio=('dlc_skip_ratio', 'mean'),
+        ocr_call_ratio=('ocr_call_ratio', 'mean'),
+        queue_time_min_p50=('queue_time_min', percentile(50)),
+        queue_time_min_p90=('queue_time_min', percentile(90)),
+    )
+    return table.round(3)
+
+
+if __name__ == "__main__":
+
+    log_folder, output, no_log_fallback = get_args()
+
+    rows, metrics_files = read_metrics_files(log_folder)
+    print("Read {} video records from {} metrics files".format(len(rows), len(metrics_files)))
+
+    if not no_log_fallback:
+        # parse logs without a corresponding metrics file
+        parsed_logs = 0
+        for log_file in glob.glob(os.path.join(log_folder, "*")):
+            if log_file.endswith(".metrics.jsonl") or not os.path.isfile(log_file):
+                continue
+            if os.path.isfile(log_file + ".metrics.jsonl"):
+                continue
+            log_rows = parse_log_file(log_file)
+            if log_rows:
+                rows.extend(log_rows)
+                parsed_logs += 1
+        print("Parsed {} logs without metrics files".format(parsed_logs))
+
+    if not rows:
+        print("No video records found in", log_folder)
+        exit()
+
+    df = pd.DataFrame(rows)
+
+    tables = {
+        'rig': summarize(df, 'rig_no'),
+        'node': summarize(df, 'host'),
+        'overall': summarize(df.assign(all='all'), 'all'),
+    }
+
+    # failure causes
+    failures = df[df['status'] == 'error']
+    tables['failures'] = failures.groupby(failures['error'].fillna('unknown')).size().sort_values(ascending=False).to_frame('videos')
+
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', 50)
+    for name, table in tables.items():
+        print("\n===== per {} =====".format(name) if name != 'failures' else "\n===== failure causes =====")
+        print(table.to_string())
+
+    if output:
+        for name, table in tables.items():
+            table.to_csv("{}_{}.csv".format(output, name))
+        df.to_csv("{}_videos.csv".format(output), index=False)
+        print("\nSaved tables with prefix", output)
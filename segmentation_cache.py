@@ -0,0 +1,154 @@
+import cv2
+import io
+import os
+import stat
+import tempfile
+import zipfile
+import zlib
+import numpy as np
+
+from object_mask import ObjectMask
+
+""" on-disk cache of Mask R-CNN segmentation results (object positions and dilated masks) per camera
+Cages don't move between recording sessions, so the segmentation of a camera is reused for every later video of the
+same camera (rig, camera view and cage IDs, ex. CV_5_12) instead of running Mask R-CNN (seconds per frame on CPU).
+Every entry keeps a downsampled grayscale reference frame of the video it was computed from. A new video reuses the
+entry if the difference hash (fingerprint) of its first frame is close to the one of the reference frame, or, if the
+fingerprint differs (ex. red/white cage light), if phase correlation with the reference frame finds no shift.
+Otherwise the camera moved and Mask R-CNN is re-run and the entry replaced.
+
+cache layout (one compressed .npz file per camera):
+    <cache_folder>/<camera_name>.npz    version, fingerprint, reference (gray uint8), positions (N, 4), mask_shape (height, width),
+                                        mask_bboxes (N, 4) and mask_bits_<i> (bit-packed box mask of object i, see object_mask.py)
+The file is written to a temporary file (unique per writer) and renamed, an incomplete entry is never read and
+unreadable entries are treated as missing """
+
+# bump when content of cache changes (older entries are ignored)
+SEGMENTATION_CACHE_VERSION = 2
+
+# 'on': reuse cached segmentation and store new ones, 'refresh': always re-run Mask R-CNN and store, 'off': no cache
+SEGMENTATION_CACHE_MODES = ['on', 'refresh', 'off']
+
+# size (width, height) of reference frame kept with each entry
+REFERENCE_SIZE = (160, 90)
+
+# maximum number of differing bits (of 64) between fingerprints of the same camera position
+FINGERPRINT_MAX_DISTANCE = 6
+
+# registration check: maximum shift (pixels of reference frame) and minimum phase correlation response of an unmoved camera
+REGISTRATION_MAX_SHIFT = 1.5
+REGISTRATION_MIN_RESPONSE = 0.2
+
+
+def get_camera_name(video_file_name):
+    """ camera part of video file name, key of cache entry (ex. CV_5_12.20220310_190000 -> CV_5_12) """
+    return video_file_name.split('.')[0]
+
+
+def get_reference_frame(frame):
+    """ downsampled grayscale copy of (RGB) frame """
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, REFERENCE_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def get_fingerprint(reference):
+    """ 64 bit difference hash (hex) of reference frame: sign of horizontal gradients of a 9x8 thumbnail """
+    thumbnail = cv2.resize(reference, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1]).tobytes().hex()
+
+
+def fingerprint_distance(fingerprint1, fingerprint2):
+    """ number of differing bits of two fingerprints """
+    return bin(int(fingerprint1, 16) ^ int(fingerprint2, 16)).count('1')
+
+
+def registration_shift(reference1, reference2):
+    """ translation (pixels) between two reference frames and response of phase correlation
+    frames are normalized to zero mean/unit variance so global lighting changes don't matter """
+
+    normalized = []
+    for reference in (reference1, reference2):
+        reference = reference.astype(np.float32)
+        normalized.append((reference - reference.mean()) / (reference.std() + 1e-6))
+    window = cv2.createHanningWindow(REFERENCE_SIZE, cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(normalized[0], normalized[1], window)
+    return float(np.hypot(dx, dy)), response
+
+
+class SegmentationCache():
+    def __init__(self, cache_folder, mode='on'):
+        """ segmentation cache in [cache_folder] (see SEGMENTATION_CACHE_MODES) """
+
+        if mode not in SEGMENTATION_CACHE_MODES:
+            raise ValueError("Segmentation cache mode {} must be one of {}".format(mode, SEGMENTATION_CACHE_MODES))
+
+        self.cache_folder = cache_folder
+        self.mode = mode
+
+    def get_cache_path(self, camera_name):
+        """ path to cache entry of camera """
+        return os.path.join(self.cache_folder, camera_name + '.npz')
+
+    def lookup(self, camera_name, frame):
+        """ cached segmentation of camera if it still matches (RGB) [frame], else None
+        returns list of {'position', 'mask'} like MaskRCNNCageView.run_inference """
+
+        cache_path = self.get_cache_path(camera_name)
+        if self.mode != 'on' or not os.path.isfile(cache_path):
+            return None
+
+        try:
+            with np.load(cache_path) as entry:
+                if int(entry['version']) != SEGMENTATION_CACHE_VERSION:
+                    return None
+                mask_shape = tuple(int(value) for value in entry['mask_shape'])
+                positions, cached_reference, cached_fingerprint = entry['positions'], entry['reference'], str(entry['fingerprint'])
+                masks = [ObjectMask(shape=mask_shape, bbox=bbox, bits=entry['mask_bits_{}'.format(i)]) for i, bbox in enumerate(entry['mask_bboxes'])]
+        except (OSError, ValueError, KeyError, TypeError, IndexError, EOFError, zipfile.BadZipFile, zlib.error) as error:
+            print('(SEGMENTATION CACHE) Unreadable entry of camera {} ({}), segmentation is re-run'.format(camera_name, error))
+            return None
+
+        if mask_shape != frame.shape[:2]:
+            print('(SEGMENTATION CACHE) Frame size of {} changed, segmentation is re-run'.format(camera_name))
+            return None
+
+        reference = get_reference_frame(frame)
+        distance = fingerprint_distance(get_fingerprint(reference), cached_fingerprint)
+        if distance > FINGERPRINT_MAX_DISTANCE:
+            shift, response = registration_shift(cached_reference, reference)
+            if shift > REGISTRATION_MAX_SHIFT or response < REGISTRATION_MIN_RESPONSE:
+                print('(SEGMENTATION CACHE) Camera {} moved (fingerprint distance {}, shift {:.2f} px, response {:.2f}), segmentation is re-run'.format(
+                    camera_name, distance, shift, response))
+                return None
+
+        print('(SEGMENTATION CACHE) Reusing segmentation of camera {}'.format(camera_name))
+        return [{'position': tuple(float(value) for value in position), 'mask': mask} for position, mask in zip(positions, masks)]
+
+    def store(self, camera_name, frame, object_results):
+        """ save segmentation [object_results] of (RGB) [frame] as entry of camera """
+
+        if self.mode == 'off':
+            return
+
+        reference = get_reference_frame(frame)
+        masks = [object_result['mask'] for object_result in object_results]
+        mask_bits = {'mask_bits_{}'.format(i): mask.bits for i, mask in enumerate(masks)}
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, version=SEGMENTATION_CACHE_VERSION, fingerprint=get_fingerprint(reference), reference=reference,
+                            positions=np.array([object_result['position'] for object_result in object_results], dtype=np.float64).reshape(-1, 4),
+                            mask_shape=np.array(frame.shape[:2]), mask_bboxes=np.array([mask.bbox for mask in masks], dtype=np.int64).reshape(-1, 4),
+                            **mask_bits)
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        cache_path = self.get_cache_path(camera_name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_folder, prefix=camera_name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(buffer.getvalue())
+            os.chmod(tmp_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
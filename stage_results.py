@@ -0,0 +1,99 @@
+import json
+import os
+import stat
+
+from frame_cache import json_default
+
+""" per-video store of the segmentation/OCR stage results of each analyzed trial, so later stages can be re-run alone
+(ex. only DLC after exporting a new modelinfo['dlctm'] model) without re-running LED/TM detection, OCR and coat recognition.
+
+For every trial the store keeps the frame indices, DLC motion-skip flags, timestamps per frame, trial datetime,
+coat prediction, edge case and the LED/TM positions used for the training module crop. It is written as a single
+JSON file per video when the video is closed:
+    <stage_results_folder>/<video_file_name>.json
+The file is written to a temporary file and renamed, a store from an incomplete analysis is never read """
+
+# bump when content of store changes (older stores are ignored)
+STAGE_RESULTS_VERSION = 2
+
+# stages of training module pipeline that can be run
+#   'all': segmentation (LED/TM detection), OCR, coat recognition and DLC, segmentation/OCR results are stored
+#   'dlc': only DLC (mouse pose) on the trial frames of the stored results
+PIPELINE_STAGES = ['all', 'dlc']
+
+
+def get_stage_results_path(stage_results_folder, video_file_name):
+    """ path to stage results of video """
+    return os.path.join(stage_results_folder, video_file_name + '.json')
+
+
+def stage_results_exist(stage_results_folder, video_file_name):
+    """ check if stage results of current version exist for video """
+
+    results_path = get_stage_results_path(stage_results_folder, video_file_name)
+    if not os.path.isfile(results_path):
+        return False
+    try:
+        with open(results_path) as fp:
+            return json.load(fp).get('version') == STAGE_RESULTS_VERSION
+    except ValueError:
+        return False
+
+
+class StageResultsWriter():
+    def __init__(self, stage_results_folder, video_file_name):
+        """ collect segmentation/OCR results of trials while a video is analyzed, written on close """
+
+        self.results_path = get_stage_results_path(stage_results_folder, video_file_name)
+        self.trials = []
+
+    def add_trial(self, trial_datetime, timestamps_ms, frame_indices, motion_skips, edge_case, mousecoatcolor, led_position,
+                  tm_markers, original_tm_position, padding_for_aspect_ratio):
+        """ add results of a trial (timestamps_ms: timestamp of each frame in milliseconds since epoch) """
+
+        if not (len(timestamps_ms) == len(frame_indices) == len(motion_skips)):
+            raise ValueError('Number of timestamps, frame indices and motion skips of trial must be equal.')
+
+        self.trials.append({
+            'trial_datetime': trial_datetime,
+            'timestamps_ms': timestamps_ms,
+            'frame_indices': frame_indices,
+            'motion_skips': motion_skips,
+            'edge_case': edge_case,
+            'mousecoatcolor': mousecoatcolor,
+            'led_position': led_position,
+            'tm_markers': tm_markers,
+            'original_tm_position': original_tm_position,
+            'padding_for_aspect_ratio': padding_for_aspect_ratio,
+        })
+
+    def close(self, video_info):
+        """ write results of all trials """
+
+        results = {'version': STAGE_RESULTS_VERSION, 'video': video_info, 'trials': self.trials}
+        os.makedirs(os.path.dirname(self.results_path), exist_ok=True)
+        tmp_path = self.results_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(results, fp, default=json_default)
+        os.replace(tmp_path, self.results_path)
+        os.chmod(self.results_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        print("Saved stage results of {} trials to {}".format(len(self.trials), self.results_path))
+
+
+class StageResults():
+    def __init__(self, stage_results_folder, video_file_name):
+        """ stored segmentation/OCR results of a video """
+
+        self.results_path = get_stage_results_path(stage_results_folder, video_file_name)
+
+        with open(self.results_path) as fp:
+            results = json.load(fp)
+        if results.get('version') != STAGE_RESULTS_VERSION:
+            raise ValueError('Stage results {} have version {}, expected {}'.format(self.results_path, results.get('version'), STAGE_RESULTS_VERSION))
+
+        self.video_info = results['video']
+        self.trials = results['trials']
+
+    def get_trial(self, trial_idx):
+        """ results of trial """
+        return dict(self.trials[trial_idx])
@@ -0,0 +1,41 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models'))
+from dlclive.onnx_export import convert_to_onnx
+
+""" Convert exported DeepLabCut models (frozen .pb graphs) to ONNX so they can be run with
+DLCLive(model_type="onnx") / training_module_wrapper.py --dlc_model_type onnx.
+By default the .onnx file is saved next to the .pb file in the exported model folder, which is
+where DLCLive looks for it. The batch dimension of the converted model is dynamic.
+
+Example of running Python script:
+python convert_dlc_to_onnx.py -mp exported-models/DLC_trainingmodule_black_v6 exported-models/DLC_trainingmodule_v4_white """
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Convert exported DLC models to ONNX",
+        epilog="python convert_dlc_to_onnx.py -mp model/folder"
+    )
+    parser.add_argument("--model_paths", '-mp', nargs="+", required=True, help='list of exported DLC model folders.')
+    parser.add_argument("--output_folder", '-of', required=False, default=None, help='folder to save .onnx files (default: model folder).')
+    parser.add_argument("--opset", '-op', type=int, required=False, default=11, help='ONNX opset version.')
+    args = parser.parse_args()
+    return args.model_paths, args.output_folder, args.opset
+
+
+if __name__ == "__main__":
+
+    model_paths, output_folder, opset = get_args()
+
+    for model_path in model_paths:
+        model_name = os.path.basename(os.path.normpath(model_path))
+        save_folder = output_folder if output_folder else model_path
+        os.makedirs(save_folder, exist_ok=True)
+        onnx_file = os.path.join(save_folder, model_name + ".onnx")
+
+        convert_to_onnx(model_path, onnx_file=onnx_file, opset=opset)
+        print("{} created.".format(onnx_file))
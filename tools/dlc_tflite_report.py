@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models'))
+from dlclive.dlclive import DLCLive
+
+""" Compare the speed and accuracy of tensorflow lite (FP32/FP16/INT8) DeepLabCut inference against
+the 'base' tensorflow model on a reference clip. Useful to decide whether quantized CPU inference
+is accurate enough for the SCC nodes (CPU-only).
+
+Frames are resized to 640x360 (same as TrainingModuleAnalysis.process_frame), optionally cropped to
+the training module position and resized to the 400x300 frames the mouse pose models were trained on.
+
+Example of running Python script:
+python dlc_tflite_report.py -mp path/to/exported-model -v reference_clip.mp4 -tm 0.25 0 0.45 0.8 -o report.json """
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Accuracy-vs-speed report of tflite DLC inference against the base model",
+        epilog="python dlc_tflite_report.py -mp model/folder -v clip.mp4"
+    )
+    parser.add_argument("--model_path", '-mp', required=True, help='path to exported DLC model folder.')
+    parser.add_argument("--video_path", '-v', required=True, help='path to reference clip.')
+    parser.add_argument("--tm_position", '-tm', nargs=4, type=float, required=False, default=None,
+                        help='normalized training module position (x y w h) used to crop frames.')
+    parser.add_argument("--max_frames", '-mf', type=int, required=False, default=300, help='max number of frames to use from clip.')
+    parser.add_argument("--calibration_frames", '-cf', type=int, required=False, default=50, help='number of frames used to calibrate INT8 quantization.')
+    parser.add_argument("--precisions", '-p', nargs="+", required=False, default=["FP32", "FP16", "INT8"], help='tflite precisions to compare.')
+    parser.add_argument("--num_threads", '-nt', type=int, required=False, default=None, help='number of tflite interpreter threads.')
+    parser.add_argument("--pcutoff", '-pc', type=float, required=False, default=0.4, help='likelihood cutoff for keypoint error.')
+    parser.add_argument("--output", '-o', required=False, default=None, help='path to save report as JSON.')
+    args = parser.parse_args()
+    return args
+
+
+def load_reference_frames(video_path, tm_position, max_frames):
+    """ read frames from reference clip and crop them like the training module analysis """
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError('Video {} could not be opened.'.format(video_path))
+
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame = cv2.resize(frame, (640, 360))
+        if tm_position is not None:
+            height, width = frame.shape[:2]
+            x, y, w, h = tm_position
+            x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
+            frame = frame[y:y+h, x:x+w]
+        frames.append(cv2.resize(frame, (400, 300)))
+    cap.release()
+
+    if len(frames) == 0:
+        raise ValueError('No frames read from {}'.format(video_path))
+
+    return np.array(frames)
+
+
+def run_model(dlc, frames):
+    """ run inference on all frames, return poses and per-frame latency (sec) """
+
+    poses, latencies = [], []
+    for frame in frames:
+        start = time.time()
+        pose = dlc.get_pose(np.array([frame]))
+        latencies.append(time.time() - start)
+        poses.append(pose)
+    return np.array(poses), np.array(latencies)
+
+
+def summarize(name, init_time, poses, latencies, base_poses, pcutoff):
+    """ speed and accuracy metrics of a model variant relative to the base model """
+
+    summary = {
+        'model': name,
+        'init_time_sec': round(init_time, 3),
+        'mean_latency_ms': round(float(np.mean(latencies)) * 1000, 3),
+        'median_latency_ms': round(float(np.median(latencies)) * 1000, 3),
+        'fps': round(1.0 / float(np.mean(latencies)), 2),
+    }
+
+    if base_poses is not None:
+        # euclidean keypoint error only for keypoints the base model is confident in
+        valid = base_poses[:, :, 2] >= pcutoff
+        errors = np.linalg.norm(poses[:, :, :2] - base_poses[:, :, :2], axis=2)
+        summary['mean_error_px'] = round(float(np.mean(errors[valid])), 3) if np.any(valid) else None
+        summary['max_error_px'] = round(float(np.max(errors[valid])), 3) if np.any(valid) else None
+        summary['mean_likelihood_diff'] = round(float(np.mean(np.abs(poses[:, :, 2] - base_poses[:, :, 2]))), 4)
+
+    return summary
+
+
+if __name__ == "__main__":
+
+    args = get_args()
+
+    frames = load_reference_frames(args.video_path, args.tm_position, args.max_frames)
+    print("Loaded {} reference frames from {}".format(len(frames), os.path.basename(args.video_path)))
+
+    # sample calibration frames evenly throughout the clip
+    calibration_idx = np.linspace(0, len(frames) - 1, num=min(args.calibration_frames, len(frames))).astype(int)
+    calibration_frames = frames[calibration_idx]
+
+    report = []
+
+    # base tensorflow model used as reference
+    start = time.time()
+    base = DLCLive(args.model_path, model_type="base", display=False)
+    base.init_inference(frames[:1])
+    base_init_time = time.time() - start
+    base_poses, base_latencies = run_model(base, frames)
+    base.close()
+    report.append(summarize("base", base_init_time, base_poses, base_latencies, None, args.pcutoff))
+
+    for precision in args.precisions:
+        start = time.time()
+        tflite = DLCLive(args.model_path, model_type="tflite", precision=precision, display=False,
+                         calibration_frames=calibration_frames, num_threads=args.num_threads)
+        tflite.init_inference(frames[:1])
+        init_time = time.time() - start
+        poses, latencies = run_model(tflite, frames)
+        tflite.close()
+        report.append(summarize("tflite_" + precision, init_time, poses, latencies, base_poses, args.pcutoff))
+
+    # print report
+    columns = ['model', 'init_time_sec', 'mean_latency_ms', 'median_latency_ms', 'fps',
+               'mean_error_px', 'max_error_px', 'mean_likelihood_diff']
+    print("\n" + " | ".join(columns))
+    for summary in report:
+        print(" | ".join(str(summary.get(col, '-')) for col in columns))
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+        print("{} created.".format(args.output))
@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hdf5_output import export_matfiles
+
+""" Export per-trial .mat files (same contents as training_module_analysis.py saves with --output_format mat)
+from the consolidated HDF5 file of a video (training_module_wrapper.py --output_format hdf5).
+
+Example of running Python script:
+python export_matfiles.py -h5 trainingmodule_hdf5/TM_6.20220310_190000.h5 -mf matfiles/TM_6.20220310_190000 -ti 0 1 2 """
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Export .mat files from HDF5 output of a video",
+        epilog="python export_matfiles.py -h5 video.h5 -mf mat/folder"
+    )
+    parser.add_argument("--hdf5_paths", '-h5', nargs="+", required=True, help='list of HDF5 files of videos.')
+    parser.add_argument("--mat_folder", '-mf', required=True, help='folder to save .mat files (one subfolder per video if several HDF5 files).')
+    parser.add_argument("--trial_indices", '-ti', type=int, nargs="+", required=False, default=None, help='trials to export (default: all).')
+    args = parser.parse_args()
+    return args.hdf5_paths, args.mat_folder, args.trial_indices
+
+
+if __name__ == "__main__":
+
+    hdf5_paths, mat_folder, trial_indices = get_args()
+
+    for hdf5_path in hdf5_paths:
+        video_file_name = os.path.splitext(os.path.basename(hdf5_path))[0]
+        save_folder = os.path.join(mat_folder, video_file_name) if len(hdf5_paths) > 1 else mat_folder
+
+        mat_filepaths = export_matfiles(hdf5_path, save_folder, trial_indices=trial_indices)
+        print("Exported {} .mat files of {} to {}".format(len(mat_filepaths), video_file_name, save_folder))
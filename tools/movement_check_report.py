@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import sys
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models.led_tracker import led_movement_check, get_movement_crop_size
+
+""" Compare camera movement decisions (led_movement_check around the LED) of decoded 640x360 frames against the
+decisions on native resolution frames (analysis before frames were decoded at 640x360), on a reference clip:
+    native          native frames, threshold 50 (reference, analysis of native frames is unchanged)
+    area_scaled     640x360 frames, threshold scaled by area (ex. 50 * 640*360 / (1280*720) = 12.5)
+    crop_resized    640x360 frames, LED crops resized to their size at native resolution, threshold 50 (current analysis)
+Use clips with known camera bumps/occlusions and LED status changes to validate the threshold before changing it.
+
+Example of running Python script:
+python movement_check_report.py -v reference_clip.mp4 -led 0.05 0.05 0.04 0.07 -o report.json """
+
+CAMERA_MOVEMENT_THRESH = 50
+DECODED_RESOLUTION = (640, 360)
+
+
+def get_args():
+    """ gets arguments from command line """
+    parser = argparse.ArgumentParser(
+        description="Agreement of camera movement checks on decoded frames with checks on native frames",
+        epilog="python movement_check_report.py -v clip.mp4 -led 0.05 0.05 0.04 0.07"
+    )
+    parser.add_argument("--video_path", '-v', required=True, help='path to reference clip.')
+    parser.add_argument("--led_position", '-led', nargs=4, type=float, required=True, help='normalized LED position (x y w h).')
+    parser.add_argument("--max_frames", '-mf', type=int, required=False, default=3000, help='max number of frames to use from clip.')
+    parser.add_argument("--step", '-s', type=int, required=False, default=1, help='compare frames [step] frames apart.')
+    parser.add_argument("--output", '-o', required=False, default=None, help='path to save report as JSON.')
+    return parser.parse_args()
+
+
+def movement_decisions(video_path, led_position, max_frames, step):
+    """ changed pixel counts of each method for frame pairs [step] frames apart, returns {method: array}, frame indices """
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError('Video {} could not be opened.'.format(video_path))
+
+    resolution = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    area_thresh = CAMERA_MOVEMENT_THRESH * (DECODED_RESOLUTION[0] * DECODED_RESOLUTION[1]) / (resolution[0] * resolution[1])
+    crop_size = get_movement_crop_size(led_position, resolution)
+
+    native, decoded, counts, frame_indices = [], [], {'native': [], 'area_scaled': [], 'crop_resized': []}, []
+    frame_idx = -1
+    while frame_idx + 1 < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_idx += 1
+        native.append(frame)
+        decoded.append(cv2.resize(frame, DECODED_RESOLUTION))
+        if len(native) > step:
+            prev_native, prev_decoded = native.pop(0), decoded.pop(0)
+            counts['native'].append(led_movement_check(frame, prev_native, led_position) / CAMERA_MOVEMENT_THRESH)
+            counts['area_scaled'].append(led_movement_check(decoded[-1], prev_decoded, led_position) / area_thresh)
+            counts['crop_resized'].append(led_movement_check(decoded[-1], prev_decoded, led_position, crop_size=crop_size) / CAMERA_MOVEMENT_THRESH)
+            frame_indices.append(frame_idx)
+    cap.release()
+
+    # counts relative to threshold of each method (> 1 = camera movement)
+    return {method: np.array(values) for method, values in counts.items()}, frame_indices
+
+
+if __name__ == '__main__':
+
+    args = get_args()
+    ratios, frame_indices = movement_decisions(args.video_path, tuple(args.led_position), args.max_frames, args.step)
+    reference = ratios['native'] > 1
+
+    report = {'video': os.path.basename(args.video_path), 'led_position': args.led_position, 'step': args.step,
+              'frame_pairs': len(frame_indices), 'native_movements': int(reference.sum()), 'methods': {}}
+    for method in ['area_scaled', 'crop_resized']:
+        decisions = ratios[method] > 1
+        report['methods'][method] = {
+            'movements': int(decisions.sum()),
+            'agreement': float((decisions == reference).mean()) if len(decisions) else None,
+            'missed': [frame_indices[i] for i in np.flatnonzero(reference & ~decisions)],
+            'extra': [frame_indices[i] for i in np.flatnonzero(decisions & ~reference)],
+        }
+
+    print(json.dumps(report, indent=1))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=1)
@@ -1,12 +1,10 @@
 from chenlabpylib import chenlab_filepaths
 import cv2
 import datetime
-import gc
 import math
 import numpy as np
 import os
 import pandas as pd
-from scipy.io import savemat
 import shutil
 import sys
 import stat
@@ -14,13 +12,46 @@ import time
 import traceback
 import utils
 
+from frame_source import open_frame_source, ANALYSIS_RESOLUTION
+from frame_cache import FrameCache, FrameCacheWriter, cache_exists
+from hdf5_output import HDF5TrialWriter, OUTPUT_FORMATS
+from instrumentation import VideoMetrics
+from mat_writer import AsyncMatWriter
+from trial_record import TrialRecord
+from stage_results import StageResults, StageResultsWriter, stage_results_exist, PIPELINE_STAGES
 from paths import folder_paths, modelinfo, led_issue_info
-from models.led_tracker import led_status_check, led_movement_check
-from models.detect_objects import get_object_location
+from models.led_tracker import led_status_check, led_movement_check, get_movement_crop_size
+from models.detect_objects import ObjectDetector
+from roi_calibration import RoiCalibrationStore
+from roi_transform import RoiTransform, ROI_SIZE
+from object_localization import localize_objects, sample_frame_indices, LOCALIZATION_NUM_FRAMES, LOCALIZATION_SEC, LOCALIZATION_MIN_CONFIDENCE
+
+# number of changed pixels around the LED (at native resolution) considered camera movement; LED crops of frames decoded
+# below native resolution are resized to their native size before the check, so the threshold and noise suppression are not rescaled
+CAMERA_MOVEMENT_THRESH = 50
+
+# trial-file mode: frames more than PRE_TRIAL_MARGIN_SEC before the next trial are skipped with grab(),
+# skipping only a fraction of the remaining time so dropped frames (fewer frames per second than fps) can't overshoot
+PRE_TRIAL_MARGIN_SEC = 2
+PRE_TRIAL_SKIP_FRACTION = 0.5
+
+# trial-file seek mode: seek TRIAL_SEEK_MARGIN_SEC before the estimated frame of a trial, re-seek if the timestamp
+# read after seeking is past the trial or more than TRIAL_SEEK_MAX_SCAN_SEC before it
+TRIAL_SEEK_MARGIN_SEC = 3
+TRIAL_SEEK_MAX_SCAN_SEC = 10
+TRIAL_SEEK_ATTEMPTS = 5
+
+# LED mode sparse scan: largest step (seconds) between checked frames, LED on periods (trials) and camera bumps shorter
+# than the step can fall between two checked frames and be missed, so the sparse scan is only exact for longer ones
+LED_SCAN_MAX_STEP_SEC = 0.5
 
 
 class TrainingModuleAnalysis():
-    def __init__(self, video_path, mouseposemodels, ocr, mousecoatrecognition, tmdetectionmodel):
+    def __init__(self, video_path, mouseposemodels, ocr, mousecoatrecognition, tmdetectionmodel, leddetectionmodel=None,
+                 decode_backend='opencv', decode_threads=None, hw_decode=False, trial_file_seek=True, led_scan_step=1,
+                 frame_cache='off', frame_cache_folder=None, stages='all', stage_results_folder=None,
+                 output_format='mat', hdf5_folder=None, localization_frames=LOCALIZATION_NUM_FRAMES,
+                 roi_calibration='on', roi_calibration_folder=None):
         """ object for data analysis  """
 
         # full path to video file
@@ -30,9 +61,7 @@ class TrainingModuleAnalysis():
         if not os.path.isfile(self.video_path):
             raise ValueError('Video path {} does not point to a file.'.format(os.path.basename(self.video_path)))
 
-        self.video_file_name = os.path.basename(self.video_path)[:-4]
-        if self.video_file_name[-2:] == "_1":
-            self.video_file_name = self.video_file_name[:-2]
+        self.video_file_name = utils.get_video_file_name(self.video_path)
 
         # path to deeplabcut models
         self.dlc_model_paths = modelinfo['dlctm']['model_paths']
@@ -58,13 +87,72 @@ class TrainingModuleAnalysis():
         # maskrcnn object
         self.tmdetectionmodel = tmdetectionmodel
 
+        # LED detection model object (YOLO if not given)
+        self.leddetectionmodel = leddetectionmodel if leddetectionmodel is not None else ObjectDetector(class_label='LED', confidence_thresh=0.8)
+
+        # video decoding options (see frame_source.py)
+        self.decode_backend = decode_backend
+        self.decode_threads = decode_threads
+        self.hw_decode = hw_decode
+
+        # trial-file mode: seek to trials instead of scanning the whole video
+        self.trial_file_seek = trial_file_seek
+
+        # LED mode: check LED status of every k-th frame while no trial is active (1 = every frame)
+        # not exact: LED on periods and camera bumps shorter than led_scan_step frames can be missed (limited to
+        # LED_SCAN_MAX_STEP_SEC once fps is known), use 1 when every trial must match a full scan
+        self.led_scan_step = max(1, int(led_scan_step))
+
+        # frame cache of trial frames for re-analysis ('off', 'write' or 'read', see frame_cache.py)
+        self.frame_cache = frame_cache
+        self.frame_cache_folder = frame_cache_folder if frame_cache_folder else chenlab_filepaths(path=folder_paths['framecachetm'])
+        self.frame_cache_writer = None
+
+        # pipeline stages to run ('all' or 'dlc', see stage_results.py), segmentation/OCR results are stored when running all stages
+        if stages not in PIPELINE_STAGES:
+            raise ValueError("stages {} is not one of {}".format(stages, PIPELINE_STAGES))
+        self.stages = stages
+        self.stage_results_folder = stage_results_folder if stage_results_folder else chenlab_filepaths(path=folder_paths['stageresultstm'])
+        self.stage_results_writer = None
+
+        # trial data output: one .mat file per trial, one HDF5 file per video (see hdf5_output.py) or both
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("output_format {} is not one of {}".format(output_format, OUTPUT_FORMATS))
+        self.output_format = output_format
+        self.hdf5_folder = hdf5_folder if hdf5_folder else chenlab_filepaths(path=folder_paths['hdf5tm'])
+        self.hdf5_writer = None
+
+        # background writer of .mat files (analysis doesn't wait on the network share)
+        self.mat_writer = None
+
+        # number of frames sampled at the start of the video to locate LED/TM by consensus (0 = first frame where both are detected)
+        self.localization_frames = max(0, int(localization_frames))
+        self.localization_confidence = None
+
+        # stored LED/TM positions of rig, validated on the first frame before running any detector (see roi_calibration.py)
+        if roi_calibration != 'off':
+            roi_calibration_folder = roi_calibration_folder if roi_calibration_folder else chenlab_filepaths(path=folder_paths['roicalibrationtm'])
+            self.roi_calibration = RoiCalibrationStore(store_folder=roi_calibration_folder, mode=roi_calibration)
+        else:
+            self.roi_calibration = None
+
+        # RGB frame the LED/TM positions were last detected in, stored as calibration of rig when the video is complete
+        self.calibration_frame = None
+
+        # crop/pad/resize of TM region, recomputed when the TM position changes (see roi_transform.py)
+        self.roi_transform = None
+
         self.dlc_total_time = 0
 
+        # per-stage timings and counters
+        self.metrics = VideoMetrics()
+
     def init_video_data(self):
         """ initialize video data """
 
-        # open video file using cv2
-        self.cap = cv2.VideoCapture(self.video_path)
+        # open video file, frames are decoded at analysis resolution
+        self.cap = open_frame_source(self.video_path, backend=self.decode_backend, output_size=ANALYSIS_RESOLUTION,
+                                     num_threads=self.decode_threads, hw_acceleration=self.hw_decode)
 
         # check if video cap opened successfully
         if not self.cap.isOpened():
@@ -72,6 +160,22 @@ class TrainingModuleAnalysis():
         else:
             print('Video {} successfully loaded!'.format(os.path.basename(self.video_path)))
 
+        # camera and rig information from file name
+        self.init_video_info()
+
+        # get metadata of video file
+        self.get_metadata()
+
+        # write trial frames to frame cache
+        if self.frame_cache != 'off':
+            self.frame_cache_writer = FrameCacheWriter(self.frame_cache_folder, self.video_file_name)
+
+        # initilaize object detection
+        self.init_object_detection()
+
+    def init_video_info(self):
+        """ initialize camera and rig information from video file name """
+
         # extract information from file name
         file_info = utils.parse_filename(filename=self.video_file_name)
 
@@ -91,30 +195,111 @@ class TrainingModuleAnalysis():
         self.CAMERA_NAME = self.camera_view + "_" + str(self.training_module_id)  # CAMERA_NAME EX: TM_1, TM_2 ...
 
         # location to save generated trial .mat files
-        self.mat_subfolder_path = utils.create_mat_subfolder(videofilename=self.video_file_name, training_module_id=self.training_module_id,
-                                                             camera_view=self.camera_view, videodatetime=self.videodatetime, cageID="")
-
-        # get metadata of video file
-        self.get_metadata()
-
-        # initilaize object detection
-        self.init_object_detection()
+        if self.output_format != 'hdf5':
+            self.mat_subfolder_path = utils.create_mat_subfolder(videofilename=self.video_file_name, training_module_id=self.training_module_id,
+                                                                 camera_view=self.camera_view, videodatetime=self.videodatetime, cageID="")
 
     def get_metadata(self):
         """ get metadata from video file """
 
-        self.fps = round(self.cap.get(cv2.CAP_PROP_FPS))  # average video fps
-        self.resolution = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))  # (width, height)
+        self.fps = round(self.cap.fps)  # average video fps
+        self.resolution = self.cap.resolution  # native (width, height)
         # estimate number of frames in video
-        self.video_frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.video_frame_count = self.cap.frame_count
+        # camera movement threshold (LED crops at native resolution, see led_movement)
+        self.camera_movement_thresh = CAMERA_MOVEMENT_THRESH
         # keep track of frame index throughout video
         self.frame_idx = -1
 
     def init_object_detection(self):
+        """ locate needed objects for analysis: stored positions of rig if they match the first frame, else consensus of
+        frames sampled at the start of the video, else find first frame that can locate them """
+
+        if self.roi_calibration is not None and self.use_roi_calibration():
+            return
+        if self.localization_frames and self.localize_objects():
+            return
+        self.detect_objects_first_frame()
+
+    def use_roi_calibration(self):
+        """ use stored LED/TM positions of rig if they are valid for first frame of video, returns True if they are used """
+
+        ret, frame = self.read_frame()
+        if not ret:
+            return False
+        rgbframe = self.process_frame(frame.copy())
+        with self.metrics.stage('roi_calibration'):
+            calibration = self.roi_calibration.lookup(camera_name=self.CAMERA_NAME, rgbframe=rgbframe, movement_thresh=self.camera_movement_thresh,
+                                                      resolution=self.resolution)
+        self.seek_frame(0)  # re-read first frame (no seek)
+        if calibration is None:
+            return False
+
+        self.metrics.count('roi_calibration_hits')
+        self.led_position = calibration['led_position']
+        self.tm_dlc_position = calibration['tm_markers']
+        self.original_tm_position = calibration['original_tm_position']
+        self.padding_for_aspect_ratio = calibration['padding_for_aspect_ratio']
+        self.frame_init_cutoff = 0
+        self.prev_frame = frame
+        return True
+
+    def localize_objects(self):
+        """ run LED and TM detection as batches on frames sampled over the first seconds of the video (see object_localization.py)
+        returns True if the objects were located, analysis then starts at the first sampled frame agreeing with the consensus """
+
+        num_frames = LOCALIZATION_SEC * self.fps
+        if self.video_frame_count > 0:
+            num_frames = min(num_frames, self.video_frame_count)
+
+        # decode sampled frames only
+        frames, rgbframes, frame_indices = [], [], []
+        for frame_idx in sample_frame_indices(num_frames, self.localization_frames):
+            self.skip_frames(frame_idx - self.frame_idx - 1)
+            ret, frame = self.read_frame()
+            if not ret:
+                break
+            self.frame_idx += 1
+            frames.append(frame)
+            rgbframes.append(self.process_frame(frame.copy()))
+            frame_indices.append(self.frame_idx)
+
+        localization = None
+        if frames:
+            self.metrics.count('localization_frames', len(frames))
+            # note: position of objects are normalized based on frame resolution
+            with self.metrics.stage('init_detection'):
+                led_positions = self.leddetectionmodel.run_inference_batch([cv2.cvtColor(rgbframe, cv2.COLOR_RGB2GRAY) for rgbframe in rgbframes])
+                tm_detections = self.tmdetectionmodel.run_inference_batch([rgbframe.copy() for rgbframe in rgbframes])
+            localization = localize_objects(led_positions, tm_detections)
+        self.localization_confidence = localization['confidence'] if localization is not None else 0.0
+
+        if localization is None or localization['confidence'] < LOCALIZATION_MIN_CONFIDENCE:
+            print('No consensus of LED/TM positions in {} sampled frames (confidence={:.2f}), searching frame by frame ...'.format(
+                len(frames), self.localization_confidence))
+            self.seek_frame(0)
+            return False
+
+        tm_detection = localization['tm_detection']
+        self.led_position = localization['led_position']
+        self.tm_dlc_position = tm_detection['dlc_marker_positions']
+        self.original_tm_position = tm_detection['original_tm_position']
+        self.padding_for_aspect_ratio = tm_detection['padding_for_aspect_ratio']
+
+        start_idx = frame_indices[localization['sample_idx']]
+        print('ALL objects located by consensus of {} sampled frames (confidence={:.2f}), starting at frame-idx={}!'.format(
+            len(frames), self.localization_confidence, start_idx))
+        self.seek_frame(start_idx)
+        self.frame_init_cutoff = start_idx
+        self.prev_frame = frames[localization['sample_idx']]
+        self.calibration_frame = rgbframes[localization['sample_idx']]
+        return True
+
+    def detect_objects_first_frame(self):
         """ find first frame that can locate needed objects for analysis """
 
         while True:
-            ret, frame = self.cap.read()
+            ret, frame = self.read_frame()
 
             if ret:
                 self.frame_idx += 1
@@ -128,7 +313,8 @@ class TrainingModuleAnalysis():
 
                 # note: position of objects are normalized based on frame resolution
                 gsframe = cv2.cvtColor(rgbframe, cv2.COLOR_RGB2GRAY)
-                self.led_position = get_object_location(gsframe.copy(), 'LED', confidence_thresh=0.8)
+                with self.metrics.stage('init_detection'):
+                    self.led_position = self.leddetectionmodel.run_inference(frame=gsframe.copy())
 
                 # go to next frame if no LED detected in current frame
                 if self.led_position is None:
@@ -136,7 +322,8 @@ class TrainingModuleAnalysis():
                     continue
 
                 # run maskrcnn to get training module position
-                tm_detection = self.tmdetectionmodel.run_inference(frame=rgbframe.copy())
+                with self.metrics.stage('init_detection'):
+                    tm_detection = self.tmdetectionmodel.run_inference(frame=rgbframe.copy())
 
                 # go to next frame if no TM detected in current frame
                 if tm_detection is None:
@@ -149,7 +336,8 @@ class TrainingModuleAnalysis():
                 self.padding_for_aspect_ratio = tm_detection['padding_for_aspect_ratio']
 
                 print('ALL objects detected in frame-idx={} for video!'.format(self.frame_idx))
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frame_idx)
+                self.calibration_frame = rgbframe
+                self.cap.set_position(self.frame_idx)  # re-read detection frame (no seek)
                 self.frame_init_cutoff = self.frame_idx
                 self.frame_idx -= 1
                 self.prev_frame = frame
@@ -160,62 +348,133 @@ class TrainingModuleAnalysis():
 
     def close(self):
         """ close session """
-        self.cap.release()  # release video capture
+        if getattr(self, 'cap', None) is not None:
+            self.cap.release()  # release video capture
+
+        # wait for queued .mat files to be written
+        if self.mat_writer is not None:
+            with self.metrics.stage('savemat_flush'):
+                self.mat_writer.close()
+            for write_time in self.mat_writer.write_times:
+                self.metrics.add_time('savemat', write_time)
+            self.mat_writer = None
+
+        # complete frame cache of video
+        if self.frame_cache_writer is not None:
+            self.frame_cache_writer.close(video_info=self.get_video_info())
+            self.frame_cache_writer = None
+
+        # save segmentation/OCR results of trials
+        if self.stage_results_writer is not None:
+            self.stage_results_writer.close(video_info=self.get_video_info())
+            self.stage_results_writer = None
+
+        # complete HDF5 output of video
+        if self.hdf5_writer is not None:
+            self.hdf5_writer.close()
+            self.hdf5_writer = None
+
+        # update stored LED/TM positions of rig with the last detected positions
+        if self.roi_calibration is not None and self.calibration_frame is not None:
+            try:
+                self.roi_calibration.store(camera_name=self.CAMERA_NAME, video_file_name=self.video_file_name, rgbframe=self.calibration_frame,
+                                           led_position=self.led_position, tm_markers=self.tm_dlc_position,
+                                           original_tm_position=self.original_tm_position, padding_for_aspect_ratio=self.padding_for_aspect_ratio)
+            except OSError:
+                print("Unable to save LED/TM positions of camera {}".format(self.CAMERA_NAME))
+            self.calibration_frame = None
+
         # delete video if copied to compute node scratch folder
         if sys.platform == 'linux' and 'scratch' in self.video_path:
             os.remove(self.video_path)
         print("Closing", datetime.datetime.now())
 
+    def get_video_info(self):
+        """ video information saved with frame cache and stage results """
+        return {'video_file_name': self.video_file_name, 'fps': self.fps, 'resolution': self.resolution,
+                'video_frame_count': self.video_frame_count, 'frames_processed': self.frame_idx + 1}
+
+    def read_frame(self):
+        """ read (decode) next frame of video """
+        with self.metrics.stage('decode'):
+            return self.cap.read()
+
+    def skip_frames(self, num_frames):
+        """ skip frames whose pixels are not needed (decode only), returns number of frames skipped """
+        with self.metrics.stage('grab'):
+            skipped = self.cap.skip(num_frames)
+        self.frame_idx += skipped
+        self.metrics.count('decode_skips', skipped)
+        return skipped
+
     def process_frame(self, frame):
         """ preprocess frames to fit training module analysis requirements """
-        frame = cv2.resize(frame, (640, 360))
-        rgbframe = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with self.metrics.stage('process_frame'):
+            if frame.shape[1::-1] != ANALYSIS_RESOLUTION:
+                frame = cv2.resize(frame, ANALYSIS_RESOLUTION)
+            rgbframe = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         return rgbframe
 
-    def run_dlc(self, frame):
-        """ run deeplabcut model inference """
-        height, width = frame.shape[:2]
+    def run_ocr(self, frame):
+        """ run timestamp ocr and count whether tesseract ran or the previous timestamp was reused """
+        with self.metrics.stage('ocr'):
+            ocr_predicted = self.ocr.run_inference(frame=frame)
+        self.metrics.count('ocr_calls' if self.ocr.last_run_ocr else 'ocr_skips')
+        return ocr_predicted
 
-        # crop frame for dlc inference
-        x, y, w, h = self.original_tm_position
-        x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
-        frame = frame[y:y+h, x:x+w]
+    def get_tm_roi(self, frame, out=None):
+        """ crop training module from frame, pad to aspect ratio and resize to 400x300 (DLC and coat recognition input),
+        written to [out] if given """
 
-        if self.padding_for_aspect_ratio[0] == 'y':
-            frame = cv2.copyMakeBorder(frame, self.padding_for_aspect_ratio[1], 0, 0, 0, cv2.BORDER_CONSTANT)  # height padding
-        elif self.padding_for_aspect_ratio[0] == 'x':
-            frame = cv2.copyMakeBorder(frame, 0, 0, 0, self.padding_for_aspect_ratio[1], cv2.BORDER_CONSTANT)  # width padding
+        if self.roi_transform is None or not self.roi_transform.matches(self.original_tm_position, self.padding_for_aspect_ratio, frame.shape):
+            self.roi_transform = RoiTransform(position=self.original_tm_position, padding=self.padding_for_aspect_ratio, frame_shape=frame.shape)
+        return self.roi_transform.apply(frame, out=out)
 
-        # Mouse pose DLC model was trained on 400x300 dim frames
-        frame = cv2.resize(frame, (400, 300))
+    def run_dlc(self, frame):
+        """ run deeplabcut model inference """
+        return self.run_dlc_roi(roi=self.get_tm_roi(frame))
+
+    def run_dlc_roi(self, roi):
+        """ run deeplabcut model inference on 400x300 training module crop """
 
         # mouse pose prediction
-        dlcmarkers = self.mouseposemodels.run_inference(frame=frame, key=self.TRIALDATA['mousecoatcolor']['prediction'])
+        with self.metrics.stage('dlc'):
+            dlcmarkers = self.mouseposemodels.run_inference(frame=np.array(roi), key=self.TRIALDATA.mousecoatcolor['prediction'])
         return dlcmarkers
 
     def run_coat_recognition(self, frame):
         """ run mouse coat recognition model """
-        height, width = frame.shape[:2]
-
-        # crop frame for dlc inference
-        x, y, w, h = self.original_tm_position
-        x, y, w, h = int(x*width), int(y*height), int(w*width), int(h*height)
-        frame = frame[y:y+h, x:x+w]
+        return self.run_coat_recognition_roi(roi=self.get_tm_roi(frame))
 
-        if self.padding_for_aspect_ratio[0] == 'y':
-            frame = cv2.copyMakeBorder(frame, self.padding_for_aspect_ratio[1], 0, 0, 0, cv2.BORDER_CONSTANT)  # height padding
-        elif self.padding_for_aspect_ratio[0] == 'x':
-            frame = cv2.copyMakeBorder(frame, 0, 0, 0, self.padding_for_aspect_ratio[1], cv2.BORDER_CONSTANT)  # width padding
-
-        # DLC model was trained on 400x300 dim frames
-        frame = cv2.resize(frame, (400, 300))
+    def run_coat_recognition_roi(self, roi):
+        """ run mouse coat recognition model on 400x300 training module crop """
 
         # predict mouse coat color
-        mousecoatpredicted, confidence = self.mousecoatrecognition.run_inference(frame=frame)
+        with self.metrics.stage('coat_classification'):
+            mousecoatpredicted, confidence = self.mousecoatrecognition.run_inference(frame=np.array(roi))
         return mousecoatpredicted, confidence
 
-    def init_trial_data(self, frame, frame_idx):
-        """ initialize data for trial
+    def get_timestamp_strip(self, frame):
+        """ crop timestamp of frame (OCR input) """
+        rows, cols = self.ocr.get_timestamp_region(height=frame.shape[0], width=frame.shape[1])
+        return frame[rows, cols]
+
+    def get_timestamp_frame(self, timestamp_strip):
+        """ analysis resolution frame with only the timestamp (OCR input from cached timestamp strip) """
+        frame = np.zeros((ANALYSIS_RESOLUTION[1], ANALYSIS_RESOLUTION[0], 3), dtype=np.uint8)
+        rows, cols = self.ocr.get_timestamp_region(height=frame.shape[0], width=frame.shape[1])
+        frame[rows, cols] = timestamp_strip
+        return frame
+
+    def new_trial_data(self):
+        """ trial information before OCR, coat recognition and DLC """
+
+        return TrialRecord(raw_data=os.path.basename(self.video_path), training_module_id=self.training_module_id,
+                           camera_view=self.camera_view, resolution=self.resolution, fps=self.fps, marker_list=self.body_parts,
+                           tm_markers=self.tm_dlc_position, led_position=self.led_position)
+
+    def init_trial_data(self, frame, frame_idx, roi=None):
+        """ initialize data for trial (roi: cached training module crop of frame for coat recognition)
         return encoding
          0 = successful initialization
         -1 = unsuccessful initialization but continuing attempt to initialize
@@ -223,24 +482,10 @@ class TrainingModuleAnalysis():
         """
 
         # initialize trial information
-        self.TRIALDATA = {
-            'raw_data': os.path.basename(self.video_path),  # basename of video file used
-            'training_module_id': self.training_module_id,
-            'camera_view': self.camera_view,
-            'resolution': self.resolution,
-            'fps': self.fps,
-            'dlcdata': [],  # deeplabcut data
-            'dlc_processed': 0,  # whether pose estimation was run
-            'marker_list': self.body_parts,  # list of labeled markers tracked
-            'tm_markers': self.tm_dlc_position,  # position of markers for tm
-            'timestamp_per_frame': [],  # timestamp for each frame in trial
-            'led_position': self.led_position,  # position of led in frame
-            'edge_case': 0,  # whether trial occurred at the beginning or end of video
-            'frame_indices': [],  # list of frame indices used in video for trial
-        }
+        self.TRIALDATA = self.new_trial_data()
 
         # get timestamp of frame
-        ocr_predicted = self.ocr.run_inference(frame=frame.copy())
+        ocr_predicted = self.run_ocr(frame=frame.copy())
         if ocr_predicted == -1:  # Skipping this frame since no timestamp was recognized in initial frame
             print('Timestamp of frame is blank. Cannot get initial trial timestamp. Skipping to next frame.')
             return -1
@@ -250,90 +495,99 @@ class TrainingModuleAnalysis():
             return -2
 
         # save trial datetime
-        self.TRIALDATA['trial_datetime'] = ocr_predicted.strftime('%m/%d/%Y, %H:%M:%S')
+        self.TRIALDATA.trial_datetime = ocr_predicted.strftime('%m/%d/%Y, %H:%M:%S')
 
         # predict coat of mouse in frame
-        mousecoatpredicted, confidence = self.run_coat_recognition(frame=frame.copy())
+        if roi is None:
+            mousecoatpredicted, confidence = self.run_coat_recognition(frame=frame.copy())
+        else:
+            mousecoatpredicted, confidence = self.run_coat_recognition_roi(roi=roi)
 
         # save mouse coat color and DLC model to be used
-        self.TRIALDATA['mousecoatcolor'] = {'prediction': mousecoatpredicted, 'confidence': confidence}
-        self.TRIALDATA['dlc_model_path'] = self.dlc_model_paths[mousecoatpredicted]
+        self.TRIALDATA.mousecoatcolor = {'prediction': mousecoatpredicted, 'confidence': confidence}
+        self.TRIALDATA.dlc_model_path = self.dlc_model_paths[mousecoatpredicted]
 
         print('--- START OF NEW TRIAL ---')
-        print('mouse coat predicted as {} with confidence {}'.format(self.TRIALDATA['mousecoatcolor']['prediction'],
-                                                                     round(self.TRIALDATA['mousecoatcolor']['confidence'], 4)))
-        print('initial trial datetime:', self.TRIALDATA['trial_datetime'])
+        print('mouse coat predicted as {} with confidence {}'.format(self.TRIALDATA.mousecoatcolor['prediction'],
+                                                                     round(self.TRIALDATA.mousecoatcolor['confidence'], 4)))
+        print('initial trial datetime:', self.TRIALDATA.trial_datetime)
         print('frame-idx={}'.format(self.frame_idx))
         return 0
 
     def end_trial(self):
         """ end trial and save data to file """
 
-        # process data collected from trial
-        self.process_trial_data()
+        # trial data with timestamp offsets (sec) from initial trial timestamp
+        trial_data = self.TRIALDATA.to_mat_dict()
 
-        # save trial data to .mat file
-        self.save_to_matfile()
+        # save trial data to .mat file and/or HDF5 file of video
+        if self.output_format != 'hdf5':
+            self.save_to_matfile(trial_data)
+        if self.output_format != 'mat':
+            self.save_to_hdf5(trial_data)
 
-        # reset trial data and call garbage collection
-        self.TRIALDATA = {}
-        gc.collect()
+        # reset trial data (per-frame data are preallocated arrays, no garbage collection needed)
+        self.TRIALDATA = None
         print('----- END OF TRIAL -----\n')
 
+    def led_movement(self, frame, prev_frame):
+        """ number of changed pixels around the LED between decoded frames, LED crops of frames decoded below native
+        resolution are resized to their native size (scale CAMERA_MOVEMENT_THRESH and the noise suppression were tuned at) """
+        if tuple(frame.shape[1::-1]) == tuple(self.resolution):
+            return led_movement_check(frame, prev_frame, self.led_position)
+        return led_movement_check(frame, prev_frame, self.led_position, crop_size=get_movement_crop_size(self.led_position, self.resolution))
+
     def camera_view_unstable(self, frame):
         """ if camera view was blocked or accidentally moved, rerun led and tm detection """
 
         rgbframe = self.process_frame(frame.copy())
         if self.led_position:
-            framedifferencing = led_movement_check(frame, self.prev_frame, self.led_position)  # check if led position has moved
-            if framedifferencing > 50:
-                # ignore if change is just a switch in LED status
-                prev_LED_status = led_status_check(frame=self.process_frame(self.prev_frame.copy()), led_position=self.led_position)
-                curr_LED_status = led_status_check(frame=rgbframe.copy(), led_position=self.led_position)
+            with self.metrics.stage('movement_check'):
+                framedifferencing = self.led_movement(frame, self.prev_frame)  # check if led position has moved
+                if framedifferencing > self.camera_movement_thresh:
+                    # ignore if change is just a switch in LED status
+                    prev_LED_status = led_status_check(frame=self.process_frame(self.prev_frame.copy()), led_position=self.led_position)
+                    curr_LED_status = led_status_check(frame=rgbframe.copy(), led_position=self.led_position)
+            if framedifferencing > self.camera_movement_thresh:
                 if prev_LED_status != curr_LED_status:  # camera view interference is due to LED status change
                     self.prev_frame = frame.copy()
                     return False
                 print("Camera view interference in frame-idx={}. Difference jump = {}. Re-running object detection.".format(self.frame_idx, framedifferencing))
-                self.led_position = get_object_location(cv2.cvtColor(rgbframe.copy(), cv2.COLOR_RGB2GRAY), 'LED', confidence_thresh=0.8)
-                if self.led_position is None:
-                    print("No LED detected in frame-idx={}, skipping to next frame...".format(self.frame_idx))
-                    return True
-                else:
-                    tm_detection = self.tmdetectionmodel.run_inference(frame=rgbframe.copy())
-                    if tm_detection is None:
-                        print('LED detected but no TM detected in frame-idx={}, skipping to next frame...'.format(self.frame_idx))
-                        return True
-                    else:
-                        self.tm_dlc_position = tm_detection['dlc_marker_positions']
-                        self.original_tm_position = tm_detection['original_tm_position']
-                        self.padding_for_aspect_ratio = tm_detection['padding_for_aspect_ratio']
-                        self.prev_frame = frame.copy()
-                        print("Objects re-detected in frame-idx={}".format(self.frame_idx))
-                        return False
+                return self.redetect_objects(frame=frame, rgbframe=rgbframe)
             else:
                 self.prev_frame = frame.copy()
                 return False
         else:
-            self.led_position = get_object_location(cv2.cvtColor(rgbframe.copy(), cv2.COLOR_RGB2GRAY), 'LED', confidence_thresh=0.8)
+            return self.redetect_objects(frame=frame, rgbframe=rgbframe)
+
+    def redetect_objects(self, frame, rgbframe):
+        """ re-run led and tm detection, returns True if objects could not be detected (camera view unstable) """
+
+        self.metrics.count('redetections')
+        with self.metrics.stage('redetection'):
+            self.led_position = self.leddetectionmodel.run_inference(frame=cv2.cvtColor(rgbframe.copy(), cv2.COLOR_RGB2GRAY))
             if self.led_position is None:
                 print("No LED detected in frame-idx={}, skipping to next frame...".format(self.frame_idx))
                 return True
-            else:
-                tm_detection = self.tmdetectionmodel.run_inference(frame=rgbframe.copy())
-                if tm_detection is None:
-                    print('LED detected but no TM detected in frame-idx={}, skipping to next frame...'.format(self.frame_idx))
-                    return True
-                else:
-                    self.tm_dlc_position = tm_detection['dlc_marker_positions']
-                    self.original_tm_position = tm_detection['original_tm_position']
-                    self.padding_for_aspect_ratio = tm_detection['padding_for_aspect_ratio']
-                    self.prev_frame = frame.copy()
-                    print("Objects re-detected in frame-idx={}".format(self.frame_idx))
-                    return False
+            tm_detection = self.tmdetectionmodel.run_inference(frame=rgbframe.copy())
+
+        if tm_detection is None:
+            print('LED detected but no TM detected in frame-idx={}, skipping to next frame...'.format(self.frame_idx))
+            return True
+        else:
+            self.tm_dlc_position = tm_detection['dlc_marker_positions']
+            self.original_tm_position = tm_detection['original_tm_position']
+            self.padding_for_aspect_ratio = tm_detection['padding_for_aspect_ratio']
+            self.prev_frame = frame.copy()
+            self.calibration_frame = rgbframe
+            print("Objects re-detected in frame-idx={}".format(self.frame_idx))
+            return False
 
     def run_analysis(self, BATCH_OF_FRAMES, edge_case=0):
         """ using BATCH_OF_FRAMES, run video analysis (DLC, OCR, ...) """
 
+        self.metrics.start_trial(first_frame_idx=BATCH_OF_FRAMES[0][1], num_frames=len(BATCH_OF_FRAMES), edge_case=edge_case)
+
         # initialize trial
         init_successful = False
         for i in range(len(BATCH_OF_FRAMES)):
@@ -346,54 +600,258 @@ class TrainingModuleAnalysis():
                 break
             elif status_code == -2:  # end trial early
                 del self.TRIALDATA
+                self.metrics.end_trial(status='outside_hours')
                 return
 
         if init_successful is False:  # unable to successfully initialize trial
             print("Unable to sucessfully initialize trial at started in frame-idx={}".format(BATCH_OF_FRAMES[0][1]))
             del self.TRIALDATA
+            self.metrics.end_trial(status='init_failed')
             return
 
-        self.TRIALDATA['edge_case'] = 1 if init_idx == self.frame_init_cutoff else edge_case  # check if trial is edge_case
+        self.TRIALDATA.edge_case = 1 if init_idx == self.frame_init_cutoff else edge_case  # check if trial is edge_case
+
+        trial_frames = [frame for frame, _ in BATCH_OF_FRAMES[init_idx:]]
+        frame_indices = [frame_idx for _, frame_idx in BATCH_OF_FRAMES[init_idx:]]
+
+        # use previous frames dlc results if frame difference is less than 5 pixels (mouse hasn't moved or TM is empty)
+        motion_skips = [False] + [bool(cv2.absdiff(trial_frames[i][:, :, 0], trial_frames[i-1][:, :, 0]).sum() < 5) for i in range(1, len(trial_frames))]
+
+        # DLC input of frames (all frames if trial is written to frame cache), written into one buffer per trial
+        roi_buffer = np.empty((len(trial_frames), ROI_SIZE[1], ROI_SIZE[0]) + trial_frames[0].shape[2:], dtype=trial_frames[0].dtype)
+        rois = [self.get_tm_roi(frame, out=roi_buffer[i]) if (self.frame_cache_writer is not None or not motion_skip) else None
+                for i, (frame, motion_skip) in enumerate(zip(trial_frames, motion_skips))]
+
+        if self.frame_cache_writer is not None:
+            self.frame_cache_writer.add_trial(rois=rois, timestamp_strips=[self.get_timestamp_strip(frame) for frame in trial_frames], info={
+                'frame_indices': frame_indices, 'motion_skips': motion_skips, 'edge_case': self.TRIALDATA.edge_case,
+                'led_position': self.led_position, 'tm_markers': self.tm_dlc_position,
+                'original_tm_position': self.original_tm_position, 'padding_for_aspect_ratio': self.padding_for_aspect_ratio})
+
+        self.run_trial_inference(ocr_frames=trial_frames, rois=rois, motion_skips=motion_skips, frame_indices=frame_indices)
+
+    def run_trial_inference(self, ocr_frames, rois, motion_skips, frame_indices):
+        """ OCR and DLC inference of initialized trial, saves trial data
+        ocr_frames: frames for OCR, rois: DLC input (400x300 crops, None where DLC is skipped), motion_skips: reuse previous DLC result """
+
+        # per-frame data of trial
+        self.TRIALDATA.allocate(num_frames=len(frame_indices))
 
         # OCR inference
-        for i in range(init_idx, len(BATCH_OF_FRAMES)):
+        for i, frame in enumerate(ocr_frames):
             # time.sleep(0.1)
-            frame, frame_idx = BATCH_OF_FRAMES[i]
-            ocr_predicted = self.ocr.run_inference(frame=frame.copy())  # run OCR
+            ocr_predicted = self.run_ocr(frame=frame.copy())  # run OCR
             if ocr_predicted == -1:  # use previous timestamp if ocr is blank in frame or if timestamp in wrong format
-                if i == init_idx:
-                    raise ValueError("Problem initializing trial for frame-idx={}".format(i))
+                if i == 0:
+                    raise ValueError("Problem initializing trial for frame-idx={}".format(frame_indices[i]))
                 print('No timestamp recognized in frame. Using previous frame as timestamp ...')
-                ocr_predicted = self.TRIALDATA['timestamp_per_frame'][-1]
-            self.TRIALDATA['timestamp_per_frame'].append(ocr_predicted)
+                self.TRIALDATA.timestamps_ms[i] = self.TRIALDATA.timestamps_ms[i-1]
+            else:
+                self.TRIALDATA.set_timestamp(i, ocr_predicted)
+
+        # store segmentation/OCR results of trial (re-run of DLC stage only)
+        if self.stage_results_writer is not None:
+            self.stage_results_writer.add_trial(
+                trial_datetime=self.TRIALDATA.trial_datetime, timestamps_ms=self.TRIALDATA.timestamps_ms,
+                frame_indices=frame_indices, motion_skips=motion_skips, edge_case=self.TRIALDATA.edge_case,
+                mousecoatcolor=self.TRIALDATA.mousecoatcolor, led_position=self.led_position, tm_markers=self.tm_dlc_position,
+                original_tm_position=self.original_tm_position, padding_for_aspect_ratio=self.padding_for_aspect_ratio)
+
+        self.run_trial_dlc(rois=rois, motion_skips=motion_skips, frame_indices=frame_indices)
+
+    def run_trial_dlc(self, rois, motion_skips, frame_indices):
+        """ DLC inference of trial with allocated per-frame data and timestamps, saves trial data """
 
         start_time_dlc = time.time()
         # DLC inference
-        prev_dlc_frame, _ = BATCH_OF_FRAMES[init_idx]
-        for i in range(init_idx, len(BATCH_OF_FRAMES)):
+        for i, (roi, motion_skip) in enumerate(zip(rois, motion_skips)):
             # time.sleep(0.1)
-            frame, frame_idx = BATCH_OF_FRAMES[i]
-            # run DLC: use previous frames dlc results if frame difference is less than 5 pixels (mouse hasn't moved or TM is empty)
-            dlcmarkers = self.TRIALDATA['dlcdata'][-1] if ((cv2.absdiff(frame[:, :, 0], prev_dlc_frame[:, :, 0]).sum() < 5) and (i != init_idx)) else self.run_dlc(frame=frame.copy())
-            self.TRIALDATA['dlc_processed'] = 1
-            self.TRIALDATA['dlcdata'].append(dlcmarkers)
-            self.TRIALDATA['frame_indices'].append(frame_idx)  # append frame index
-            prev_dlc_frame = frame.copy()
+            if motion_skip:
+                self.TRIALDATA.set_pose(i, self.TRIALDATA.dlcdata[i-1])
+                self.metrics.count('dlc_motion_skips')
+            else:
+                self.TRIALDATA.set_pose(i, self.run_dlc_roi(roi=roi))
+                self.metrics.count('dlc_inferences')
+        self.TRIALDATA.frame_indices[:] = frame_indices
 
         end_time_dlc = time.time() - start_time_dlc
         self.dlc_total_time += end_time_dlc
 
+        trial_datetime = self.TRIALDATA.trial_datetime
         self.end_trial()
+        self.metrics.end_trial(status='saved', trial_datetime=trial_datetime)
+
+    def run_from_frame_cache(self):
+        """ re-run analysis of all trials (OCR, coat recognition, DLC) on the frame cache of the video, nothing is decoded """
+
+        # initialize start time
+        start_time = time.time()
+
+        cache = FrameCache(self.frame_cache_folder, self.video_file_name)
+        print('Video {} loaded from frame cache ({} trials)'.format(os.path.basename(self.video_path), len(cache.trials)))
+
+        self.init_video_info()
+        self.fps = cache.video_info['fps']
+        self.resolution = tuple(cache.video_info['resolution'])
+        self.video_frame_count = cache.video_info['video_frame_count']
+        self.frame_idx = cache.video_info['frames_processed'] - 1
+        self.metrics.count('cached_frames', cache.num_frames)
+        self.open_hdf5_writer()
+
+        for trial_idx in range(len(cache.trials)):
+            trial = cache.get_trial(trial_idx)
+            frame_indices = trial['frame_indices']
+            self.metrics.start_trial(first_frame_idx=frame_indices[0], num_frames=len(frame_indices), edge_case=trial['edge_case'])
+
+            # object positions of first pass
+            self.led_position = tuple(trial['led_position']) if trial['led_position'] is not None else None
+            self.tm_dlc_position = np.array(trial['tm_markers'])
+            self.original_tm_position = tuple(trial['original_tm_position'])
+            self.padding_for_aspect_ratio = tuple(trial['padding_for_aspect_ratio'])
+
+            # first cached frame of trial is the frame the trial was initialized with
+            ocr_frames = [self.get_timestamp_frame(timestamp_strip) for timestamp_strip in trial['timestamp_strips']]
+            status_code = self.init_trial_data(frame=ocr_frames[0], frame_idx=frame_indices[0], roi=trial['rois'][0])
+            if status_code != 0:
+                del self.TRIALDATA
+                self.metrics.end_trial(status='outside_hours' if status_code == -2 else 'init_failed')
+                continue
+            self.TRIALDATA.edge_case = trial['edge_case']
+
+            self.run_trial_inference(ocr_frames=ocr_frames, rois=trial['rois'], motion_skips=trial['motion_skips'], frame_indices=frame_indices)
+
+        # end time of analysis
+        total_time = str(datetime.timedelta(seconds=int(time.time() - start_time)))
+        print('Elapsed time:', total_time)
+        print('DLC time', self.dlc_total_time)
+        self.close()
+
+    def run_dlc_stage(self):
+        """ re-run only DLC on the trials of the stored segmentation/OCR results of the video (stage_results.py)
+        training module crops are read from the frame cache if it is used and has the trial, otherwise trial frames are decoded """
+
+        if not stage_results_exist(self.stage_results_folder, self.video_file_name):
+            raise ValueError('No stage results for video {} in {}. Run all stages first.'.format(self.video_file_name, self.stage_results_folder))
+
+        # initialize start time
+        start_time = time.time()
+
+        results = StageResults(self.stage_results_folder, self.video_file_name)
+        print('Video {} loaded from stage results ({} trials)'.format(os.path.basename(self.video_path), len(results.trials)))
+
+        self.init_video_info()
+        self.fps = results.video_info['fps']
+        self.resolution = tuple(results.video_info['resolution'])
+        self.video_frame_count = results.video_info['video_frame_count']
+        self.frame_idx = -1
+        self.open_hdf5_writer()
+
+        # cached trials by frame indices
+        cache, cached_trials = None, {}
+        if self.frame_cache == 'read' and cache_exists(self.frame_cache_folder, self.video_file_name):
+            cache = FrameCache(self.frame_cache_folder, self.video_file_name)
+            cached_trials = {tuple(trial['frame_indices']): trial_idx for trial_idx, trial in enumerate(cache.trials)}
+
+        # decode trials that are not cached
+        if any(tuple(trial['frame_indices']) not in cached_trials for trial in results.trials):
+            self.cap = open_frame_source(self.video_path, backend=self.decode_backend, output_size=ANALYSIS_RESOLUTION,
+                                         num_threads=self.decode_threads, hw_acceleration=self.hw_decode)
+            if not self.cap.isOpened():
+                raise IOError('Video {} could not be opened; it may be corrupted.'.format(os.path.basename(self.video_path)))
+            self.cap.load_keyframe_index()
+
+        for trial_idx in range(len(results.trials)):
+            trial = results.get_trial(trial_idx)
+            frame_indices = trial['frame_indices']
+            self.metrics.start_trial(first_frame_idx=frame_indices[0], num_frames=len(frame_indices), edge_case=trial['edge_case'])
+
+            # object positions of segmentation stage
+            self.led_position = tuple(trial['led_position']) if trial['led_position'] is not None else None
+            self.tm_dlc_position = np.array(trial['tm_markers'])
+            self.original_tm_position = tuple(trial['original_tm_position'])
+            self.padding_for_aspect_ratio = tuple(trial['padding_for_aspect_ratio'])
+
+            if tuple(frame_indices) in cached_trials:
+                rois = cache.get_trial(cached_trials[tuple(frame_indices)])['rois']
+                self.metrics.count('cached_frames', len(frame_indices))
+            else:
+                rois = self.decode_trial_rois(frame_indices=frame_indices, motion_skips=trial['motion_skips'])
+                if rois is None:
+                    print('Video ended before last frame of trial {}, skipping trial'.format(trial['trial_datetime']))
+                    self.metrics.end_trial(status='decode_failed')
+                    continue
+
+            # OCR and coat recognition results of trial
+            self.TRIALDATA = self.new_trial_data()
+            self.TRIALDATA.trial_datetime = trial['trial_datetime']
+            self.TRIALDATA.mousecoatcolor = trial['mousecoatcolor']
+            self.TRIALDATA.dlc_model_path = self.dlc_model_paths[trial['mousecoatcolor']['prediction']]
+            self.TRIALDATA.edge_case = trial['edge_case']
+            self.TRIALDATA.allocate(num_frames=len(frame_indices))
+            self.TRIALDATA.timestamps_ms[:] = trial['timestamps_ms']
+            print('--- START OF TRIAL {} (DLC only) ---'.format(trial['trial_datetime']))
+
+            self.run_trial_dlc(rois=rois, motion_skips=trial['motion_skips'], frame_indices=frame_indices)
+
+        # end time of analysis
+        total_time = str(datetime.timedelta(seconds=int(time.time() - start_time)))
+        print('Elapsed time:', total_time)
+        print('DLC time', self.dlc_total_time)
+        self.close()
+
+    def decode_trial_rois(self, frame_indices, motion_skips):
+        """ decode frames [frame_indices] of a trial, returns training module crops (None for motion skips, these frames
+        are not decoded) or None if the video ends before the last frame """
+
+        self.seek_frame(frame_indices[0])
+        rois = []
+        for frame_idx, motion_skip in zip(frame_indices, motion_skips):
+            if motion_skip:
+                rois.append(None)
+                continue
+
+            # skip motion skips and frames without valid timestamp in between
+            num_frames = frame_idx - self.frame_idx - 1
+            if num_frames > 0 and self.skip_frames(num_frames) != num_frames:
+                return None
+
+            ret, frame = self.read_frame()
+            if not ret:
+                return None
+            self.frame_idx += 1
+            rois.append(self.get_tm_roi(self.process_frame(frame=frame)))
+        return rois
 
     def run(self):
         """ run through entire video """
 
+        # background writer of trial .mat files
+        if self.output_format != 'hdf5':
+            self.mat_writer = AsyncMatWriter()
+
+        # re-run only DLC on stored segmentation/OCR results
+        if self.stages == 'dlc':
+            self.run_dlc_stage()
+            return
+
+        # store segmentation/OCR results of trials
+        self.stage_results_writer = StageResultsWriter(self.stage_results_folder, self.video_file_name)
+
+        # re-analysis from frame cache (no video decoding)
+        if self.frame_cache == 'read' and cache_exists(self.frame_cache_folder, self.video_file_name):
+            self.run_from_frame_cache()
+            return
+
         # retrieve initial video data
         self.init_video_data()
+        self.open_hdf5_writer()
 
         # use trial file for runnning analysis instead of relying on LED
         if self.use_trial_csv:
-            self.run_with_trial_file()
+            if self.trial_file_seek:
+                self.run_with_trial_file_seek()
+            else:
+                self.run_with_trial_file()
             return
 
         # initialize start time
@@ -408,8 +866,27 @@ class TrainingModuleAnalysis():
         # batch of frames for trial
         BATCH_OF_FRAMES = []
 
+        # sparse scan: LED status of last checked frame and frame index until which every frame is checked
+        last_led_status = None
+        dense_until_idx = -1
+        max_scan_step = max(1, int(LED_SCAN_MAX_STEP_SEC * self.fps))
+        if self.led_scan_step > max_scan_step:
+            print('(LED SCAN) Step of {} frames is longer than {} s at {} fps, using {} frames'.format(
+                self.led_scan_step, LED_SCAN_MAX_STEP_SEC, self.fps, max_scan_step))
+            self.led_scan_step = max_scan_step
+        if self.led_scan_step > 1:
+            self.cap.load_keyframe_index()
+
         while True:
-            ret, frame = self.cap.read()
+            # sparse scan while LED is off and no trial is active, frames in between are only grabbed
+            if (self.led_scan_step > 1) and (last_led_status == 0) and (self.frame_idx >= dense_until_idx) and \
+                    (self.active_trial is False) and (self.corrupt_status is False):
+                refine_until_idx = self.sparse_led_scan()
+                if refine_until_idx is not None:
+                    dense_until_idx = refine_until_idx
+                continue
+
+            ret, frame = self.read_frame()
 
             if ret:
                 # time.sleep(.005)
@@ -419,6 +896,7 @@ class TrainingModuleAnalysis():
                 if self.active_trial is False:
                     is_camera_unstable = self.camera_view_unstable(frame=frame)
                     if is_camera_unstable is True:
+                        last_led_status = None
                         continue
                     # time.sleep(0.005)
 
@@ -426,7 +904,9 @@ class TrainingModuleAnalysis():
                 rgbframe = self.process_frame(frame=frame.copy())
 
                 # get status of led
-                led_status = led_status_check(frame=rgbframe.copy(), led_position=self.led_position)
+                with self.metrics.stage('led_status'):
+                    led_status = led_status_check(frame=rgbframe.copy(), led_position=self.led_position)
+                last_led_status = led_status
 
                 # run analysis if led status == 1 ("on")
                 if (led_status == 1) and (self.corrupt_status is False):
@@ -456,8 +936,42 @@ class TrainingModuleAnalysis():
                 self.close()
                 break
 
-    def run_with_trial_file(self):
-        """ run through entire video using csv file with trial data """
+    def sparse_led_scan(self):
+        """ check LED status of the frame led_scan_step frames ahead, frames in between are skipped with grab()
+        the LED was off at the previous checked frame (sparse scan only runs then): if it is still off and the camera
+        didn't move between the two checked frames, returns None and the skipped frames are treated as LED off, otherwise
+        moves the video back to the first skipped frame and returns the frame index up to which frames are checked one by one
+        (refined frames are checked like a full scan: LED status and consecutive frame movement check from the previous
+        checked frame on, so an LED edge or camera movement between the checked frames gives the trial frames and frame
+        indices of a full scan)
+        not exact: an LED on period or a camera bump that starts and ends between two checked frames is not seen, so the
+        trial frames can differ from a full scan for LED on periods shorter than led_scan_step frames """
+
+        first_skipped_idx = self.frame_idx + 1
+        ret = self.skip_frames(self.led_scan_step - 1) == self.led_scan_step - 1
+        if ret:
+            ret, frame = self.read_frame()
+
+        if ret:
+            self.frame_idx += 1
+            rgbframe = self.process_frame(frame.copy())
+            with self.metrics.stage('movement_check'):
+                camera_moved = self.led_movement(frame, self.prev_frame) > self.camera_movement_thresh
+            with self.metrics.stage('led_status'):
+                led_status = led_status_check(frame=rgbframe.copy(), led_position=self.led_position)
+
+            if led_status == 0 and not camera_moved:
+                self.prev_frame = frame.copy()
+                return None
+
+        # LED edge, camera movement or end of video between checks: refine frame by frame
+        self.metrics.count('led_scan_refinements')
+        refine_until_idx = max(self.frame_idx, first_skipped_idx)
+        self.seek_frame(first_skipped_idx)
+        return refine_until_idx
+
+    def get_trial_file_trials(self):
+        """ trials of rig csv file close to video datetime, returns trial data and trial datetimes sorted by datetime """
 
         # read csv file for trial data
         # column names ["trial_datetime", "session_datetime", "report_time", "direction_1", "direction_2"]
@@ -474,6 +988,13 @@ class TrainingModuleAnalysis():
 
         # sort list by datetime in ascending order
         filtered_trial_data_list = sorted(filtered_trial_data_list, key=lambda x: x[0])
+        filtered_trial_dt_list = [datetime.datetime.strptime(trial_data[0][:-4], "%Y-%m-%d %H:%M:%S") for trial_data in filtered_trial_data_list]
+        return filtered_trial_data_list, filtered_trial_dt_list
+
+    def run_with_trial_file(self):
+        """ run through entire video using csv file with trial data """
+
+        filtered_trial_data_list, filtered_trial_dt_list = self.get_trial_file_trials()
 
         # if trial was found
         trial_match = False
@@ -484,11 +1005,14 @@ class TrainingModuleAnalysis():
         # previous frames timestamp
         prev_ocr_predicted = None
 
+        # max. expected change (sec) of timestamp to next timestamp (larger after skipping frames)
+        max_tick_sec = 2
+
         # initialize start time
         start_time = time.time()
 
         while True:
-            ret, frame = self.cap.read()
+            ret, frame = self.read_frame()
 
             if ret:
                 self.frame_idx += 1
@@ -497,7 +1021,7 @@ class TrainingModuleAnalysis():
                 rgbframe = self.process_frame(frame=frame.copy())
 
                 # run OCR
-                ocr_predicted = self.ocr.run_inference(frame=rgbframe.copy())
+                ocr_predicted = self.run_ocr(frame=rgbframe.copy())
 
                 # skip if ocr is invalid
                 if ocr_predicted == -1:
@@ -508,10 +1032,12 @@ class TrainingModuleAnalysis():
                         # no need to search if timestamp is the same
                         pass
                     else:
+                        # timestamp advanced as expected (not an OCR misread), safe to skip ahead
+                        regular_tick = prev_ocr_predicted is not None and 0 < (ocr_predicted - prev_ocr_predicted).total_seconds() <= max_tick_sec
+                        max_tick_sec = 2
                         prev_ocr_predicted = ocr_predicted
                         # TODO: Improve - Brute force linear search through all timestamps
-                        for trial_data in filtered_trial_data_list:
-                            trial_dt = datetime.datetime.strptime(trial_data[0][:-4], "%Y-%m-%d %H:%M:%S")
+                        for trial_data, trial_dt in zip(filtered_trial_data_list, filtered_trial_dt_list):
                             if ocr_predicted == trial_dt:
                                 # number of frames to run analysis on (record_time = lenght of time in ms led is on)
                                 recording_time_sec = int(trial_data[2]) / 1000.0  # convert to sec
@@ -520,6 +1046,11 @@ class TrainingModuleAnalysis():
                                 BATCH_OF_FRAMES = []
                                 break
 
+                        # no trial starts in the next seconds, skip frames without processing them
+                        if trial_match is False and regular_tick:
+                            skipped = self.skip_to_next_trial(ocr_predicted, filtered_trial_dt_list)
+                            max_tick_sec += skipped / self.fps / PRE_TRIAL_SKIP_FRACTION
+
                 if trial_match:
                     if len(BATCH_OF_FRAMES) < num_of_frames_for_trial:
                         BATCH_OF_FRAMES.append([rgbframe, self.frame_idx])
@@ -544,30 +1075,185 @@ class TrainingModuleAnalysis():
                 self.close()
                 break
 
-    def process_trial_data(self):
-        """ process the trial data collected before storing as MAT file """
+    def run_with_trial_file_seek(self):
+        """ run analysis of trials in csv file by seeking to the estimated frame of each trial (only trial windows are decoded) """
 
-        # convert dlcdata list to numpy array
-        self.TRIALDATA['dlcdata'] = np.array(self.TRIALDATA['dlcdata'])
+        filtered_trial_data_list, filtered_trial_dt_list = self.get_trial_file_trials()
 
-        # convert list of timestamps into a list of offsets (in seconds) from initial trial timestamp
-        self.TRIALDATA['timestamp_offset_list'] = [self.ocr.get_timestamp_offset(init=self.TRIALDATA['timestamp_per_frame'][0], curr=ocr_timestamp) for ocr_timestamp in self.TRIALDATA['timestamp_per_frame']]
+        # initialize start time
+        start_time = time.time()
 
-        # delete 'timestamp_per_frame' key
-        del self.TRIALDATA['timestamp_per_frame']
+        # keyframe index for exact seeks that decode as few frames as possible
+        with self.metrics.stage('keyframe_index'):
+            keyframe_index = self.cap.load_keyframe_index()
+        print('Keyframe index {}'.format('with {} keyframes'.format(len(self.cap.keyframes)) if keyframe_index else 'unavailable, using decoder seeks'))
+
+        # (frame index, timestamp) of last timestamp read, used to estimate frame index of trials
+        self.seek_anchor = (0, self.videodatetime)
+        self.end_of_video = False
+
+        # timestamp of last frame read, trials starting at or before it have passed
+        last_dt = None
+
+        for trial_data, trial_dt in zip(filtered_trial_data_list, filtered_trial_dt_list):
+            if last_dt is not None and trial_dt <= last_dt:
+                continue
+
+            rgbframe = self.seek_to_trial(trial_dt)
+            last_dt = self.seek_anchor[1]
+            if rgbframe is None:
+                if self.end_of_video:
+                    break
+                continue
+
+            # number of frames to run analysis on (record_time = lenght of time in ms led is on)
+            recording_time_sec = int(trial_data[2]) / 1000.0  # convert to sec
+            num_of_frames_for_trial = math.ceil(recording_time_sec * self.fps)  # get num of frames (round up always)
+
+            BATCH_OF_FRAMES = [[rgbframe, self.frame_idx]]
+            while len(BATCH_OF_FRAMES) < num_of_frames_for_trial:
+                ret, frame = self.read_frame()
+                if not ret:
+                    self.end_of_video = True
+                    break
+                self.frame_idx += 1
 
-    def save_to_matfile(self):
+                # process raw frame and skip frames with invalid ocr (same as full scan)
+                rgbframe = self.process_frame(frame=frame.copy())
+                ocr_predicted = self.run_ocr(frame=rgbframe.copy())
+                if ocr_predicted == -1:
+                    continue
+                self.seek_anchor = (self.frame_idx, ocr_predicted)
+                BATCH_OF_FRAMES.append([rgbframe, self.frame_idx])
+            last_dt = self.seek_anchor[1]
+
+            # analysis (video ends before trial, edge_case = 1)
+            self.run_analysis(BATCH_OF_FRAMES, edge_case=1 if self.end_of_video else 0)
+            if self.end_of_video:
+                break
+
+        # end time of analysis
+        total_time = str(datetime.timedelta(seconds=int(time.time() - start_time)))
+        print('Elapsed time:', total_time)
+        print('DLC time', self.dlc_total_time)
+        self.close()
+
+    def seek_frame(self, frame_idx):
+        """ position video so that the next frame read is [frame_idx] """
+        self.metrics.count('seeks')
+        with self.metrics.stage('seek'):
+            self.cap.set_position(frame_idx)
+        self.frame_idx = frame_idx - 1
+
+    def seek_to_trial(self, trial_dt):
+        """ find first frame with timestamp [trial_dt] by seeking shortly before its estimated frame index and confirming with OCR
+        returns processed frame (frame_idx points to it), None if the trial timestamp is not in the rest of the video """
+
+        # frames before current position were already used
+        floor_idx = self.cap.position
+        margin_sec = TRIAL_SEEK_MARGIN_SEC
+
+        for attempt in range(TRIAL_SEEK_ATTEMPTS):
+            anchor_idx, anchor_dt = self.seek_anchor
+            target_idx = max(floor_idx, anchor_idx + int(((trial_dt - anchor_dt).total_seconds() - margin_sec) * self.fps))
+            if target_idx != self.cap.position:
+                self.seek_frame(target_idx)
+
+            # timestamp before trial seen since seek (first frame of trial timestamp can be confirmed)
+            seen_before_trial = False
+            while True:
+                ret, frame = self.read_frame()
+                if not ret:
+                    self.end_of_video = True
+                    return None
+                self.frame_idx += 1
+
+                rgbframe = self.process_frame(frame=frame.copy())
+                ocr_predicted = self.run_ocr(frame=rgbframe.copy())
+                if ocr_predicted == -1:
+                    continue
+                self.seek_anchor = (self.frame_idx, ocr_predicted)
+
+                gap_sec = (trial_dt - ocr_predicted).total_seconds()
+                confirmed = seen_before_trial or target_idx <= floor_idx
+                if gap_sec == 0 and confirmed:
+                    return rgbframe
+                if gap_sec < 0 and confirmed:
+                    # timestamp of trial is not in video (before current position or skipped by camera)
+                    return None
+                if gap_sec <= 0:
+                    # seeked past the first frame of trial, seek back further
+                    margin_sec *= 2
+                    break
+                if gap_sec > TRIAL_SEEK_MAX_SCAN_SEC and not seen_before_trial:
+                    # too far before trial, seek forward
+                    break
+                seen_before_trial = True
+
+        print('Unable to locate trial {} after {} seeks, skipping trial'.format(trial_dt, TRIAL_SEEK_ATTEMPTS))
+        return None
+
+    def skip_to_next_trial(self, ocr_predicted, trial_dt_list):
+        """ grab() frames until shortly before the next trial after timestamp [ocr_predicted], returns number of frames skipped """
+
+        next_trial_dt = next((trial_dt for trial_dt in trial_dt_list if trial_dt > ocr_predicted), None)
+        if next_trial_dt is None:
+            # no trials left in video
+            gap_sec = (self.video_frame_count - self.frame_idx) / self.fps + PRE_TRIAL_MARGIN_SEC if self.fps else 0
+        else:
+            gap_sec = (next_trial_dt - ocr_predicted).total_seconds()
+
+        num_frames = int(PRE_TRIAL_SKIP_FRACTION * (gap_sec - PRE_TRIAL_MARGIN_SEC) * self.fps)
+        if num_frames > 0:
+            return self.skip_frames(num_frames)
+        return 0
+
+    def save_to_matfile(self, trial_data):
         """ save results to a single MAT file """
 
-        mat_filename = utils.format_filename(cameraname=self.CAMERA_NAME, datetime_obj=self.TRIALDATA['trial_datetime'], filextension='mat')
+        mat_filename = utils.format_filename(cameraname=self.CAMERA_NAME, datetime_obj=trial_data['trial_datetime'], filextension='mat')
         mat_filepath = os.path.join(self.mat_subfolder_path, mat_filename)
 
-        # save trial data to mat file
-        savemat(mat_filepath, self.TRIALDATA)
+        # queue trial data for background writer (blocks only if the writer is far behind)
+        with self.metrics.stage('savemat_queue'):
+            self.mat_writer.submit(mat_filepath, trial_data)
+        print("Saving trial data to {}".format(mat_filename))
+
+    def open_hdf5_writer(self):
+        """ consolidated output of all trials of video (with video attributes, also written if the video has no trials) """
 
-        # allow rw for everyone
-        os.chmod(mat_filepath, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-        print("Saved trial data to {}".format(mat_filename))
+        if self.output_format == 'mat':
+            return
+        self.hdf5_writer = HDF5TrialWriter(self.hdf5_folder, self.video_file_name, video_info={
+            'raw_data': os.path.basename(self.video_path), 'training_module_id': self.training_module_id, 'camera_view': self.camera_view,
+            'camera_name': self.CAMERA_NAME, 'resolution': self.resolution, 'fps': self.fps, 'marker_list': self.body_parts})
+
+    def save_to_hdf5(self, trial_data):
+        """ append results to HDF5 file of video """
+
+        with self.metrics.stage('savehdf5'):
+            self.hdf5_writer.add_trial(trial_data)
+        print("Appended trial data to {}".format(os.path.basename(self.hdf5_writer.hdf5_path)))
+
+    def get_metrics_record(self, status='complete', error=None):
+        """ structured record of stage timings/counters and video information for this video """
+
+        return self.metrics.to_record(
+            video=self.video_file_name,
+            rig_no=getattr(self, 'training_module_id', None),
+            camera_view=getattr(self, 'camera_view', None),
+            mode=('trial_file_seek' if self.trial_file_seek else 'trial_file') if getattr(self, 'use_trial_csv', False) else 'led',
+            fps=getattr(self, 'fps', None),
+            video_frame_count=getattr(self, 'video_frame_count', None),
+            frames_processed=getattr(self, 'frame_idx', -1) + 1,
+            frame_cache=self.frame_cache,
+            stages=self.stages,
+            output_format=self.output_format,
+            localization_confidence=getattr(self, 'localization_confidence', None),
+            roi_calibration=self.roi_calibration.mode if getattr(self, 'roi_calibration', None) is not None else 'off',
+            status=status,
+            error=error,
+        )
 
     def log_error(self):
         """ log error caught for debugging """
@@ -581,6 +1267,24 @@ class TrainingModuleAnalysis():
         except:
             pass
 
+        # stop writing .mat files before their folder is deleted
+        if self.mat_writer is not None:
+            write_error = self.mat_writer.abort()
+            if write_error is not None:
+                print("Error writing {}: {}".format(*write_error))
+            self.mat_writer = None
+
+        # delete incomplete frame cache
+        if self.frame_cache_writer is not None:
+            self.frame_cache_writer.abort()
+            self.frame_cache_writer = None
+
+        # results of incomplete analysis are not stored
+        self.stage_results_writer = None
+        if self.hdf5_writer is not None:
+            self.hdf5_writer.abort()
+            self.hdf5_writer = None
+
         # parse filename to locate error folder and mat files created
         file_info = utils.parse_filename(filename=self.video_file_name)
 
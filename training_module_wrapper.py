@@ -1,3 +1,4 @@
+import runtime_config  # must be imported before cv2/tensorflow/tesserocr to set thread environment
 import argparse
 import os
 import sys
@@ -5,12 +6,16 @@ import json
 import traceback
 import utils
 import gc
-from paths import modelinfo
+import instrumentation
 from training_module_analysis import TrainingModuleAnalysis
-from models.timestamp_ocr import TimestampOCR
-from models.detect_tm_anchor_pts import DetectTMAnchorPts
-from models.coat_classifier import CoatClassifier
-from models.detect_mouse_pose import DetectMousePose
+from models.backends import load_backends
+from frame_source import FRAME_SOURCE_BACKENDS
+from frame_cache import FRAME_CACHE_MODES, cache_exists
+from stage_results import PIPELINE_STAGES
+from hdf5_output import OUTPUT_FORMATS
+from object_localization import LOCALIZATION_NUM_FRAMES
+from roi_calibration import ROI_CALIBRATION_MODES
+from paths import folder_paths
 from chenlabpylib import chenlab_filepaths, send_slack_notification
 
 
@@ -23,13 +28,63 @@ def get_args():
     # required argument
     parser.add_argument("--json_file_name", '-jfn', required=False, help='name of json file with video paths.')
     parser.add_argument("--task_array", '-ta', required=False, help='boolean to determine script is submitted as job aray or single job')
+    parser.add_argument("--dlc_model_type", '-dmt', required=False, default="base", choices=["base", "tflite", "tensorrt", "onnx"],
+                        help='inference backend for the DLC pose and TM anchor models')
+    parser.add_argument("--num_threads", '-nt', type=int, required=False, default=None, help='number of inference threads (default: $NSLOTS)')
+    parser.add_argument("--cpu_affinity", '-ca', required=False, default=None, help='cpu list to pin worker to (ex. "0-3")')
+    parser.add_argument("--metrics_file", '-mf', required=False, default=None, help='path to JSON-lines metrics file (default: next to SGE job log)')
+    parser.add_argument("--backend_profile", "--backend-profile", '-bp', required=False, default="real",
+                        help='model backends: real, stub, stub_cpu or path to JSON profile (see models/backends.py)')
+    parser.add_argument("--decode_backend", '-db', required=False, default="opencv", choices=FRAME_SOURCE_BACKENDS,
+                        help='video decoding backend (pyav decodes and scales frames in a single FFmpeg pass)')
+    parser.add_argument("--decode_threads", '-dt', type=int, required=False, default=None, help='number of FFmpeg decoding threads (default: num_threads)')
+    parser.add_argument("--hw_decode", '-hwd', action='store_true', help='use hardware video decoding if available (opencv backend)')
+    parser.add_argument("--trial_file_scan", '-tfs', required=False, default="seek", choices=["seek", "full"],
+                        help='trial-file mode: seek to trials (decode only trial windows) or scan every frame')
+    parser.add_argument("--led_scan_step", '-lss', type=int, required=False, default=1,
+                        help='LED mode: check LED every k-th frame outside of trials and refine edges frame by frame (1 = every frame, exact). Not exact: LED on periods shorter than k frames can be missed, k is limited to 0.5 s of frames')
+    parser.add_argument("--frame_cache", '-fc', required=False, default="off", choices=FRAME_CACHE_MODES,
+                        help='write trial frames to frame cache, or read them (re-analysis without decoding) if the video is cached')
+    parser.add_argument("--frame_cache_folder", '-fcf', required=False, default=None, help="frame cache folder (default: folder_paths['framecachetm'])")
+    parser.add_argument("--stages", '-st', required=False, default="all", choices=PIPELINE_STAGES,
+                        help='run all stages and store segmentation/OCR results, or re-run only DLC on the stored results')
+    parser.add_argument("--stage_results_folder", '-srf', required=False, default=None,
+                        help="folder of stored segmentation/OCR results (default: folder_paths['stageresultstm'])")
+    parser.add_argument("--output_format", '-of', required=False, default="mat", choices=OUTPUT_FORMATS,
+                        help='save trial data as one .mat file per trial, one HDF5 file per video, or both')
+    parser.add_argument("--hdf5_folder", '-hf', required=False, default=None, help="folder of HDF5 files (default: folder_paths['hdf5tm'])")
+    parser.add_argument("--localization_frames", '-lf', type=int, required=False, default=LOCALIZATION_NUM_FRAMES,
+                        help='number of frames sampled over the first seconds to locate LED/TM by consensus (0 = first frame where both are detected)')
+    parser.add_argument("--roi_calibration", '-rc', required=False, default="on", choices=ROI_CALIBRATION_MODES,
+                        help='reuse stored LED/TM positions of rig unless the camera moved, always detect them (refresh) or no store')
+    parser.add_argument("--roi_calibration_folder", '-rcf', required=False, default=None,
+                        help="folder of stored LED/TM positions (default: folder_paths['roicalibrationtm'])")
     args = parser.parse_args()
-    return args.json_file_name, args.task_array
+    return (args.json_file_name, args.task_array, args.dlc_model_type, args.num_threads, args.cpu_affinity, args.metrics_file,
+            args.backend_profile, args.decode_backend, args.decode_threads, args.hw_decode, args.trial_file_scan, args.led_scan_step,
+            args.frame_cache, args.frame_cache_folder, args.stages, args.stage_results_folder,
+            args.output_format, args.hdf5_folder, args.localization_frames,
+            args.roi_calibration, args.roi_calibration_folder)
 
 
 if __name__ == '__main__':
 
-    json_file_name, task_array = get_args()
+    (json_file_name, task_array, dlc_model_type, num_threads, cpu_affinity, metrics_file,
+     backend_profile, decode_backend, decode_threads, hw_decode, trial_file_scan, led_scan_step,
+     frame_cache, frame_cache_folder, stages, stage_results_folder, output_format, hdf5_folder, localization_frames,
+     roi_calibration, roi_calibration_folder) = get_args()
+
+    # configure thread pools of inference engines before loading any models
+    runtime_settings = runtime_config.configure_runtime(num_threads=num_threads, cpu_affinity=cpu_affinity)
+
+    # video decoding settings
+    decode_threads = decode_threads if decode_threads else runtime_settings['opencv_threads']
+    runtime_settings.update({'decode_backend': decode_backend, 'decode_threads': decode_threads, 'hw_decode': hw_decode})
+
+    # per video metrics (stage timings/counters) saved as JSON lines
+    if metrics_file is None:
+        metrics_file = instrumentation.get_metrics_file_path()
+    print("Saving video metrics to", metrics_file)
 
     # load in JSON file
     f = open(json_file_name)
@@ -45,41 +100,61 @@ if __name__ == '__main__':
     # update video paths w/ modified chenlab_filepaths function
     video_path_list = [utils.ospath(path=video_path) for video_path in video_path_list]
 
-    # move video files to scratch folder if on scc
+    # move video files to scratch folder if on scc (cached videos are not decoded)
     if sys.platform == 'linux':
-        video_path_list = utils.move_videos_2_scc_scratch(video_path_list=video_path_list)
-
-    # initialize mouse coat recognition model
-    mousecoatrecognition = CoatClassifier(model_path=chenlab_filepaths(path=modelinfo['coatrecognition']))
-
-    # training module DLC model
-    tmdetectionmodel = DetectTMAnchorPts(model_path=chenlab_filepaths(modelinfo['tmdetection']))
-
-    # initialize tesserocr (optical character recognition) model
-    ocr = TimestampOCR(camera_view='TM', model_path=chenlab_filepaths(path=modelinfo['ocr']))
-
-    # mouse DLC models
-    mouseposemodels = DetectMousePose(model_paths=modelinfo['dlctm']['model_paths'])
+        if frame_cache == 'read':
+            frame_cache_folder = frame_cache_folder if frame_cache_folder else chenlab_filepaths(path=folder_paths['framecachetm'])
+            cached = [cache_exists(frame_cache_folder, utils.get_video_file_name(video_path)) for video_path in video_path_list]
+            scratch_paths = iter(utils.move_videos_2_scc_scratch(video_path_list=[path for path, is_cached in zip(video_path_list, cached) if not is_cached]))
+            video_path_list = [path if is_cached else next(scratch_paths) for path, is_cached in zip(video_path_list, cached)]
+        else:
+            video_path_list = utils.move_videos_2_scc_scratch(video_path_list=video_path_list)
+
+    # initialize models (LED detection, TM DLC model, mouse coat recognition, tesserocr, mouse DLC models)
+    # with real or stub backends
+    backends = load_backends(profile=backend_profile, dlc_model_type=dlc_model_type, camera_view='TM')
 
     # run through all videos in list
     for video_path in video_path_list:
         va_object = None
         print('\n')
         try:
-            va_object = TrainingModuleAnalysis(video_path=video_path, mouseposemodels=mouseposemodels, ocr=ocr,
-                                               mousecoatrecognition=mousecoatrecognition, tmdetectionmodel=tmdetectionmodel)
+            va_object = TrainingModuleAnalysis(video_path=video_path, mouseposemodels=backends['mouse_pose'], ocr=backends['ocr'],
+                                               mousecoatrecognition=backends['coat_classification'],
+                                               tmdetectionmodel=backends['tm_detection'], leddetectionmodel=backends['led_detection'],
+                                               decode_backend=decode_backend, decode_threads=decode_threads, hw_decode=hw_decode,
+                                               trial_file_seek=trial_file_scan == 'seek', led_scan_step=led_scan_step,
+                                               frame_cache=frame_cache, frame_cache_folder=frame_cache_folder,
+                                               stages=stages, stage_results_folder=stage_results_folder,
+                                               output_format=output_format, hdf5_folder=hdf5_folder,
+                                               localization_frames=localization_frames,
+                                               roi_calibration=roi_calibration, roi_calibration_folder=roi_calibration_folder)
             va_object.run()
+            metrics_record = va_object.get_metrics_record(status='complete')
 
             del va_object
         except:
+            error = traceback.format_exc().strip().split('\n')[-1]
             if va_object:
                 # catch any exceptions when running video analysis
                 va_object.log_error()
+                metrics_record = va_object.get_metrics_record(status='error', error=error)
             else:
                 print("Error during initialization of video analysis for {}".format(os.path.basename(video_path)))
                 traceback.print_exc()
+                metrics_record = instrumentation.VideoMetrics().to_record(video=os.path.basename(video_path)[:-4], status='error', error=error)
 
             # send_slack_notification("VIDEOANALYSIS: Error w/ {}".format(os.path.basename(video_path)))
+
+        # save structured metrics of video
+        metrics_record['json_file'] = json_file_name
+        metrics_record['runtime'] = runtime_settings
+        metrics_record['backend_profile'] = backend_profile
+        try:
+            instrumentation.write_record(metrics_record, metrics_file)
+        except OSError:
+            print("Unable to write metrics to", metrics_file)
+
         gc.collect()
     print("Complete.")
     sys.exit()
@@ -0,0 +1,93 @@
+import datetime
+import numpy as np
+
+""" preallocated record of a trial, filled in place during trial inference
+Per-frame data (timestamps as int64 milliseconds since the epoch, frame indices and DLC pose) are numpy arrays sized
+from the number of trial frames instead of Python lists of datetimes, ints and arrays, so no objects are allocated
+per frame and timestamp offsets are computed in a single vectorized step. to_mat_dict() returns the trial data
+fields saved to the .mat files (dlcdata, frame_indices, timestamp_offset_list, ...) """
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_epoch_ms(timestamp):
+    """ milliseconds since epoch of (naive) datetime """
+    return (timestamp - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+class TrialRecord():
+    __slots__ = ['raw_data', 'training_module_id', 'camera_view', 'resolution', 'fps', 'marker_list', 'tm_markers',
+                 'led_position', 'edge_case', 'dlc_processed', 'trial_datetime', 'mousecoatcolor', 'dlc_model_path',
+                 'num_frames', 'timestamps_ms', 'frame_indices', 'dlcdata']
+
+    def __init__(self, raw_data, training_module_id, camera_view, resolution, fps, marker_list, tm_markers, led_position):
+        """ trial information before OCR, coat recognition and DLC """
+
+        self.raw_data = raw_data  # basename of video file used
+        self.training_module_id = training_module_id
+        self.camera_view = camera_view
+        self.resolution = resolution
+        self.fps = fps
+        self.marker_list = marker_list  # list of labeled markers tracked
+        self.tm_markers = tm_markers  # position of markers for tm
+        self.led_position = led_position  # position of led in frame
+        self.edge_case = 0  # whether trial occurred at the beginning or end of video
+        self.dlc_processed = 0  # whether pose estimation was run
+
+        # set when trial is initialized (first timestamp, coat recognition)
+        self.trial_datetime = None
+        self.mousecoatcolor = None
+        self.dlc_model_path = None
+
+        # per-frame data, see allocate()
+        self.num_frames = 0
+        self.timestamps_ms = None
+        self.frame_indices = None
+        self.dlcdata = None
+
+    def allocate(self, num_frames):
+        """ preallocate per-frame data of [num_frames] trial frames (pose array is allocated with shape/dtype of first pose) """
+
+        self.num_frames = num_frames
+        self.timestamps_ms = np.zeros(num_frames, dtype=np.int64)
+        self.frame_indices = np.zeros(num_frames, dtype=np.int64)
+        self.dlcdata = None
+
+    def set_timestamp(self, i, timestamp):
+        """ set timestamp (datetime) of trial frame i """
+        self.timestamps_ms[i] = to_epoch_ms(timestamp)
+
+    def set_pose(self, i, pose):
+        """ set DLC result of trial frame i """
+
+        if self.dlcdata is None:
+            pose = np.asarray(pose)
+            self.dlcdata = np.empty((self.num_frames,) + pose.shape, dtype=pose.dtype)
+        self.dlcdata[i] = pose
+        self.dlc_processed = 1
+
+    def timestamp_offsets(self):
+        """ offset (sec) of timestamp of each frame from first timestamp """
+        return (self.timestamps_ms - self.timestamps_ms[0]) / 1000.0
+
+    def to_mat_dict(self):
+        """ trial data dictionary saved to .mat/HDF5 """
+
+        return {
+            'raw_data': self.raw_data,
+            'training_module_id': self.training_module_id,
+            'camera_view': self.camera_view,
+            'resolution': self.resolution,
+            'fps': self.fps,
+            'dlcdata': self.dlcdata if self.dlcdata is not None else np.array([]),
+            'dlc_processed': self.dlc_processed,
+            'marker_list': self.marker_list,
+            'tm_markers': self.tm_markers,
+            'led_position': self.led_position,
+            'edge_case': self.edge_case,
+            'frame_indices': self.frame_indices,
+            'trial_datetime': self.trial_datetime,
+            'mousecoatcolor': self.mousecoatcolor,
+            'dlc_model_path': self.dlc_model_path,
+            'timestamp_offset_list': self.timestamp_offsets(),
+        }
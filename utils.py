@@ -181,6 +181,15 @@ def get_timestamp_offset(init, curr):
     return diff_in_secs
 
 
+def get_video_file_name(video_path):
+    """ video file name without extension and BlueIris "_1" suffix (ex. /path/TM_6.20220310_190000_1.mp4 -> TM_6.20220310_190000) """
+
+    video_file_name = os.path.basename(video_path)[:-4]
+    if video_file_name[-2:] == "_1":
+        video_file_name = video_file_name[:-2]
+    return video_file_name
+
+
 def parse_filename(filename):
     """ parse video filename
     note: assuming BlueIris videos have filename structure such as: TM_6.20220310_190000.mp4"""